@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark how many concurrent async speech sessions one process can run.
+
+A fake server in a separate process reads each streaming request to the end
+and then replies. In this process, one recorder thread feeds 100 ms chunks
+of audio in real time to every session through an AudioBridge, as the
+recorder does, and each session streams them over one shared grpc.aio
+channel. Reports the time from the end of the audio to the reply, and the
+client's CPU use, for each number of sessions.
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+
+import grpc
+import grpc.aio
+
+sys.path.append(os.path.realpath(os.path.join(__file__, '..', '..')) + '/src/')
+
+import aiy._apis._aio  # noqa
+import aiy._apis._channel  # noqa
+
+METHOD = '/benchmark.Speech/Recognize'
+CHUNK = b'\0' * 3200  # 100 ms of 16 kHz 16-bit audio
+CHUNK_S = 0.1
+
+
+async def recognize(request_iterator, context):
+    size = 0
+    async for request in request_iterator:
+        size += len(request)
+    yield str(size).encode()
+
+
+def serve(port_queue):
+    async def main():
+        server = grpc.aio.server()
+        server.add_generic_rpc_handlers((grpc.method_handlers_generic_handler(
+            'benchmark.Speech', {'Recognize': grpc.stream_stream_rpc_method_handler(recognize)}),))
+        port_queue.put(server.add_insecure_port('localhost:0'))
+        await server.start()
+        await server.wait_for_termination()
+
+    asyncio.run(main())
+
+
+def feed(bridges, chunks):
+    """Feeds audio to every session in real time, like the recorder."""
+    start = time.monotonic()
+    for i in range(chunks):
+        for bridge in bridges:
+            bridge.put(CHUNK)
+        time.sleep(max(0, start + (i + 1) * CHUNK_S - time.monotonic()))
+    end = time.monotonic()
+    for bridge in bridges:
+        bridge.put(None)
+    return end
+
+
+async def session(channel, bridge):
+    call = channel.get().stream_stream(METHOD)(bridge)
+    async for _ in call:
+        pass
+    return time.monotonic()
+
+
+async def run_sessions(channel, count, chunks):
+    bridges = [aiy._apis._aio.AudioBridge() for _ in range(count)]
+    tasks = [asyncio.ensure_future(session(channel, bridge)) for bridge in bridges]
+    loop = asyncio.get_event_loop()
+    end_of_audio = await loop.run_in_executor(None, feed, bridges, chunks)
+    done = await asyncio.gather(*tasks)
+    return sorted(t - end_of_audio for t in done)
+
+
+async def benchmark(port, session_counts, chunks):
+    channel = aiy._apis._aio.AsyncChannel(
+        lambda options: grpc.aio.insecure_channel('localhost:%d' % port, options=options),
+        aiy._apis._channel.keepalive_options())
+    await channel.wait_ready(5)
+    await run_sessions(channel, 1, 1)
+
+    audio_s = chunks * CHUNK_S
+    print('%8s %10s %10s %10s %14s' % ('sessions', 'p50 ms', 'p95 ms', 'max ms', 'client CPU %'))
+    for count in session_counts:
+        cpu = time.process_time()
+        wall = time.monotonic()
+        latencies = await run_sessions(channel, count, chunks)
+        cpu = (time.process_time() - cpu) / (time.monotonic() - wall)
+        print('%8d %10.1f %10.1f %10.1f %14.0f' % (
+            count, latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.95)] * 1000, latencies[-1] * 1000, cpu * 100))
+    print('(%.1f s of audio per session)' % audio_s)
+    await channel.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sessions', default='1,10,50,100,200,500',
+                        help='comma separated numbers of concurrent sessions')
+    parser.add_argument('--audio-s', type=float, default=2.0,
+                        help='seconds of audio per session (default: 2.0)')
+    args = parser.parse_args()
+
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(port_queue,), daemon=True)
+    server.start()
+    port = port_queue.get()
+    try:
+        asyncio.run(benchmark(port, [int(n) for n in args.sessions.split(',')],
+                              int(round(args.audio_s / CHUNK_S))))
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
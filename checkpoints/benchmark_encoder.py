@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark the audio encodings used for speech requests.
+
+Encodes a recorded utterance in 100 ms chunks, as the request stream does,
+and reports the CPU time per second of audio and the bytes uploaded.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.realpath(os.path.join(__file__, '..', '..')) + '/src/')
+
+import aiy._apis._flac as flac  # noqa
+
+SAMPLE_RATE_HZ = 16000
+CHUNK_BYTES = 2 * SAMPLE_RATE_HZ // 10
+
+
+class Linear16Encoder(object):
+
+    def encode(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+ENCODERS = [
+    ('LINEAR16', Linear16Encoder),
+    ('FLAC', lambda: flac.FlacEncoder(SAMPLE_RATE_HZ)),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('file', nargs='?',
+                        default=os.path.join(os.path.dirname(__file__), 'test_hello.raw'),
+                        help='16 kHz 16-bit mono raw audio (default: test_hello.raw)')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='times to encode the file (default: 20)')
+    args = parser.parse_args()
+
+    with open(args.file, 'rb') as f:
+        data = f.read()
+    audio_s = len(data) / (2 * SAMPLE_RATE_HZ)
+    print('%s: %.1f s of audio, %d bytes' % (args.file, audio_s, len(data)))
+
+    for name, make_encoder in ENCODERS:
+        size = 0
+        start = time.process_time()
+        for _ in range(args.repeat):
+            encoder = make_encoder()
+            size = sum(len(encoder.encode(data[i:i + CHUNK_BYTES]))
+                       for i in range(0, len(data), CHUNK_BYTES))
+            size += len(encoder.flush())
+        cpu = (time.process_time() - start) / args.repeat
+        print('%-10s %8d bytes per utterance (%3.0f%%) %8.2f ms CPU per second of audio' % (
+            name, size, size * 100 / len(data), cpu * 1000 / audio_s))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare the Assistant alone with racing Cloud Speech against it.
+
+Stand-ins for the two services answer after a random delay from the end of
+the audio. For local commands, reports the time until the command can run;
+for other requests, the time until the Assistant's response starts playing.
+"""
+
+import argparse
+import collections
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.append(os.path.realpath(os.path.join(__file__, '..', '..')) + '/src/')
+
+import aiy._apis._hedge as hedge  # noqa
+
+Result = collections.namedtuple('Result', ['transcript', 'response_audio'])
+
+
+class StandInRequest(object):
+
+    """Answers latency_s (mean, stddev) after the audio ends, unless it's
+    cancelled first.
+    """
+
+    dialog_follow_on = False
+    last_timing = None
+
+    def __init__(self, latency_s, response_audio=None):
+        self.latency_s = latency_s
+        self.response_audio = response_audio
+        self.transcript = None
+        self.endpointer_cb = None
+        self.response_stream_cb = None
+        self._ended = threading.Event()
+        self._cancelled = threading.Event()
+
+    def set_endpointer_cb(self, cb):
+        self.endpointer_cb = cb
+
+    def set_response_stream_cb(self, cb):
+        self.response_stream_cb = cb
+
+    def reset(self):
+        self._ended.clear()
+        self._cancelled.clear()
+
+    def add_data(self, data):
+        if not data:
+            self._ended.set()
+
+    def end_audio(self):
+        self.add_data(None)
+
+    def cancel(self):
+        self._cancelled.set()
+        self.end_audio()
+
+    def do_request(self):
+        self._ended.wait()
+        if self._cancelled.wait(max(0, random.gauss(*self.latency_s))):
+            return Result(None, None)
+        if self.response_audio and self.response_stream_cb:
+            self.response_stream_cb(self.transcript)
+        return Result(self.transcript, self.response_audio)
+
+
+def run_turn(request, assistant, cloud, transcript, can_handle):
+    """Returns the seconds from the end of the audio until the command runs
+    or the response starts playing.
+    """
+    played = []
+    assistant.set_response_stream_cb(lambda t: played.append(time.monotonic()))
+    if isinstance(request, hedge.HedgedRequest):
+        request.set_response_stream_cb(lambda t: played.append(time.monotonic()))
+
+    request.reset()
+    assistant.transcript = cloud.transcript = transcript
+    request.add_data(b'audio')
+    start = time.monotonic()
+    request.end_audio()
+    result = request.do_request()
+    if result.transcript and can_handle(result.transcript) and not played:
+        return time.monotonic() - start
+    return played[0] - start
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--turns', type=int, default=50,
+                        help='turns of each kind (default: 50)')
+    parser.add_argument('--cloud-speech-ms', type=float, nargs=2, default=[350, 80],
+                        metavar=('MEAN', 'STDDEV'),
+                        help='Cloud Speech final result latency (default: 350 80)')
+    parser.add_argument('--assistant-ms', type=float, nargs=2, default=[1100, 250],
+                        metavar=('MEAN', 'STDDEV'),
+                        help='Assistant response latency (default: 1100 250)')
+    args = parser.parse_args()
+
+    def can_handle(transcript):
+        return 'light' in transcript
+
+    cloud_latency = tuple(ms / 1000 for ms in args.cloud_speech_ms)
+    assistant_latency = tuple(ms / 1000 for ms in args.assistant_ms)
+
+    print('%-10s %-16s %8s %8s' % ('mode', 'turn', 'p50 ms', 'p95 ms'))
+    for mode in ('assistant', 'hedged'):
+        cloud = StandInRequest(cloud_latency)
+        assistant = StandInRequest(assistant_latency, response_audio=b'response')
+        if mode == 'hedged':
+            request = hedge.HedgedRequest(cloud, assistant)
+            request.set_can_handle_cb(can_handle)
+        else:
+            request = assistant
+
+        for kind, transcript in (('local command', 'turn on the light'),
+                                 ('assistant query', 'what is the weather')):
+            latencies = [run_turn(request, assistant, cloud, transcript, can_handle)
+                         for _ in range(args.turns)]
+            print('%-10s %-16s %8.0f %8.0f' % (mode, kind, percentile(latencies, 50) * 1000,
+                                               percentile(latencies, 95) * 1000))
+        if mode == 'hedged':
+            request.reset()
+            print(request.get_hedge_stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark the CPU cost of mixing stereo microphone audio down to mono.
+
+Reports CPU seconds spent per second of 16 kHz stereo audio for each mix
+mode. Python runs the mixer on a single core; set OPENBLAS_NUM_THREADS=1 if
+your numpy build might use more.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.realpath(os.path.join(__file__, '..', '..')) + '/src/')
+
+import aiy._drivers._mixer as mixer  # noqa
+
+SAMPLE_RATE_HZ = 16000
+CHUNK_S = 0.1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seconds', type=float, default=60,
+                        help='seconds of audio to mix (default: 60)')
+    args = parser.parse_args()
+
+    chunk_frames = int(CHUNK_S * SAMPLE_RATE_HZ)
+    chunks = int(args.seconds / CHUNK_S)
+    speech = np.random.RandomState(0).normal(0, 3000, chunk_frames + 3)
+    chunk = np.stack((speech[3:], speech[:-3]), axis=1).astype(np.int16).tobytes()
+    out = bytearray(len(chunk) // 2)
+
+    for mode in mixer.MODES:
+        channel_mixer = mixer.ChannelMixer(2, mode)
+        start = time.process_time()
+        for _ in range(chunks):
+            channel_mixer.mix_into(chunk, out)
+        cpu = time.process_time() - start
+        print('%-14s %8.2f ms CPU per second of audio (%.2f%% of one core)' % (
+            mode, cpu * 1000 / args.seconds, cpu * 100 / args.seconds))
+
+
+if __name__ == '__main__':
+    main()
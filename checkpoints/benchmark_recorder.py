@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark the Recorder capture loop against a fake arecord pipe.
+
+The fake arecord writes silence as fast as the pipe accepts it, so the numbers
+show the CPU cost of the capture loop itself rather than the audio clock.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.realpath(os.path.join(__file__, '..', '..')) + '/src/')
+
+import aiy._drivers._recorder  # noqa
+
+# arecord writes one ALSA period at a time, which is 1024 frames by default.
+FAKE_ARECORD = '''
+import sys
+block = bytes(int(sys.argv[2]))
+remaining = int(sys.argv[1])
+while remaining > 0:
+    remaining -= sys.stdout.buffer.write(block[:remaining])
+'''
+PERIOD_BYTES = 2048
+
+
+class NullProcessor(object):
+
+    def __init__(self):
+        self.bytes = 0
+
+    def add_data(self, data):
+        self.bytes += len(data)
+
+
+def fake_arecord(total_bytes, bufsize=0):
+    return subprocess.Popen(
+        [sys.executable, '-c', FAKE_ARECORD, str(total_bytes), str(PERIOD_BYTES)],
+        stdout=subprocess.PIPE, bufsize=bufsize)
+
+
+def legacy_capture(stream, chunk_bytes, handle_chunk):
+    """The capture loop from before the ring buffer, kept for comparison."""
+    this_chunk = b''
+
+    while True:
+        input_data = stream.read(chunk_bytes)
+        if not input_data:
+            break
+
+        this_chunk += input_data
+        if len(this_chunk) >= chunk_bytes:
+            handle_chunk(this_chunk[:chunk_bytes])
+            this_chunk = this_chunk[chunk_bytes:]
+
+
+def run_legacy(total_bytes):
+    recorder = aiy._drivers._recorder.Recorder()
+    processors = [NullProcessor()]
+
+    def handle_chunk(chunk):
+        for p in processors:
+            p.add_data(chunk)
+
+    # The old loop used a buffered pipe.
+    proc = fake_arecord(total_bytes, bufsize=-1)
+    legacy_capture(proc.stdout, recorder._chunk_bytes, handle_chunk)
+    proc.wait()
+    return processors[0].bytes
+
+
+def run_ring(total_bytes):
+    recorder = aiy._drivers._recorder.Recorder()
+    processor = NullProcessor()
+    recorder.add_processor(processor)
+    proc = fake_arecord(total_bytes)
+    recorder._capture(proc.stdout)
+    proc.wait()
+    return processor.bytes
+
+
+def measure(name, func, total_bytes):
+    start_wall = time.monotonic()
+    start_cpu = time.process_time()
+    handled = func(total_bytes)
+    wall = time.monotonic() - start_wall
+    cpu = time.process_time() - start_cpu
+
+    tracemalloc.start()
+    func(total_bytes)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print('%-8s %10.1f MB/s %10.3f s CPU %10d bytes peak alloc %10d bytes handled' % (
+        name, handled / wall / 1e6, cpu, peak, handled))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seconds', type=float, default=3600,
+                        help='seconds of 16 kHz mono audio to feed (default: 1 hour)')
+    args = parser.parse_args()
+
+    total_bytes = int(args.seconds * 16000) * 2
+    measure('legacy', run_legacy, total_bytes)
+    measure('ring', run_ring, total_bytes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark building the config request that starts each speech request.
+
+Uses the phrases of the app's command set, added twice as main.py did before
+phrases were deduplicated, and compares building the config request for
+every request with reusing the cached one.
+"""
+
+import argparse
+import gettext
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.realpath(os.path.join(__file__, '..', '..')) + '/src/')
+sys.path.append(os.path.realpath(os.path.join(__file__, '..', '..')) + '/tests/')
+
+import aiy._apis._speech as speech  # noqa
+import fakeserver  # noqa
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=2000,
+                        help='config requests to build (default: 2000)')
+    parser.add_argument('--extra-phrases', type=int, default=0,
+                        help='synthetic phrases to add to the command set (default: 0)')
+    args = parser.parse_args()
+
+    gettext.install('voice-recognizer')
+    import action  # noqa
+    actor = action.make_actor(lambda text: None)
+    phrases = actor.get_phrases() * 2 + [
+        'synthetic phrase number %d' % i for i in range(args.extra_phrases)]
+
+    with fakeserver.FakeSpeechServer() as server:
+        request = speech.CloudSpeechRequest(
+            None, fakeserver.fake_credentials(), server.channel_factory())
+        for phrase in phrases:
+            request.add_phrase(phrase)
+
+        def rebuild():
+            request._config_cache.clear()
+            request._start_request_stream()
+
+        def cached():
+            request._start_request_stream()
+
+        config = request._start_request_stream()
+        print('%d phrases added, %d sent, %d bytes serialized' % (
+            len(phrases), len(config.streaming_config.config.speech_context.phrases),
+            config.ByteSize()))
+        for name, func in (('rebuilt', rebuild), ('cached', cached)):
+            per_call_s = min(timeit.repeat(func, number=args.number, repeat=3)) / args.number
+            print('%-8s %8.1f us per request' % (name, per_call_s * 1e6))
+        request._channel.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark streaming format conversion in 100 ms chunks.
+
+Reports how many seconds of audio are converted per CPU second, so anything
+above 1x keeps up with real time.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.realpath(os.path.join(__file__, '..', '..')) + '/src/')
+
+import aiy._drivers._resample as resample  # noqa
+
+CHUNK_S = 0.1
+
+# (description, from rate, to rate, from channels, to channels, from width, to width)
+CONVERSIONS = [
+    ('48k s32 stereo -> 16k s16 mono', 48000, 16000, 2, 1, 4, 2),
+    ('48k s16 mono -> 16k s16 mono', 48000, 16000, 1, 1, 2, 2),
+    ('16k s16 mono -> 48k s16 stereo', 16000, 48000, 1, 2, 2, 2),
+    ('24k s16 mono -> 48k s16 mono', 24000, 48000, 1, 1, 2, 2),
+    ('16k s32 mono -> 16k s16 mono', 16000, 16000, 1, 1, 4, 2),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seconds', type=float, default=60,
+                        help='seconds of audio to convert (default: 60)')
+    args = parser.parse_args()
+
+    random = np.random.RandomState(0)
+    for name, from_rate, to_rate, from_channels, to_channels, from_width, to_width in CONVERSIONS:
+        samples = int(CHUNK_S * from_rate) * from_channels
+        dtype = np.int16 if from_width == 2 else np.int32
+        chunk = random.normal(0, 1000, samples).astype(dtype).tobytes()
+        converter = resample.FormatConverter(
+            from_rate, to_rate, from_channels, to_channels, from_width, to_width)
+
+        start = time.process_time()
+        for _ in range(int(args.seconds / CHUNK_S)):
+            converter.convert(chunk)
+        cpu = time.process_time() - start
+        print('%-32s %8.1fx real time %8.2f%% of one core' % (
+            name, args.seconds / cpu, cpu * 100 / args.seconds))
+
+
+if __name__ == '__main__':
+    main()
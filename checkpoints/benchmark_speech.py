@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark speech requests end to end against local stand-in servers.
+
+Recorded audio is streamed in real time through the real request code to the
+fake Cloud Speech and Assistant servers in tests/fakeserver.py, which
+answer after a scripted latency. With --mode mic, the audio goes through
+SyncMicRecognizer as well, from a stand-in recorder, trigger and player.
+
+Reports the latency from the end of the audio (or the endpointer event, if it
+came first) until the result: the transcript for requests, or the command
+running or the response starting to play for the mic recognizer. Throughput
+is the number of turns per second with --concurrency turns at a time.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+
+import grpc
+
+sys.path.append(os.path.realpath(os.path.join(__file__, '..', '..')) + '/src/')
+sys.path.append(os.path.realpath(os.path.join(__file__, '..', '..')) + '/tests/')
+
+import aiy._apis._speech as speech  # noqa
+import fakeserver  # noqa
+
+CHUNK_S = 0.1
+COMMAND = 'turn on the light'
+QUERY = 'what is the weather'
+
+
+class AudioFeeder(object):
+
+    """Streams recorded audio to a processor in real time, until the audio
+    runs out or the processor is removed, then ends the audio.
+    """
+
+    def __init__(self, audio, speed):
+        self._audio = audio
+        self._speed = speed
+        self._stopped = threading.Event()
+        self.audio_end = None
+
+    def start(self, processor):
+        self._stopped.clear()
+        self.audio_end = None
+        thread = threading.Thread(target=self._feed, args=(processor,))
+        thread.start()
+        return thread
+
+    def stop(self):
+        if not self._stopped.is_set():
+            self.audio_end = time.monotonic()
+            self._stopped.set()
+
+    def _feed(self, processor):
+        chunk_bytes = int(CHUNK_S * speech.AUDIO_SAMPLE_RATE_HZ) * speech.AUDIO_SAMPLE_SIZE
+        interval_s = CHUNK_S / self._speed
+        for i in range(0, len(self._audio), chunk_bytes):
+            if self._stopped.wait(interval_s if i else 0):
+                break
+            processor.add_data(self._audio[i:i + chunk_bytes])
+        self.stop()
+        processor.end_audio()
+
+
+def make_request(api, server):
+    if api == 'cloud':
+        return speech.CloudSpeechRequest(
+            None, fakeserver.fake_credentials(), server.channel_factory())
+    return speech.AssistantSpeechRequest(
+        fakeserver.fake_credentials(), server.channel_factory())
+
+
+def run_requests(args, api, server, audio, turns):
+    """Runs turns requests one after another. Returns their latencies and
+    the number that failed.
+    """
+    request = make_request(api, server)
+    request.set_audio_encoding(args.encoding)
+    feeder = AudioFeeder(audio, args.speed)
+    request.set_endpointer_cb(feeder.stop)
+    latencies = []
+    errors = 0
+    for _ in range(turns):
+        request.reset()
+        thread = feeder.start(request)
+        try:
+            request.do_request()
+            latencies.append(time.monotonic() - feeder.audio_end)
+        except speech.Error:
+            errors += 1
+        thread.join()
+    request._channel.close()
+    return latencies, errors
+
+
+class StandInPlayer(object):
+
+    """Notes when response audio starts playing."""
+
+    def __init__(self, played):
+        self._played = played
+
+    def open_stream(self, sample_rate_hz, bytes_per_sample, trace_turn=None):
+        return self
+
+    def write(self, data):
+        self._played()
+
+    def close(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def play_bytes(self, audio_bytes, sample_width, sample_rate, trace_turn=None):
+        self._played()
+
+
+class StandInActor(object):
+
+    """Handles commands about the light."""
+
+    def __init__(self, handled):
+        self._handled = handled
+
+    def can_handle(self, transcript):
+        return 'light' in transcript
+
+    def handle(self, transcript):
+        if not self.can_handle(transcript):
+            return False
+        self._handled()
+        return True
+
+
+class StandInRecorder(object):
+
+    """Feeds the recorded audio to each processor that is added."""
+
+    def __init__(self, feeder):
+        self.feeder = feeder
+
+    def add_processor(self, processor, preroll=False):
+        self.feeder.start(processor)
+
+    def remove_processor(self, processor):
+        self.feeder.stop()
+
+
+class StandInTrigger(object):
+
+    def __init__(self):
+        self.callback = None
+
+    def set_callback(self, callback):
+        self.callback = callback
+
+    def start(self):
+        pass
+
+
+class StandInStatusUi(object):
+
+    """Notes when the recognizer is ready for the next turn. The trigger is
+    armed during turns too, so that it can cancel them.
+    """
+
+    def __init__(self):
+        self.ready = threading.Event()
+
+    def status(self, status):
+        if status == 'ready':
+            self.ready.set()
+
+
+def run_mic_recognizer(args, api, server, audio, turns):
+    """Runs turns through a SyncMicRecognizer, triggered as soon as it is
+    ready. Returns the latencies until the command runs or the response starts
+    playing, and the number of turns without either.
+    """
+    import aiy.i18n
+    import main  # The app module has more dependencies than the requests.
+
+    # main logs every turn at INFO, which would bury the results.
+    logging.getLogger().setLevel(logging.WARNING)
+    aiy.i18n.set_locale_dir(main.LOCALE_DIR)
+    aiy.i18n.set_language_code('en-US', gettext_install=True)
+    marks = []
+    finished = threading.Event()
+
+    def done():
+        if not marks:
+            marks.append(time.monotonic())
+        finished.set()
+
+    request = make_request(api, server)
+    request.set_audio_encoding(args.encoding)
+    feeder = AudioFeeder(audio, args.speed)
+    triggerer = StandInTrigger()
+    status_ui = StandInStatusUi()
+    mic_recognizer = main.SyncMicRecognizer(
+        StandInActor(done), request, StandInRecorder(feeder), StandInPlayer(done),
+        lambda text: finished.set(), triggerer, status_ui,
+        assistant_always_responds=False)
+    if args.early_action and api == 'cloud':
+        mic_recognizer.enable_early_action(0.8)
+
+    latencies = []
+    errors = 0
+    with mic_recognizer:
+        for _ in range(turns):
+            status_ui.ready.wait()
+            status_ui.ready.clear()
+            del marks[:]
+            finished.clear()
+            triggerer.callback()
+            # The turn is over when the command runs, the response plays or
+            # an error is spoken.
+            finished.wait(speech.GenericSpeechRequest.DEADLINE_SECS)
+            if marks:
+                latencies.append(marks[0] - feeder.audio_end)
+            else:
+                errors += 1
+        # Let the last request finish before the channel closes.
+        status_ui.ready.wait()
+    request._channel.close()
+    return latencies, errors
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run(args, api, audio):
+    transcript = COMMAND if api == 'cloud' else QUERY
+    script = fakeserver.Script(
+        transcript,
+        interim=[(args.endpoint_s * 0.8, COMMAND, 0.9)] if args.endpoint_s else (),
+        endpoint_after_s=args.endpoint_s,
+        # A second of response audio, like a short Assistant answer.
+        response_audio=b'\0' * (2 * speech.AUDIO_SAMPLE_RATE_HZ) if api == 'assistant' else b'',
+        latency_s=args.latency_ms / 1000, jitter_s=args.jitter_ms / 1000,
+        error=grpc.StatusCode.UNAVAILABLE if args.error_rate else None,
+        error_rate=args.error_rate)
+    server_class = (fakeserver.FakeSpeechServer if api == 'cloud'
+                    else fakeserver.FakeAssistantServer)
+    runner = run_mic_recognizer if args.mode == 'mic' else run_requests
+
+    with server_class([script], max_workers=args.concurrency + 4) as server:
+        results = []
+        turns = [args.turns // args.concurrency + (i < args.turns % args.concurrency)
+                 for i in range(args.concurrency)]
+        threads = [threading.Thread(
+            target=lambda n: results.append(runner(args, api, server, audio, n)), args=(n,))
+            for n in turns]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+
+        latencies = [latency for turn_latencies, _ in results for latency in turn_latencies]
+        errors = sum(turn_errors for _, turn_errors in results)
+        upload = sum(len(call.audio) for call in server.calls) / max(1, len(server.calls))
+
+    if latencies:
+        print('%-10s %6d %6d %8.0f %8.0f %8.0f %8.2f %8.1f' % (
+            api, len(latencies), errors,
+            percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000,
+            percentile(latencies, 99) * 1000, len(latencies) / elapsed, upload / 1024))
+    else:
+        print('%-10s %6d %6d' % (api, 0, errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--audio', default=os.path.join(os.path.dirname(__file__),
+                                                        'test_hello.raw'),
+                        help='16 kHz 16-bit mono raw audio (default: test_hello.raw)')
+    parser.add_argument('--api', choices=['cloud', 'assistant', 'both'], default='both',
+                        help='Which fake service to use (default: both)')
+    parser.add_argument('--mode', choices=['request', 'mic'], default='request',
+                        help='Drive the requests directly, or through '
+                        'SyncMicRecognizer (default: request)')
+    parser.add_argument('--turns', type=int, default=20,
+                        help='turns for each API (default: 20)')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='turns at a time, each with its own request (default: 1)')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='how much faster than real time to send audio (default: 1)')
+    parser.add_argument('--encoding', choices=speech.AUDIO_ENCODINGS,
+                        default=speech.DEFAULT_AUDIO_ENCODING,
+                        help='audio encoding to send (default: %(default)s)')
+    parser.add_argument('--latency-ms', type=float, default=300,
+                        help='server latency after the audio ends (default: 300)')
+    parser.add_argument('--jitter-ms', type=float, default=100,
+                        help='random extra server latency, up to this (default: 100)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of calls that fail with UNAVAILABLE (default: 0)')
+    parser.add_argument('--endpoint-s', type=float, default=None,
+                        help='send the endpointer event this long after the audio '
+                        'starts, with an interim result just before (default: at the '
+                        'end of the audio)')
+    parser.add_argument('--early-action', action='store_true',
+                        help='run commands from interim Cloud Speech results, for '
+                        '--mode mic')
+    args = parser.parse_args()
+
+    with open(args.audio, 'rb') as f:
+        audio = f.read()
+
+    print('%d turns of %.1f s of audio, %s mode, %d at a time' % (
+        args.turns, len(audio) / (speech.AUDIO_SAMPLE_SIZE * speech.AUDIO_SAMPLE_RATE_HZ),
+        args.mode, args.concurrency))
+    print('%-10s %6s %6s %8s %8s %8s %8s %8s' % (
+        'api', 'turns', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'turns/s', 'KB up'))
+    for api in (['cloud', 'assistant'] if args.api == 'both' else [args.api]):
+        run(args, api, audio)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,8 +14,12 @@
 # limitations under the License.
 
 """Check that the voiceHAT audio input and output are both working.
+
+If the voice-recognizer service is running with audio-bus = true, this records
+through its audio bus instead of stopping it.
 """
 
+import argparse
 import os
 import subprocess
 import sys
@@ -26,6 +30,7 @@ import traceback
 
 sys.path.append(os.path.realpath(os.path.join(__file__, '..', '..')) + '/src/')
 
+import aiy._drivers._audiobus  # noqa
 import aiy.audio  # noqa
 
 CARDS_PATH = '/proc/asound/cards'
@@ -127,7 +132,7 @@ def check_speaker_works():
     return ask('Did you hear the test sound?')
 
 
-def check_mic_works():
+def check_mic_works(bus_reader=None):
     """Check the microphone records correctly."""
     temp_file, temp_path = tempfile.mkstemp(suffix='.wav')
     os.close(temp_file)
@@ -135,7 +140,10 @@ def check_mic_works():
     try:
         input("When you're ready, press enter and say 'Testing, 1 2 3'...")
         print('Recording...')
-        aiy.audio.record_to_wave(temp_path, RECORD_DURATION_SECONDS)
+        if bus_reader:
+            bus_reader.record_to_wave(temp_path, RECORD_DURATION_SECONDS)
+        else:
+            aiy.audio.record_to_wave(temp_path, RECORD_DURATION_SECONDS)
         print('Playing back recorded audio...')
         aiy.audio.play_wave(temp_path)
     finally:
@@ -147,7 +155,17 @@ def check_mic_works():
     return ask('Did you hear your own voice?')
 
 
-def do_checks():
+def open_audio_bus(path):
+    """Returns a reader for the voice-recognizer's audio bus, or None if it
+    isn't publishing one.
+    """
+    try:
+        return aiy._drivers._audiobus.AudioBusReader(path)
+    except (OSError, aiy._drivers._audiobus.Error):
+        return None
+
+
+def do_checks(bus_reader=None):
     """Run all audio checks and print status."""
     if not check_voicehat_present():
         print(textwrap.fill(
@@ -167,7 +185,7 @@ may be unable to find it. Please try removing other sound drivers."""))
 connected properly."""))
         return
 
-    if not check_mic_works():
+    if not check_mic_works(bus_reader):
         print(textwrap.fill(
             """There may be a problem with your microphone. Check that it's
 connected properly."""))
@@ -178,9 +196,19 @@ connected properly."""))
 
 def main():
     """Run all checks, stopping the voice-recognizer if necessary."""
-    should_restart = stop_service()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--bus-path', default=aiy._drivers._audiobus.DEFAULT_PATH,
+                        help="the voice-recognizer's audio-bus-path (default: %(default)s)")
+    args = parser.parse_args()
+
+    bus_reader = open_audio_bus(args.bus_path) if is_service_active() else None
+    if bus_reader:
+        print('Recording through the voice-recognizer audio bus.')
+        should_restart = False
+    else:
+        should_restart = stop_service()
 
-    do_checks()
+    do_checks(bus_reader)
 
     if should_restart:
         start_service()
@@ -14,15 +14,24 @@
 # limitations under the License.
 
 """Synthetic load test simillar to running the actual app.
+
+If the voice-recognizer service is running with audio-bus = true, this records
+through its audio bus instead of stopping it.
 """
 
+import argparse
 import json
 import os
 import subprocess
+import sys
 import tempfile
 import time
 import traceback
 
+sys.path.append(os.path.realpath(os.path.join(__file__, '..', '..')) + '/src/')
+
+import aiy._drivers._audiobus  # noqa
+
 if os.path.exists('/home/pi/credentials.json'):
     # Legacy fallback: old location of credentials.
     CREDENTIALS_PATH = '/home/pi/credentials.json'
@@ -115,14 +124,27 @@ def play_wav():
                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
 
-def record_wav():
+def open_audio_bus(path):
+    """Returns a reader for the voice-recognizer's audio bus, or None if it
+    isn't publishing one.
+    """
+    try:
+        return aiy._drivers._audiobus.AudioBusReader(path)
+    except (OSError, aiy._drivers._audiobus.Error):
+        return None
+
+
+def record_wav(bus_reader=None):
     """Record a wav file."""
     temp_file, temp_path = tempfile.mkstemp(suffix='.wav')
     os.close(temp_file)
-    subprocess.check_call(
-        [PYTHON3, AUDIO_PY, 'dump', temp_path,
-         '-d', RECORD_DURATION_SECONDS],
-        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if bus_reader:
+        bus_reader.record_to_wave(temp_path, int(RECORD_DURATION_SECONDS))
+    else:
+        subprocess.check_call(
+            [PYTHON3, AUDIO_PY, 'dump', temp_path,
+             '-d', RECORD_DURATION_SECONDS],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     try:
         os.unlink(temp_path)
     except FileNotFoundError:
@@ -134,7 +156,7 @@ def led_status(status):
         led.write(status + '\n')
 
 
-def run_test():
+def run_test(bus_reader=None):
     print('Running test forever - press Ctrl+C to stop...')
     try:
         while True:
@@ -144,7 +166,7 @@ def run_test():
             time.sleep(0.5)
             print('\rrecording  ', end='')
             led_status('thinking')
-            record_wav()
+            record_wav(bus_reader)
             time.sleep(0.5)
             print('\rplaying    ', end='')
             led_status('ready')
@@ -157,6 +179,11 @@ def run_test():
 
 def main():
     """Run all checks and print status."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--bus-path', default=aiy._drivers._audiobus.DEFAULT_PATH,
+                        help="the voice-recognizer's audio-bus-path (default: %(default)s)")
+    args = parser.parse_args()
+
     if not os.path.exists(CREDENTIALS_PATH):
         print(
             """Please follow these instructions to get Google Cloud credentials:
@@ -170,9 +197,14 @@ and save them to""", CREDENTIALS_PATH)
 service credentials.""")
         return
 
-    should_restart = stop_service()
+    bus_reader = open_audio_bus(args.bus_path) if is_service_active() else None
+    if bus_reader:
+        print('Recording through the voice-recognizer audio bus.')
+        should_restart = False
+    else:
+        should_restart = stop_service()
 
-    run_test()
+    run_test(bus_reader)
 
     if should_restart:
         start_service()
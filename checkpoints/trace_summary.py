@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Summarize a turn trace written by main.py --trace-file.
+
+For each stage of a turn, prints the p50, p95 and p99 of the time from the
+trigger, and of the time since the previous stage that the turn reached.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(os.path.realpath(os.path.join(__file__, '..', '..')) + '/src/')
+
+import aiy._apis._trace as trace  # noqa
+
+PERCENTILES = (50, 95, 99)
+
+
+def format_ms(values):
+    if values is None:
+        return ' '.join('%7s' % '' for _ in PERCENTILES)
+    return ' '.join('%7.0f' % (value * 1000) for value in values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('trace_file', help='JSONL trace file')
+    parser.add_argument('--last', type=int,
+                        help='only summarize the last N turns')
+    args = parser.parse_args()
+
+    with open(args.trace_file) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if args.last:
+        records = records[-args.last:]
+    print('%d turns from %s' % (len(records), args.trace_file))
+
+    header = ' '.join('%7s' % ('p%d' % p) for p in PERCENTILES)
+    print('%-17s %6s   %s   %s' % ('', '', 'ms since trigger'.center(23),
+                                   'ms since previous'.center(23)))
+    print('%-17s %6s   %s   %s' % ('stage', 'turns', header, header))
+    for stage, count, since_trigger, since_previous in trace.summarize(records, PERCENTILES):
+        print('%-17s %6d   %s   %s' % (stage, count, format_ms(since_trigger),
+                                       format_ms(since_previous)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""asyncio support for streaming requests with grpc.aio.
+
+This needs Python 3.6, so it is only imported by the async APIs. grpc.aio
+itself is only imported by the make_async_channel() methods that create the
+channels.
+"""
+
+import asyncio
+import logging
+
+logger = logging.getLogger('speech')
+
+
+class AudioBridge(object):
+
+    """Passes audio from recorder threads to a coroutine.
+
+    put() can be called from any thread. It hands the data to the event loop
+    with call_soon_threadsafe(), so no thread has to wait on behalf of the
+    coroutine. Create the bridge in the event loop's thread.
+    """
+
+    def __init__(self, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self._queue = asyncio.Queue()
+        self._closed = False
+
+    def put(self, data):
+        """Queues data from any thread. None ends the audio."""
+        self.call_soon(self._put, data)
+
+    def close(self):
+        """Drops queued audio and ends the stream, from any thread. Data put
+        afterwards is dropped too.
+        """
+        self.call_soon(self._close)
+
+    def _put(self, data):
+        if not self._closed:
+            self._queue.put_nowait(data)
+
+    def _close(self):
+        self._closed = True
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._queue.put_nowait(None)
+
+    def call_soon(self, callback, *args):
+        """Calls callback in the event loop, from any thread."""
+        try:
+            self.loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # The loop is closed, so there is no one left to hear about it.
+            logger.debug('event loop is closed, dropping %r', callback)
+
+    async def get(self):
+        return await self._queue.get()
+
+    async def __aiter__(self):
+        while True:
+            data = await self._queue.get()
+            if not data:
+                return
+            yield data
+
+
+class AsyncChannel(object):
+
+    """A grpc.aio channel that is kept between requests.
+
+    grpc.aio channels belong to the event loop they are created in, so the
+    channel is created by the first request rather than up front.
+    make_channel is called with a list of gRPC channel options.
+    """
+
+    def __init__(self, make_channel, options):
+        self._make_channel = make_channel
+        self._options = options
+        self._channel = None
+
+    def get(self):
+        """Returns the channel, creating it if needed."""
+        if self._channel is None:
+            self._channel = self._make_channel(self._options)
+        return self._channel
+
+    async def wait_ready(self, timeout=None):
+        """Waits until the channel is connected. Returns True if it is."""
+        try:
+            await asyncio.wait_for(self.get().channel_ready(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def close(self):
+        if self._channel is not None:
+            channel, self._channel = self._channel, None
+            await channel.close()
+
+
+async def timed_requests(timer, request_stream):
+    """Passes an async request_stream through, timing the first request."""
+    async for request in request_stream:
+        timer.request_sent()
+        yield request
+
+
+async def timed_responses(timer, response_stream):
+    """Passes an async response_stream through, timing the first response."""
+    async for response in response_stream:
+        timer.response_received()
+        yield response
@@ -0,0 +1,198 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Logs request and response audio to files from a background thread."""
+
+import datetime
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+import wave
+
+logger = logging.getLogger('speech')
+
+DEFAULT_LOG_DIR = os.path.join(tempfile.gettempdir(), 'voice-recognizer-audio')
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+
+
+class AudioLogStats(object):
+
+    """Counts the log entries written, dropped and removed by rotation."""
+
+    def __init__(self):
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.removed = 0
+        self.bytes_written = 0
+
+    def __repr__(self):
+        return 'AudioLogStats(written=%d, dropped=%d, failed=%d, removed=%d, %.1f MB)' % (
+            self.written, self.dropped, self.failed, self.removed,
+            self.bytes_written / (1024 * 1024))
+
+
+class AudioLogEntry(object):
+
+    """The audio and metadata of one request.
+
+    Audio is only collected in memory while the request runs, so adding it
+    is cheap. finish() hands the entry to the log's writer thread.
+    """
+
+    def __init__(self, audio_log):
+        self._audio_log = audio_log
+        self.time = time.time()
+        self.request_audio = []
+        self.response_audio = []
+        self.metadata = {}
+
+    def add_request_audio(self, data):
+        self.request_audio.append(data)
+
+    def add_response_audio(self, data):
+        self.response_audio.append(data)
+
+    def finish(self, **metadata):
+        """Queues the entry to be written, with metadata such as the
+        transcript, timings and outcome for its JSON sidecar. Returns False if
+        it was dropped.
+        """
+        self.metadata.update(metadata)
+        return self._audio_log.submit(self)
+
+
+class AudioLog(threading.Thread):
+
+    """Writes log entries in a background thread.
+
+    Each entry is written as a request WAV or FLAC file, a response file if
+    there was response audio, and a JSON sidecar, all named after the time of
+    the request. Entries wait in a queue of at most max_queued, and are
+    dropped if the queue is full because the disk can't keep up, so logging
+    never blocks a request.
+
+    After each entry is written, the oldest entries are removed until the
+    directory holds at most max_bytes and none is older than max_age_s.
+    """
+
+    def __init__(self, log_dir=DEFAULT_LOG_DIR, sample_rate_hz=16000, compress=False,
+                 max_bytes=DEFAULT_MAX_BYTES, max_age_s=None, max_queued=8):
+        super().__init__(daemon=True)
+        self.log_dir = log_dir
+        self._sample_rate_hz = sample_rate_hz
+        self._compress = compress
+        self._max_bytes = max_bytes
+        self._max_age_s = max_age_s
+        self._queue = queue.Queue(max_queued)
+        self.stats = AudioLogStats()
+        os.makedirs(log_dir, exist_ok=True)
+
+    def start_entry(self):
+        """Returns a new entry for a request."""
+        return AudioLogEntry(self)
+
+    def submit(self, entry):
+        """Queues an entry to be written. Returns False if it was dropped."""
+        try:
+            self._queue.put_nowait(entry)
+            return True
+        except queue.Full:
+            self.stats.dropped += 1
+            logger.warning('audio log is behind, dropped an entry (%d so far)',
+                           self.stats.dropped)
+            return False
+
+    def stop(self):
+        """Stops the writer thread once the queued entries are written."""
+        self._queue.put(None)
+
+    def run(self):
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                return
+            try:
+                self._write(entry)
+                self._rotate()
+            except (OSError, wave.Error):
+                self.stats.failed += 1
+                logger.exception('failed to write audio log entry')
+
+    def _write(self, entry):
+        # Names sort by time, which rotation relies on.
+        when = datetime.datetime.fromtimestamp(entry.time)
+        name = when.strftime('%Y%m%d-%H%M%S-') + '%03d' % (when.microsecond // 1000)
+        files = {}
+        for kind, chunks in (('request', entry.request_audio),
+                             ('response', entry.response_audio)):
+            if chunks:
+                files[kind] = self._write_audio(name + '.' + kind, b''.join(chunks))
+
+        metadata = dict(entry.metadata, time=entry.time, files=files)
+        json_path = os.path.join(self.log_dir, name + '.json')
+        with open(json_path, 'w') as f:
+            json.dump(metadata, f, indent=2, sort_keys=True, default=str)
+
+        self.stats.written += 1
+        self.stats.bytes_written += os.path.getsize(json_path) + sum(
+            os.path.getsize(os.path.join(self.log_dir, filename))
+            for filename in files.values())
+        logger.info('Logged request audio to %s/%s.*', self.log_dir, name)
+
+    def _write_audio(self, basename, data):
+        """Writes 16-bit mono audio, and returns the file name."""
+        if self._compress:
+            # numpy is only needed for FLAC compression, so import it on demand.
+            import aiy._apis._flac
+            filename = basename + '.flac'
+            with open(os.path.join(self.log_dir, filename), 'wb') as f:
+                f.write(aiy._apis._flac.encode_file(data, self._sample_rate_hz))
+            return filename
+
+        filename = basename + '.wav'
+        with open(os.path.join(self.log_dir, filename), 'wb') as f:
+            wav = wave.open(f, 'w')
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(self._sample_rate_hz)
+            wav.writeframes(data)
+            wav.close()
+        return filename
+
+    def _rotate(self):
+        """Removes the oldest entries that are over the size or age limit."""
+        entries = {}
+        for filename in os.listdir(self.log_dir):
+            stat = os.stat(os.path.join(self.log_dir, filename))
+            entry = entries.setdefault(filename.split('.')[0], [0, 0, []])
+            entry[0] += stat.st_size
+            entry[1] = max(entry[1], stat.st_mtime)
+            entry[2].append(filename)
+
+        total = sum(size for size, _, _ in entries.values())
+        now = time.time()
+        for name in sorted(entries):
+            size, mtime, filenames = entries[name]
+            too_old = self._max_age_s is not None and now - mtime > self._max_age_s
+            if total <= self._max_bytes and not too_old:
+                continue
+            for filename in filenames:
+                os.remove(os.path.join(self.log_dir, filename))
+            total -= size
+            self.stats.removed += 1
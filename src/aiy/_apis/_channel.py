@@ -0,0 +1,237 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Long-lived gRPC channels, and timing of the requests made on them."""
+
+import logging
+import threading
+import time
+
+import grpc
+
+import aiy._apis._trace as trace
+
+logger = logging.getLogger('speech')
+
+
+def keepalive_options(keepalive_ms=300000, keepalive_timeout_ms=10000,
+                      initial_reconnect_backoff_ms=1000, max_reconnect_backoff_ms=30000):
+    """Returns gRPC channel options for a long-lived channel.
+
+    The channel is pinged even while it has no calls. Google's front ends
+    answer pings more often than every 5 minutes on an idle connection with
+    GOAWAY too_many_pings, so keepalive_ms should be at least 300000.
+    """
+    return [
+        ('grpc.keepalive_time_ms', keepalive_ms),
+        ('grpc.keepalive_timeout_ms', keepalive_timeout_ms),
+        ('grpc.keepalive_permit_without_calls', 1),
+        ('grpc.http2.max_pings_without_data', 0),
+        ('grpc.initial_reconnect_backoff_ms', initial_reconnect_backoff_ms),
+        ('grpc.max_reconnect_backoff_ms', max_reconnect_backoff_ms),
+    ]
+
+
+class PersistentChannel(object):
+
+    """A gRPC channel that is kept connected between requests.
+
+    Setting up a connection takes a DNS lookup, a TCP connection and a TLS
+    handshake, so the channel is created once and connected ahead of the first
+    request. HTTP/2 keepalive pings detect dead connections while the channel
+    is unused. gRPC reconnects after transient failures by itself, and the
+    channel is reconnected in the background when it goes idle (eg after the
+    server closes the connection), so requests rarely wait for a connection.
+
+    make_channel is called with a list of gRPC channel options and returns a
+    new grpc.Channel. It is retried on the next request if it fails.
+    """
+
+    # Pings on a channel without calls must be at least 5 minutes apart, or
+    # the server closes the connection. See keepalive_options().
+    KEEPALIVE_MS = 300000
+    KEEPALIVE_TIMEOUT_MS = 10000
+    INITIAL_RECONNECT_BACKOFF_MS = 1000
+    MAX_RECONNECT_BACKOFF_MS = 30000
+    # How long to wait before reconnecting an idle channel.
+    RECONNECT_DELAY_S = 1.0
+    # gRPC polls the state of a watched channel every 200 ms, and the polling
+    # thread fails if the channel is closed under it. Once nothing watches the
+    # channel, it is closed after the polling has had time to stop.
+    CLOSE_DELAY_S = 0.5
+
+    def __init__(self, make_channel):
+        self._make_channel = make_channel
+        self._channel = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._idle = threading.Event()
+        self._closed = threading.Event()
+        # Watches the channel's readiness while it reconnects.
+        self._ready_future = None
+        self.state = None
+        self.connects = 0
+
+    def _options(self):
+        return keepalive_options(self.KEEPALIVE_MS, self.KEEPALIVE_TIMEOUT_MS,
+                                 self.INITIAL_RECONNECT_BACKOFF_MS, self.MAX_RECONNECT_BACKOFF_MS)
+
+    def connect(self):
+        """Starts connecting in the background."""
+        threading.Thread(target=self._warm_up, daemon=True).start()
+
+    def _warm_up(self):
+        try:
+            self.get()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Failed to create channel, will retry on the next request')
+
+    def get(self):
+        """Returns the channel, creating it if needed."""
+        with self._lock:
+            if self._channel is None:
+                channel = self._make_channel(self._options())
+                channel.subscribe(self._on_state_change, try_to_connect=True)
+                threading.Thread(target=self._reconnect_when_idle, args=(channel,),
+                                 daemon=True).start()
+                self._channel = channel
+            return self._channel
+
+    def wait_ready(self, timeout=None):
+        """Waits until the channel is connected. Returns True if it is."""
+        self.get()
+        return self._ready.wait(timeout)
+
+    def _on_state_change(self, state):
+        # Called from a gRPC thread, so this only records the state.
+        logger.debug('channel state: %s', state)
+        self.state = state
+        if state == grpc.ChannelConnectivity.READY:
+            self.connects += 1
+            self._ready.set()
+        else:
+            self._ready.clear()
+
+        if state == grpc.ChannelConnectivity.TRANSIENT_FAILURE:
+            logger.warning('Connection failed, gRPC will retry')
+        elif state == grpc.ChannelConnectivity.IDLE and self.connects:
+            self._idle.set()
+
+    def _reconnect_when_idle(self, channel):
+        while True:
+            self._idle.wait()
+            self._idle.clear()
+            # close() cuts the delay short.
+            if self._closed.wait(self.RECONNECT_DELAY_S):
+                return
+            with self._lock:
+                if self._closed.is_set() or self._channel is not channel:
+                    return
+                logger.info('Reconnecting idle channel')
+                # Watching readiness makes gRPC connect the channel. The last
+                # watch is cancelled, so it doesn't keep polling.
+                if self._ready_future:
+                    self._ready_future.cancel()
+                self._ready_future = grpc.channel_ready_future(channel)
+
+    def close(self):
+        with self._lock:
+            self._closed.set()
+            self._idle.set()
+            if self._ready_future:
+                self._ready_future.cancel()
+                self._ready_future = None
+            if self._channel:
+                self._channel.unsubscribe(self._on_state_change)
+                closer = threading.Timer(self.CLOSE_DELAY_S, self._channel.close)
+                closer.daemon = True
+                closer.start()
+                self._channel = None
+            self._ready.clear()
+
+
+class RequestTimer(object):
+
+    """Breaks down where the time of a streaming request goes.
+
+    All times are in seconds from the start of the request:
+    - channel_ready_s: when the channel was connected
+    - first_request_s: when gRPC took the first request message to send
+    - first_response_s: when the first response arrived
+    - first_audio_s: when the first response audio was passed on for playback
+    - total_s: when the response stream ended
+
+    The first request is also marked in trace_turn, a _trace.Turn.
+    """
+
+    def __init__(self, trace_turn=None):
+        self._trace_turn = trace_turn
+        self._start = time.monotonic()
+        self.channel_ready_s = None
+        self.first_request_s = None
+        self.first_response_s = None
+        self.first_audio_s = None
+        self.total_s = None
+
+    def _elapsed(self):
+        return time.monotonic() - self._start
+
+    def channel_ready(self):
+        self.channel_ready_s = self._elapsed()
+
+    def request_sent(self):
+        if self.first_request_s is None:
+            self.first_request_s = self._elapsed()
+            trace.mark(trace.FIRST_REQUEST, turn=self._trace_turn)
+
+    def response_received(self):
+        if self.first_response_s is None:
+            self.first_response_s = self._elapsed()
+
+    def requests(self, request_stream):
+        """Passes request_stream through, timing the first request."""
+        for request in request_stream:
+            self.request_sent()
+            yield request
+
+    def responses(self, response_stream):
+        """Passes response_stream through, timing the first response."""
+        for response in response_stream:
+            self.response_received()
+            yield response
+
+    def first_audio(self):
+        if self.first_audio_s is None:
+            self.first_audio_s = self._elapsed()
+
+    def finish(self):
+        self.total_s = self._elapsed()
+
+    def to_dict(self):
+        return {
+            'channel_ready_s': self.channel_ready_s,
+            'first_request_s': self.first_request_s,
+            'first_response_s': self.first_response_s,
+            'first_audio_s': self.first_audio_s,
+            'total_s': self.total_s,
+        }
+
+    def __repr__(self):
+        def format_ms(seconds):
+            return 'n/a' if seconds is None else '%.0f ms' % (seconds * 1000)
+
+        return ('RequestTimer(channel_ready=%s, first_request=%s, first_response=%s, '
+                'first_audio=%s, total=%s)') % tuple(format_ms(seconds) for seconds in (
+                    self.channel_ready_s, self.first_request_s, self.first_response_s,
+                    self.first_audio_s, self.total_s))
@@ -0,0 +1,131 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Keeps OAuth2 access tokens fresh in the background."""
+
+import datetime
+import logging
+import random
+import threading
+import time
+
+import google.auth.exceptions
+import google.auth.transport.requests
+
+logger = logging.getLogger('speech')
+
+
+class RefreshStats(object):
+
+    """Counters and timings of token refreshes."""
+
+    def __init__(self):
+        self.refreshes = 0
+        self.failures = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+        self.last_s = None
+
+    def add(self, duration_s):
+        self.refreshes += 1
+        self.total_s += duration_s
+        self.max_s = max(self.max_s, duration_s)
+        self.last_s = duration_s
+
+    @property
+    def mean_s(self):
+        return self.total_s / self.refreshes if self.refreshes else 0.0
+
+    def __repr__(self):
+        return 'RefreshStats(refreshes=%d, failures=%d, mean=%.0f ms, max=%.0f ms)' % (
+            self.refreshes, self.failures, self.mean_s * 1000, self.max_s * 1000)
+
+
+class TokenRefresher(threading.Thread):
+
+    """Refreshes credentials in a background thread before they expire.
+
+    google.auth credentials refresh lazily: the gRPC auth plugin refreshes an
+    expired token synchronously, before sending the request that needed it.
+    This thread refreshes the token REFRESH_MARGIN_S (plus up to JITTER_S, so
+    that devices don't all refresh at once) before it expires, so the plugin
+    always finds a valid token. The margin has to be longer than the time
+    before expiry at which google.auth considers a token expired.
+
+    Failed refreshes are retried with exponential backoff.
+    """
+
+    REFRESH_MARGIN_S = 300
+    JITTER_S = 60
+    RETRY_DELAY_S = 1.0
+    MAX_RETRY_DELAY_S = 60.0
+
+    def __init__(self, credentials, make_request=None):
+        super().__init__(daemon=True)
+        self._credentials = credentials
+        self._make_request = make_request or google.auth.transport.requests.Request
+        self._stopped = threading.Event()
+        self._random = random.Random()
+        self.stats = RefreshStats()
+
+    def refresh(self):
+        """Refreshes the token now. Raises GoogleAuthError on failure."""
+        start = time.monotonic()
+        try:
+            self._credentials.refresh(self._make_request())
+        except google.auth.exceptions.GoogleAuthError:
+            self.stats.failures += 1
+            raise
+        duration_s = time.monotonic() - start
+        self.stats.add(duration_s)
+        logger.info('Refreshed access token in %.0f ms', duration_s * 1000)
+
+    def _get_refresh_delay(self):
+        """Returns how long to wait before the next refresh, or None if the
+        token never expires.
+        """
+        if not self._credentials.token:
+            return 0
+        expiry = self._credentials.expiry
+        if expiry is None:
+            return None
+        remaining_s = (expiry - datetime.datetime.utcnow()).total_seconds()
+        margin_s = self.REFRESH_MARGIN_S + self._random.uniform(0, self.JITTER_S)
+        return max(0, remaining_s - margin_s)
+
+    def _get_retry_delay(self, failures):
+        return min(self.RETRY_DELAY_S * 2 ** (failures - 1), self.MAX_RETRY_DELAY_S)
+
+    def run(self):
+        failures = 0
+        while True:
+            if failures:
+                delay = self._get_retry_delay(failures)
+            else:
+                delay = self._get_refresh_delay()
+                if delay is None:
+                    return
+            if self._stopped.wait(delay):
+                return
+
+            try:
+                self.refresh()
+                failures = 0
+            except google.auth.exceptions.GoogleAuthError as exc:
+                failures += 1
+                logger.warning('Failed to refresh access token (retrying in %.1f s): %s',
+                               self._get_retry_delay(failures), exc)
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,315 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A streaming FLAC encoder for 16-bit audio.
+
+Each block of samples is encoded as soon as it is complete, so audio can be
+uploaded while the user is still speaking. Every channel of a block is
+encoded with the best of the FLAC fixed polynomial predictors and Rice coded
+residuals, following the streamable subset of the format:
+https://xiph.org/flac/format.html
+
+The encoder is written with numpy and needs no native FLAC library.
+"""
+
+import hashlib
+import struct
+
+import numpy as np
+
+BITS_PER_SAMPLE = 16
+MAX_FIXED_ORDER = 4
+MAX_PARTITION_ORDER = 8
+# Rice parameters are coded in 4 bits, and 15 is reserved as an escape code.
+MAX_RICE_PARAMETER = 14
+
+# Frame header codes for common sample rates.
+_SAMPLE_RATE_CODES = {
+    8000: 4, 16000: 5, 22050: 6, 24000: 7, 32000: 8, 44100: 9, 48000: 10, 96000: 11,
+}
+_SAMPLE_SIZE_CODE_16 = 4
+
+
+def _make_crc_table(polynomial, width):
+    top = 1 << (width - 1)
+    mask = (1 << width) - 1
+    table = []
+    for byte in range(256):
+        crc = byte << (width - 8)
+        for _ in range(8):
+            crc = ((crc << 1) ^ polynomial) if crc & top else crc << 1
+        table.append(crc & mask)
+    return table
+
+
+_CRC8_TABLE = _make_crc_table(0x07, 8)
+_CRC16_TABLE = _make_crc_table(0x8005, 16)
+
+
+def _crc8(data):
+    crc = 0
+    for byte in data:
+        crc = _CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def _crc16(data):
+    crc = 0
+    table = _CRC16_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xffff) ^ table[(crc >> 8) ^ byte]
+    return crc
+
+
+def _utf8_number(number):
+    """Codes a frame number the way FLAC does, like UTF-8 but up to 36 bits."""
+    if number < 0x80:
+        return bytes([number])
+    count = 2
+    while number >= 1 << (5 * count + 1):
+        count += 1
+    coded = []
+    for _ in range(count - 1):
+        coded.append(0x80 | (number & 0x3f))
+        number >>= 6
+    lead = (0xff << (8 - count)) & 0xff
+    coded.append(lead | number)
+    return bytes(reversed(coded))
+
+
+class _BitWriter(object):
+
+    """Collects fields of any bit width, as arrays of bits."""
+
+    def __init__(self):
+        self._bits = []
+
+    def write(self, value, width):
+        if width:
+            shifts = np.arange(width - 1, -1, -1, dtype=np.int64)
+            self._bits.append(((int(value) >> shifts) & 1).astype(np.uint8))
+
+    def write_signed(self, values, width):
+        values = np.asarray(values, dtype=np.int64) & ((1 << width) - 1)
+        shifts = np.arange(width - 1, -1, -1, dtype=np.int64)
+        self._bits.append(((values[:, np.newaxis] >> shifts) & 1).astype(np.uint8).ravel())
+
+    def write_rice(self, folded, parameter):
+        """Writes folded (non-negative) residuals with a Rice parameter."""
+        quotients = folded >> parameter
+        lengths = quotients + 1 + parameter
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        bits = np.zeros(int(lengths.sum()), dtype=np.uint8)
+        # A quotient is coded in unary as zeros ended by a one, followed by
+        # the low bits of the value.
+        bits[starts + quotients] = 1
+        if parameter:
+            shifts = np.arange(parameter - 1, -1, -1, dtype=np.int64)
+            low_bits = (folded[:, np.newaxis] >> shifts) & 1
+            positions = (starts + quotients + 1)[:, np.newaxis] + np.arange(parameter)
+            bits[positions.ravel()] = low_bits.ravel()
+        self._bits.append(bits)
+
+    def to_bytes(self):
+        """Returns the bits written, zero padded to a whole byte."""
+        return np.packbits(np.concatenate(self._bits)).tobytes()
+
+
+def _fixed_residuals(samples, order):
+    """Returns the residuals of the fixed predictor of the given order."""
+    return np.diff(samples, n=order) if order else samples
+
+
+class FlacEncoder(object):
+
+    """Encodes interleaved 16-bit little-endian samples to a FLAC stream.
+
+    encode() returns the stream header followed by all complete blocks, and
+    keeps the remaining samples for the next call. flush() encodes them as
+    the final, shorter block.
+    """
+
+    encoding = 'FLAC'
+
+    def __init__(self, sample_rate_hz=16000, channels=1, block_size=None):
+        self._sample_rate_hz = sample_rate_hz
+        self._channels = channels
+        # 100 ms blocks by default, the recorder's chunk size.
+        self._block_size = block_size or sample_rate_hz // 10
+        if not 16 <= self._block_size <= 4608:
+            raise ValueError('block size must be between 16 and 4608 samples')
+        self._frame_size = 2 * channels
+        self._pending = b''
+        self._frame_number = 0
+        self._header_sent = False
+
+    def _stream_header(self):
+        streaminfo = struct.pack('>HH', self._block_size, self._block_size)
+        # Unknown frame sizes, then the sample rate, channels and bits per
+        # sample packed in 28 bits, followed by the total samples and MD5
+        # signature, which aren't known until the end of the stream.
+        streaminfo += b'\0' * 6
+        streaminfo += struct.pack('>Q', (self._sample_rate_hz << 44) |
+                                  ((self._channels - 1) << 41) |
+                                  ((BITS_PER_SAMPLE - 1) << 36))
+        streaminfo += b'\0' * 16
+        # A single, last metadata block of type STREAMINFO.
+        return b'fLaC' + struct.pack('>I', (1 << 31) | len(streaminfo)) + streaminfo
+
+    def encode(self, data):
+        """Encodes a chunk of samples, returning the bytes ready to send."""
+        out = []
+        if not self._header_sent:
+            out.append(self._stream_header())
+            self._header_sent = True
+
+        data = self._pending + bytes(data)
+        block_bytes = self._block_size * self._frame_size
+        complete = len(data) - len(data) % block_bytes
+        for start in range(0, complete, block_bytes):
+            out.append(self._encode_frame(data[start:start + block_bytes]))
+        self._pending = data[complete:]
+        return b''.join(out)
+
+    def flush(self):
+        """Encodes any samples left over as the last block."""
+        out = b'' if self._header_sent else self._stream_header()
+        self._header_sent = True
+        pending = self._pending[:len(self._pending) - len(self._pending) % self._frame_size]
+        self._pending = b''
+        if pending:
+            out += self._encode_frame(pending)
+        return out
+
+    def _frame_header(self, block_size):
+        sample_rate_code = _SAMPLE_RATE_CODES.get(self._sample_rate_hz)
+        rate_bytes = b''
+        if sample_rate_code is None:
+            if self._sample_rate_hz < 1 << 16:
+                sample_rate_code = 13
+                rate_bytes = struct.pack('>H', self._sample_rate_hz)
+            elif self._sample_rate_hz % 10 == 0:
+                sample_rate_code = 14
+                rate_bytes = struct.pack('>H', self._sample_rate_hz // 10)
+            else:
+                sample_rate_code = 0  # from STREAMINFO
+
+        header = bytes([
+            0xff, 0xf8,  # sync code, fixed block size
+            (7 << 4) | sample_rate_code,  # 16-bit block size at end of header
+            ((self._channels - 1) << 4) | (_SAMPLE_SIZE_CODE_16 << 1),
+        ])
+        header += _utf8_number(self._frame_number)
+        header += struct.pack('>H', block_size - 1) + rate_bytes
+        return header + bytes([_crc8(header)])
+
+    def _encode_frame(self, data):
+        samples = np.frombuffer(data, dtype='<i2').astype(np.int64)
+        samples = samples.reshape(-1, self._channels)
+        block_size = samples.shape[0]
+
+        writer = _BitWriter()
+        for channel in range(self._channels):
+            self._write_subframe(writer, samples[:, channel])
+        frame = self._frame_header(block_size) + writer.to_bytes()
+        self._frame_number += 1
+        return frame + struct.pack('>H', _crc16(frame))
+
+    def _write_subframe(self, writer, samples):
+        if np.all(samples == samples[0]):
+            writer.write(0, 8)  # CONSTANT
+            writer.write_signed(samples[:1], BITS_PER_SAMPLE)
+            return
+
+        # Like libFLAC, pick the predictor with the smallest residuals
+        # rather than fully coding each of them.
+        orders = range(min(MAX_FIXED_ORDER, len(samples) - 1) + 1)
+        residuals = [_fixed_residuals(samples, order) for order in orders]
+        order = int(np.argmin([np.abs(r).sum() / len(r) for r in residuals]))
+        folded = (residuals[order] << 1) ^ (residuals[order] >> 63)
+        partitions, cost = self._choose_partitions(folded, len(samples), order)
+        if cost >= len(samples) * BITS_PER_SAMPLE:
+            writer.write(1 << 1, 8)  # VERBATIM
+            writer.write_signed(samples, BITS_PER_SAMPLE)
+            return
+
+        writer.write((8 | order) << 1, 8)  # FIXED
+        writer.write_signed(samples[:order], BITS_PER_SAMPLE)
+        partition_order, parameters = partitions
+        writer.write(0, 2)  # Rice coding with 4-bit parameters
+        writer.write(partition_order, 4)
+        for (start, end), parameter in zip(
+                self._partition_bounds(len(samples), order, partition_order), parameters):
+            writer.write(parameter, 4)
+            writer.write_rice(folded[start:end], parameter)
+
+    @staticmethod
+    def _partition_bounds(block_size, order, partition_order):
+        """Returns the residual index ranges of each partition. The first
+        partition is shorter by the predictor order.
+        """
+        size = block_size >> partition_order
+        return [(max(0, i * size - order), (i + 1) * size - order)
+                for i in range(1 << partition_order)]
+
+    def _choose_partitions(self, folded, block_size, order):
+        """Returns ((partition order, Rice parameters), cost in bits).
+
+        The cost of each Rice parameter is computed for the smallest
+        partitions once, and summed pairwise for the larger ones.
+        """
+        partition_order = 0
+        while (partition_order < MAX_PARTITION_ORDER and
+               block_size % (2 << partition_order) == 0 and
+               block_size >> (partition_order + 1) > order):
+            partition_order += 1
+
+        # Padding the first partition with zeros, which cost nothing but
+        # their length, makes all partitions the same size.
+        padded = np.concatenate((np.zeros(order, dtype=np.int64), folded))
+        padded = padded.reshape(1 << partition_order, -1)
+        parameters = np.arange(MAX_RICE_PARAMETER + 1, dtype=np.int64)
+        quotient_sums = (padded[:, :, np.newaxis] >> parameters).sum(axis=1)
+        lengths = np.full(1 << partition_order, padded.shape[1], dtype=np.int64)
+        lengths[0] -= order
+
+        best = None
+        while True:
+            costs = quotient_sums + lengths[:, np.newaxis] * (parameters + 1)
+            best_parameters = costs.argmin(axis=1)
+            cost = 6 + int(costs.min(axis=1).sum()) + 4 * len(lengths)
+            if best is None or cost < best[1]:
+                best = ((partition_order, best_parameters.tolist()), cost)
+            if partition_order == 0:
+                break
+            partition_order -= 1
+            quotient_sums = quotient_sums.reshape(-1, 2, len(parameters)).sum(axis=1)
+            lengths = lengths.reshape(-1, 2).sum(axis=1)
+        return best[0], best[1] + order * BITS_PER_SAMPLE
+
+
+def encode_file(data, sample_rate_hz=16000, channels=1):
+    """Encodes all of data as a complete FLAC file. Unlike a stream, the
+    header has the total samples and MD5 signature, which some decoders need.
+    """
+    encoder = FlacEncoder(sample_rate_hz, channels)
+    data = bytes(data)
+    data = data[:len(data) - len(data) % (2 * channels)]
+    stream = encoder.encode(data) + encoder.flush()
+    # The packed sample rate, channels and bits per sample end with the 36 bit
+    # total samples, followed by the MD5 of the samples as little-endian.
+    info, = struct.unpack('>Q', stream[18:26])
+    info |= len(data) // (2 * channels)
+    return (stream[:18] + struct.pack('>Q', info) + hashlib.md5(data).digest() +
+            stream[42:])
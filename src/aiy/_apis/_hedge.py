@@ -0,0 +1,311 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Races Cloud Speech against the Assistant for the same utterance."""
+
+import copy
+import functools
+import logging
+import threading
+import time
+
+logger = logging.getLogger('speech')
+
+CLOUD_SPEECH = 'cloud speech'
+ASSISTANT = 'assistant'
+
+
+class HedgeStats(object):
+
+    """Counts which service each request was answered by, and how long Cloud
+    Speech took to decide whether a local command would handle it.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.cloud_speech = 0
+        self.assistant = 0
+        self.cloud_speech_errors = 0
+        self.decision_s = 0.0
+
+    def add(self, winner, decision_s):
+        self.requests += 1
+        if winner == CLOUD_SPEECH:
+            self.cloud_speech += 1
+        else:
+            self.assistant += 1
+        self.decision_s += decision_s
+
+    @property
+    def mean_decision_s(self):
+        return self.decision_s / self.requests if self.requests else 0.0
+
+    def __repr__(self):
+        return ('HedgeStats(cloud_speech=%d, assistant=%d, cloud_speech_errors=%d, '
+                'mean_decision=%.0f ms)' % (self.cloud_speech, self.assistant,
+                                            self.cloud_speech_errors,
+                                            self.mean_decision_s * 1000))
+
+
+class HedgedRequest(object):
+
+    """Streams the same audio to a Cloud Speech request and an Assistant
+    request at once.
+
+    If Cloud Speech's transcript is one a local command can handle, it's
+    returned as soon as it arrives and the Assistant request is cancelled, so
+    local commands don't wait for the Assistant's round trip. Otherwise the
+    Assistant's result is returned. This has the same interface as the
+    requests, so it can be used in their place.
+
+    The first decision stands: once the Assistant's response has started
+    playing, a local command that Cloud Speech recognizes later is ignored,
+    and once an early action has run, the Assistant's response isn't played.
+    """
+
+    keeps_data = True
+
+    # How long the Assistant's response waits for Cloud Speech before it
+    # starts playing anyway.
+    VERDICT_TIMEOUT_S = 2.0
+
+    def __init__(self, cloud_request, assistant_request):
+        self._can_handle = lambda transcript: False
+        self._assistant_always_responds = False
+        self._endpointer_cb = None
+        self._response_stream_cb = None
+        self._stats = HedgeStats()
+        self._bind_requests(cloud_request, assistant_request)
+        self._start_turn()
+
+    def _bind_requests(self, cloud_request, assistant_request):
+        self.cloud_request = cloud_request
+        self.assistant_request = assistant_request
+        self._requests = (cloud_request, assistant_request)
+        for request in self._requests:
+            request.set_endpointer_cb(functools.partial(self._endpointer_callback, request))
+        if self._response_stream_cb:
+            assistant_request.set_response_stream_cb(self._open_response_stream)
+
+    def _start_turn(self):
+        self._lock = threading.Lock()
+        self._audio_ended = False
+        self._winner = None
+        self._verdict = threading.Event()
+        self._assistant_thread = None
+        self._assistant_result = None
+        self._assistant_error = None
+
+    def new_session(self):
+        """Returns a hedged request for one turn, made of sessions of both
+        requests, like GenericSpeechRequest.new_session().
+        """
+        session = copy.copy(self)
+        session._bind_requests(self.cloud_request.new_session(),
+                               self.assistant_request.new_session())
+        session._start_turn()
+        return session
+
+    @property
+    def dialog_follow_on(self):
+        return self._winner == ASSISTANT and self.assistant_request.dialog_follow_on
+
+    @property
+    def last_timing(self):
+        if self._winner == CLOUD_SPEECH:
+            return self.cloud_request.last_timing
+        return self.assistant_request.last_timing
+
+    def get_hedge_stats(self):
+        """Returns HedgeStats for the requests so far."""
+        return self._stats
+
+    def set_can_handle_cb(self, cb, assistant_always_responds=False):
+        """Sets the callback that decides if a transcript is a local command,
+        like Actor.can_handle. If assistant_always_responds, the Assistant
+        request isn't cancelled for local commands, and its response is
+        returned with Cloud Speech's transcript.
+        """
+        self._can_handle = cb
+        self._assistant_always_responds = assistant_always_responds
+
+    def set_early_action_cb(self, can_handle_cb, handle_cb, min_stability=0.8):
+        """Like CloudSpeechRequest.set_early_action_cb(), but an interim
+        result isn't handled if the Assistant's response is already playing.
+        """
+        if can_handle_cb:
+            can_handle_cb = functools.partial(self._can_act_early, can_handle_cb)
+        self.cloud_request.set_early_action_cb(can_handle_cb, handle_cb, min_stability)
+
+    def _can_act_early(self, can_handle_cb, transcript):
+        if not can_handle_cb(transcript):
+            return False
+        if self._claim(CLOUD_SPEECH) == CLOUD_SPEECH or self._assistant_always_responds:
+            return True
+        logger.info('the Assistant response is playing, ignoring %r', transcript)
+        return False
+
+    def _claim(self, winner):
+        """Makes winner the winner, unless there already is one. Returns the
+        winner.
+        """
+        with self._lock:
+            if self._winner is None:
+                self._winner = winner
+            return self._winner
+
+    def set_endpointer_cb(self, cb):
+        """Callback to invoke on end of speech."""
+        self._endpointer_cb = cb
+
+    def set_trace(self, turn):
+        for request in self._requests:
+            request.set_trace(turn)
+
+    def set_response_stream_cb(self, cb):
+        """Like AssistantSpeechRequest.set_response_stream_cb(), but the
+        response isn't played if Cloud Speech wins.
+        """
+        self._response_stream_cb = cb
+        self.assistant_request.set_response_stream_cb(self._open_response_stream)
+
+    def add_phrases(self, phrases, priority=0):
+        # The Assistant API doesn't take phrase hints.
+        self.cloud_request.add_phrases(phrases, priority)
+
+    def add_phrase(self, phrase, priority=0):
+        self.cloud_request.add_phrase(phrase, priority)
+
+    def set_audio_encoding(self, encoding):
+        for request in self._requests:
+            request.set_audio_encoding(encoding)
+
+    def set_local_endpointer_enabled(self, *args, **kwargs):
+        for request in self._requests:
+            request.set_local_endpointer_enabled(*args, **kwargs)
+
+    def set_deadline(self, deadline_s):
+        for request in self._requests:
+            request.set_deadline(deadline_s)
+
+    def set_speech_gate_enabled(self, *args, **kwargs):
+        for request in self._requests:
+            request.set_speech_gate_enabled(*args, **kwargs)
+
+    def set_audio_logging_enabled(self, audio_logging_enabled=True):
+        # The Cloud Speech request creates the log in its audio format.
+        self.cloud_request.set_audio_logging_enabled(audio_logging_enabled)
+        self.set_audio_log(self.cloud_request.get_audio_log())
+
+    def set_audio_log(self, audio_log):
+        # Both requests share the log, so one writer thread rotates it.
+        for request in self._requests:
+            request.set_audio_log(audio_log)
+
+    def reset(self):
+        if self._assistant_thread:
+            # A cancelled Assistant request may still be finishing.
+            self._assistant_thread.join()
+        for request in self._requests:
+            request.reset()
+        self._start_turn()
+
+    def add_data(self, data):
+        for request in self._requests:
+            request.add_data(data)
+
+    def end_audio(self):
+        for request in self._requests:
+            request.end_audio()
+
+    def cancel(self):
+        """Cancels both requests, so do_request() returns an empty result."""
+        for request in self._requests:
+            request.cancel()
+
+    def _endpointer_callback(self, request):
+        """Ends the audio of both requests when either one's endpointer fires,
+        since they hear the same audio.
+        """
+        with self._lock:
+            if self._audio_ended:
+                return
+            self._audio_ended = True
+
+        for other in self._requests:
+            if other is not request:
+                other.end_audio()
+        if self._endpointer_cb:
+            self._endpointer_cb()
+
+    def do_request(self):
+        """Runs both requests, and returns the result of the one that wins.
+
+        If the Assistant request fails when it's needed, its error is raised
+        as it is: usually speech.Error, but not always.
+        """
+        start = time.monotonic()
+        self._assistant_thread = threading.Thread(target=self._do_assistant_request)
+        self._assistant_thread.start()
+
+        try:
+            cloud_result = self.cloud_request.do_request()
+        except Exception:  # pylint: disable=broad-except
+            # Cloud Speech is only a shortcut, so fall back to the Assistant.
+            logger.exception('Cloud Speech request failed')
+            self._stats.cloud_speech_errors += 1
+            cloud_result = None
+
+        transcript = cloud_result.transcript if cloud_result else None
+        # A command that already ran from an interim result also wins, even
+        # if the final transcript differs.
+        is_local = (bool(getattr(self.cloud_request, 'early_transcript', None)) or
+                    bool(transcript) and self._can_handle(transcript))
+        winner = self._claim(CLOUD_SPEECH if is_local else ASSISTANT)
+        self._verdict.set()
+        self._stats.add(winner, time.monotonic() - start)
+
+        if winner == CLOUD_SPEECH and not self._assistant_always_responds:
+            logger.info('Cloud Speech won with %r, cancelling the Assistant', transcript)
+            self.assistant_request.cancel()
+            return cloud_result
+
+        self._assistant_thread.join()
+        self._assistant_thread = None
+        if self._assistant_error:
+            raise self._assistant_error
+        if winner == CLOUD_SPEECH:
+            return self._assistant_result._replace(transcript=transcript)
+        return self._assistant_result
+
+    def _do_assistant_request(self):
+        try:
+            self._assistant_result = self.assistant_request.do_request()
+        except Exception as exc:  # pylint: disable=broad-except
+            self._assistant_error = exc
+
+    def _open_response_stream(self, transcript):
+        """Holds the Assistant's response until Cloud Speech decides whether
+        a local command handles the request.
+        """
+        if not self._verdict.wait(self.VERDICT_TIMEOUT_S):
+            logger.info('no Cloud Speech result yet, playing the Assistant response')
+        # An early action may have won already.
+        winner = self._claim(ASSISTANT)
+
+        if winner == CLOUD_SPEECH and not self._assistant_always_responds:
+            return None
+        if self._response_stream_cb:
+            return self._response_stream_cb(transcript)
+        return None
@@ -0,0 +1,91 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The phrase hints of a speech request, within the API's limits."""
+
+import logging
+
+logger = logging.getLogger('speech')
+
+# Cloud Speech limits for the phrases of one request. See
+# https://cloud.google.com/speech/limits.
+MAX_PHRASES = 500
+MAX_PHRASE_CHARS = 100
+MAX_TOTAL_CHARS = 10000
+
+
+class PhraseSet(object):
+
+    """Phrases to bias recognition towards, without duplicates.
+
+    Phrases that differ only in case or spacing are the same phrase, which
+    keeps the highest priority it was added with. get() returns the phrases
+    with the highest priority first, in the order they were added, up to the
+    API's limits. The result is cached until a phrase is added, and version
+    changes whenever it would be different.
+    """
+
+    def __init__(self, max_phrases=MAX_PHRASES, max_phrase_chars=MAX_PHRASE_CHARS,
+                 max_total_chars=MAX_TOTAL_CHARS):
+        self._max_phrases = max_phrases
+        self._max_phrase_chars = max_phrase_chars
+        self._max_total_chars = max_total_chars
+        # Normalized phrase -> [priority, order added, phrase as first added]
+        self._phrases = {}
+        self._trimmed = None
+        self.version = 0
+
+    def __len__(self):
+        return len(self._phrases)
+
+    def add(self, phrase, priority=0):
+        """Adds a phrase. Phrases with a higher priority are kept first when
+        there are too many.
+        """
+        key = ' '.join(phrase.lower().split())
+        if not key:
+            return
+        entry = self._phrases.get(key)
+        if entry is None:
+            self._phrases[key] = [priority, len(self._phrases), phrase.strip()]
+        elif priority > entry[0]:
+            entry[0] = priority
+        else:
+            return
+        self._trimmed = None
+        self.version += 1
+
+    def get(self):
+        """Returns the phrases to send, trimmed to the API's limits."""
+        if self._trimmed is None:
+            self._trimmed = self._trim()
+        return self._trimmed
+
+    def _trim(self):
+        phrases = []
+        total_chars = 0
+        dropped = 0
+        for _, _, phrase in sorted(self._phrases.values(),
+                                   key=lambda entry: (-entry[0], entry[1])):
+            if (len(phrases) == self._max_phrases or
+                    len(phrase) > self._max_phrase_chars or
+                    total_chars + len(phrase) > self._max_total_chars):
+                dropped += 1
+                continue
+            phrases.append(phrase)
+            total_chars += len(phrase)
+        if dropped:
+            logger.warning('dropped %d of %d phrases to stay within the API limits',
+                           dropped, len(self._phrases))
+        return phrases
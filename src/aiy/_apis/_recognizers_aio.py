@@ -0,0 +1,63 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""asyncio versions of the recognizers in aiy.cloudspeech and
+aiy.assistant.grpc.
+
+They need Python 3.6 and grpc.aio, so this module is only imported by
+get_async_recognizer() and get_async_assistant().
+"""
+
+import aiy._apis._speech_aio
+import aiy.assistant.grpc
+import aiy.cloudspeech
+
+
+class AsyncCloudSpeechRecognizer(aiy.cloudspeech._CloudSpeechRecognizer):
+    """A speech recognizer for asyncio, backed by the Google CloudSpeech APIs.
+    """
+
+    def _make_request(self, credentials_file):
+        return aiy._apis._speech_aio.AsyncCloudSpeechRequest(credentials_file)
+
+    async def recognize(self):
+        """Like _CloudSpeechRecognizer.recognize(), but a coroutine. Call it
+        from the event loop's thread. cancel() can be called from any thread.
+        """
+        recording = self._start_recording()
+        try:
+            return (await recording.session.do_request()).transcript
+        finally:
+            self._finish_recording(recording)
+
+
+class AsyncAssistantRecognizer(aiy.assistant.grpc._AssistantRecognizer):
+    """Your personal Google Assistant, for asyncio."""
+
+    def _make_request(self, credentials):
+        return aiy._apis._speech_aio.AsyncAssistantSpeechRequest(credentials)
+
+    async def recognize(self):
+        """Like _AssistantRecognizer.recognize(), but a coroutine. Call it
+        from the event loop's thread. cancel() can be called from any thread.
+
+        Usage:
+            transcript, audio = await my_recognizer.recognize()
+        """
+        recording = self._start_recording()
+        try:
+            response = await recording.session.do_request()
+        finally:
+            self._finish_recording(recording)
+        return response.transcript, response.response_audio
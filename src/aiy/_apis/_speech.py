@@ -16,10 +16,12 @@
 
 from abc import abstractmethod
 import collections
+import copy
+import importlib.util
 import logging
 import os
-import tempfile
-import wave
+import threading
+import time
 
 import google.auth
 import google.auth.exceptions
@@ -31,6 +33,11 @@ from google.assistant.embedded.v1alpha1 import embedded_assistant_pb2
 import grpc
 from six.moves import queue
 
+import aiy._apis._audiolog
+import aiy._apis._channel
+import aiy._apis._credentials
+import aiy._apis._phrases
+import aiy._apis._trace as trace
 import aiy.i18n
 
 logger = logging.getLogger('speech')
@@ -38,6 +45,18 @@ logger = logging.getLogger('speech')
 AUDIO_SAMPLE_SIZE = 2  # bytes per sample
 AUDIO_SAMPLE_RATE_HZ = 16000
 
+# FLAC roughly halves the audio uploaded, but the encoder needs numpy.
+AUDIO_ENCODINGS = ('FLAC', 'LINEAR16')
+DEFAULT_AUDIO_ENCODING = 'FLAC' if importlib.util.find_spec('numpy') else 'LINEAR16'
+
+
+# Which endpointer ended the audio of a request.
+LOCAL_ENDPOINTER = 'local'
+SERVER_ENDPOINTER = 'server'
+# The request ended locally because the user didn't start speaking.
+NO_SPEECH = 'no speech'
+# The request ended because an interim result was handled as a command.
+EARLY_ACTION = 'early action'
 
 _Result = collections.namedtuple('_Result', ['transcript', 'response_audio'])
 
@@ -46,9 +65,57 @@ class Error(Exception):
     pass
 
 
+class EndpointStats(object):
+
+    """Counts which endpointer ended each request first, and how much sooner
+    the local endpointer was than the server's. Requests that ended without
+    speech, and so were never sent, are counted in no_speech.
+
+    Once the local endpointer ends the audio, the server's endpointer event is
+    a response to that, so saved_s is a lower bound on the time saved.
+    """
+
+    def __init__(self):
+        self.local = 0
+        self.server = 0
+        self.no_speech = 0
+        self.compared = 0
+        self.saved_s = 0.0
+        self.last_saved_s = None
+
+    def add(self, endpoints):
+        """Adds a request, given a dict of endpointer to time.monotonic()
+        when it ended the request.
+        """
+        if NO_SPEECH in endpoints:
+            self.no_speech += 1
+            return
+
+        local = endpoints.get(LOCAL_ENDPOINTER)
+        server = endpoints.get(SERVER_ENDPOINTER)
+        if local is None:
+            if server is not None:
+                self.server += 1
+            return
+
+        self.local += 1
+        if server is not None:
+            self.compared += 1
+            self.last_saved_s = server - local
+            self.saved_s += self.last_saved_s
+
+    @property
+    def mean_saved_s(self):
+        return self.saved_s / self.compared if self.compared else 0.0
+
+    def __repr__(self):
+        return 'EndpointStats(local=%d, server=%d, no_speech=%d, mean_saved=%.0f ms)' % (
+            self.local, self.server, self.no_speech, self.mean_saved_s * 1000)
+
+
 class _ChannelFactory(object):
 
-    """Creates gRPC channels with a given configuration."""
+    """Creates secure gRPC channels to an API host."""
 
     def __init__(self, api_host, credentials):
         self._api_host = api_host
@@ -56,20 +123,56 @@ class _ChannelFactory(object):
 
         self._checked = False
 
-    def make_channel(self):
-        """Creates a secure channel."""
+    def make_channel(self, options=None):
+        """Creates a secure channel with the given gRPC channel options."""
 
         request = google.auth.transport.requests.Request()
         target = self._api_host + ':443'
 
-        if not self._checked:
+        if not self._checked and not self._credentials.valid:
             # Refresh now, to catch any errors early. Otherwise, they'll be
             # raised and swallowed somewhere inside gRPC.
             self._credentials.refresh(request)
-            self._checked = True
+        self._checked = True
 
         return google.auth.transport.grpc.secure_authorized_channel(
-            self._credentials, request, target)
+            self._credentials, request, target, options=options)
+
+    def make_async_channel(self, options=None):
+        """Creates a secure grpc.aio channel with the given options.
+
+        This doesn't refresh the credentials first, which would block the
+        event loop. The TokenRefresher does that in the background.
+        """
+        import grpc.aio  # pylint: disable=redefined-outer-name
+
+        metadata_plugin = google.auth.transport.grpc.AuthMetadataPlugin(
+            self._credentials, google.auth.transport.requests.Request())
+        credentials = grpc.composite_channel_credentials(
+            grpc.ssl_channel_credentials(), grpc.metadata_call_credentials(metadata_plugin))
+        return grpc.aio.secure_channel(self._api_host + ':443', credentials, options=options)
+
+
+class _Linear16Encoder(object):
+
+    """Sends raw 16-bit signed little-endian samples as they are."""
+
+    encoding = 'LINEAR16'
+
+    def encode(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+def _make_encoder(encoding):
+    """Returns a new streaming encoder for one request."""
+    if encoding == 'FLAC':
+        # numpy is only needed for FLAC, so import it on demand.
+        import aiy._apis._flac as flac
+        return flac.FlacEncoder(AUDIO_SAMPLE_RATE_HZ)
+    return _Linear16Encoder()
 
 
 class GenericSpeechRequest(object):
@@ -80,60 +183,255 @@ class GenericSpeechRequest(object):
     # pylint: disable=attribute-defined-outside-init,too-many-instance-attributes
 
     DEADLINE_SECS = 185
-
-    def __init__(self, api_host, credentials):
+    # How long a request waits for the channel to connect before trying
+    # anyway, so that it fails with the underlying error.
+    CONNECT_TIMEOUT_SECS = 5
+
+    # Audio chunks are queued until the request stream sends them, so ask the
+    # recorder for a copy rather than a view of its ring buffer.
+    keeps_data = True
+
+    def __init__(self, api_host, credentials, channel_factory=None):
+        self._phrases = aiy._apis._phrases.PhraseSet()
+        # Tokens are refreshed before they expire, so that requests don't
+        # wait for it.
+        self._token_refresher = aiy._apis._credentials.TokenRefresher(credentials)
+        self._token_refresher.start()
+        # channel_factory can replace the secure channels to api_host, with
+        # make_channel() and make_async_channel() methods like
+        # _ChannelFactory's, for example to use a local test server.
+        self._channel_factory = channel_factory or _ChannelFactory(api_host, credentials)
+        self._channel = self._create_channel()
+        self._audio_encoding = DEFAULT_AUDIO_ENCODING
+        self._endpointer_cb = None
+        self._local_endpointing = False
+        self._vad_threshold_db = 10.0
+        self._vad_hangover_s = 0.8
+        self._speech_gate_enabled = False
+        self._lead_in_s = 0.3
+        self._no_speech_timeout_s = 5.0
+        self._deadline_s = self.DEADLINE_SECS
+        self._endpoint_stats = EndpointStats()
+        self._stats_lock = threading.Lock()
+        self._audio_log = None
+        # The latest config request, by _get_config_key(). It is shared with
+        # sessions, and only rebuilt when the key changes.
+        self._config_cache = {}
+        self._start_turn()
+
+    def _start_turn(self):
+        """Sets up the state of one turn: the audio queue, endpointers, call
+        and results. Everything else is shared with sessions.
+        """
         self.dialog_follow_on = False
+        self.last_timing = None
         self._audio_queue = queue.Queue()
-        self._phrases = []
-        self._channel_factory = _ChannelFactory(api_host, credentials)
-        self._endpointer_cb = None
-        self._audio_logging_enabled = False
-        self._request_log_wav = None
-
-    def add_phrases(self, phrases):
+        self._encoder = None
+        # Set once audio is released to the request stream, or has ended.
+        self._audio_released = threading.Event()
+        self._endpoints = {}
+        self._endpoints_lock = threading.Lock()
+        self._reset_vad()
+        self._log_entry = None
+        # The call in progress, and whether it was cancelled.
+        self._call = None
+        self._cancelled = False
+        # The _trace.Turn that this turn's stages are marked in.
+        self._trace = None
+
+    def new_session(self):
+        """Returns a request for one turn, with its own audio queue, call and
+        results, which can run while other sessions finish.
+
+        The session shares this request's channel, phrases, audio log and
+        statistics, and starts with its settings and callbacks, which can be
+        changed for the session alone. Unlike reset(), creating a session
+        doesn't disturb a turn that is still running.
+        """
+        session = copy.copy(self)
+        session._start_turn()
+        return session
+
+    def _create_channel(self):
+        # The channel is shared by all requests, and connected now so that
+        # the first one doesn't wait for it.
+        channel = aiy._apis._channel.PersistentChannel(self._channel_factory.make_channel)
+        channel.connect()
+        return channel
+
+    def get_token_stats(self):
+        """Returns RefreshStats for the background token refreshes."""
+        return self._token_refresher.stats
+
+    def get_endpoint_stats(self):
+        """Returns EndpointStats comparing the local and server endpointers."""
+        return self._endpoint_stats
+
+    def add_phrases(self, phrases, priority=0):
         """Makes the recognition more likely to recognize the given phrase(s).
         phrases: an object with a method get_phrases() that returns a list of
                  phrases.
+        priority: if there are more phrases than the API allows, those with a
+                  higher priority are kept.
         """
+        for phrase in phrases.get_phrases():
+            self._phrases.add(phrase, priority)
 
-        self._phrases.extend(phrases.get_phrases())
-
-    def add_phrase(self, phrase):
+    def add_phrase(self, phrase, priority=0):
         """Makes the recognition more likely to recognize the given phrase."""
-        self._phrases.append(phrase)
+        self._phrases.add(phrase, priority)
 
     def set_endpointer_cb(self, cb):
         """Callback to invoke on end of speech."""
         self._endpointer_cb = cb
 
-    def set_audio_logging_enabled(self, audio_logging_enabled=True):
-        self._audio_logging_enabled = audio_logging_enabled
+    def set_trace(self, turn):
+        """Marks the stages of this turn in turn, a _trace.Turn, rather than
+        in the newest one.
+        """
+        self._trace = turn
+
+    def set_local_endpointer_enabled(self, enabled=True, threshold_db=10.0, hangover_s=0.8):
+        """Ends the audio when a local voice activity detector hears the end of
+        speech, instead of waiting a round trip for the server to say so. The
+        server's endpointer still ends the audio if the local one misses the
+        end of speech. Requires numpy.
 
+        Args:
+          threshold_db: how far above the background noise speech must be
+          hangover_s: how long a silence ends the utterance
+        """
+        self._local_endpointing = enabled
+        self._vad_threshold_db = threshold_db
+        self._vad_hangover_s = hangover_s
+        self._reset_vad()
+
+    def set_deadline(self, deadline_s):
+        """Fails requests that take longer than deadline_s in all, including
+        the time the user is speaking, so a stalled network can't keep the
+        caller waiting for minutes. The default is DEADLINE_SECS.
+        """
+        self._deadline_s = deadline_s
+
+    def set_speech_gate_enabled(self, enabled=True, lead_in_s=0.3, no_speech_timeout_s=5.0):
+        """Holds audio back until the user starts speaking, so that leading
+        silence isn't uploaded, and then sends it from lead_in_s before the
+        start of speech. If speech doesn't start within no_speech_timeout_s,
+        the request ends without contacting the server. Speech is detected
+        with the local endpointer's threshold_db. Requires numpy.
+        """
+        self._speech_gate_enabled = enabled
+        self._lead_in_s = lead_in_s
+        self._no_speech_timeout_s = no_speech_timeout_s
+        self._reset_vad()
+
+    def _reset_vad(self):
+        """Sets up voice activity detection for a new request."""
+        self._vad_endpointer = None
+        self._speech_gate = None
+        self._audio_released.clear()
+        if not self._local_endpointing and not self._speech_gate_enabled:
+            return
+
+        # numpy is only needed for voice activity detection, so import it on demand.
+        import aiy._drivers._vad as vad
+        self._vad_endpointer = vad.Endpointer(
+            AUDIO_SAMPLE_RATE_HZ, self._vad_threshold_db, self._vad_hangover_s)
+        if self._speech_gate_enabled:
+            self._speech_gate = vad.SpeechGate(
+                self._vad_endpointer, self._lead_in_s, AUDIO_SAMPLE_RATE_HZ, AUDIO_SAMPLE_SIZE)
+
+    def set_audio_encoding(self, encoding):
+        """Sets how audio is encoded for upload: 'FLAC' or 'LINEAR16'."""
+        if encoding not in AUDIO_ENCODINGS:
+            raise ValueError('unsupported audio encoding: %r' % encoding)
+        self._audio_encoding = encoding
+
+    def set_audio_logging_enabled(self, audio_logging_enabled=True):
+        """Logs requests and responses to an AudioLog with the default
+        settings.
+        """
+        audio_log = None
         if audio_logging_enabled:
-            self._audio_log_dir = tempfile.mkdtemp()
-            self._audio_log_ix = 0
+            audio_log = aiy._apis._audiolog.AudioLog(sample_rate_hz=AUDIO_SAMPLE_RATE_HZ)
+            audio_log.start()
+        self.set_audio_log(audio_log)
+
+    def set_audio_log(self, audio_log):
+        """Logs requests and responses to audio_log, an AudioLog whose writer
+        thread is running, or None to stop logging.
+        """
+        self._audio_log = audio_log
+
+    def get_audio_log(self):
+        """Returns the AudioLog that requests are logged to, or None."""
+        return self._audio_log
 
     def reset(self):
+        """Gets ready for the next turn. Use new_session() instead if the
+        previous turn may still be running.
+        """
+        self._start_turn()
+
+    def add_data(self, data):
+        if not data:
+            self._put_audio(data)
+            self._release_audio()
+            return
+
+        ended = self._vad_endpointer.add_data(data) if self._vad_endpointer else False
+        if self._speech_gate:
+            data = self._speech_gate.add_data(data)
+            if self._speech_gate.is_open:
+                self._release_audio()
+        if data:
+            self._put_audio(data)
+            trace.mark(trace.FIRST_CHUNK, turn=self._trace)
+
+        if ended and self._local_endpointing:
+            logger.info('local endpointer: speech from %.2f s to %.2f s',
+                        self._vad_endpointer.speech_start_s,
+                        self._vad_endpointer.speech_end_s)
+            self._end_audio_request(LOCAL_ENDPOINTER)
+
+    def end_audio(self):
+        self.add_data(None)
+
+    def cancel(self):
+        """Stops the request in progress, from another thread. Queued audio
+        is dropped and the call is cancelled, so do_request() returns an
+        empty result right away instead of waiting for the server. The
+        caller should also stop feeding it audio.
+        """
+        self._cancelled = True
+        self._drain_audio()
+        self.end_audio()
+        call = self._call
+        if call:
+            call.cancel()
+
+    def _drain_audio(self):
+        """Drops audio that hasn't been sent yet."""
         while True:
             try:
-                self._audio_queue.get(False)
+                self._audio_queue.get_nowait()
             except queue.Empty:
                 return
 
-        self.dialog_follow_on = False
-
-    def add_data(self, data):
+    def _put_audio(self, data):
+        """Queues audio for the request stream, from the recorder's thread."""
         self._audio_queue.put(data)
 
-    def end_audio(self):
-        self.add_data(None)
+    def _release_audio(self):
+        """Wakes up a request waiting for speech to start."""
+        self._audio_released.set()
 
     def _get_speech_context(self):
         """Return a SpeechContext instance to bias recognition towards certain
         phrases.
         """
         return cloud_speech.SpeechContext(
-            phrases=self._phrases,
+            phrases=self._phrases.get(),
         )
 
     @abstractmethod
@@ -162,18 +460,46 @@ class GenericSpeechRequest(object):
         """Yields a config request followed by requests constructed from the
         audio queue.
         """
-        yield self._create_config_request()
+        yield self._start_request_stream()
 
         while True:
-            data = self._audio_queue.get()
-
-            if not data:
+            data = self._audio_queue.get() or None
+            if self._cancelled:
+                return
+            for request in self._create_audio_requests(data):
+                yield request
+            if data is None:
                 return
 
-            if self._request_log_wav:
-                self._request_log_wav.writeframes(data)
-
-            yield self._create_audio_request(data)
+    def _get_config_key(self):
+        """Returns what the config request depends on. It is only rebuilt
+        when this changes.
+        """
+        return (self._audio_encoding, self._phrases.version)
+
+    def _start_request_stream(self):
+        """Returns the config request for a new request stream."""
+        self._encoder = _make_encoder(self._audio_encoding)
+        key = self._get_config_key()
+        config_request = self._config_cache.get(key)
+        if config_request is None:
+            config_request = self._create_config_request()
+            self._config_cache.clear()
+            self._config_cache[key] = config_request
+        return config_request
+
+    def _create_audio_requests(self, data):
+        """Returns the requests for a chunk of audio, or for the end of the
+        audio if data is None. Audio is encoded as it arrives, so the upload
+        keeps up with the user speaking.
+        """
+        if data is None:
+            encoded = self._encoder.flush()
+        else:
+            if self._log_entry:
+                self._log_entry.add_request_audio(data)
+            encoded = self._encoder.encode(data)
+        return [self._create_audio_request(encoded)] if encoded else []
 
     @abstractmethod
     def _create_response_stream(self, service, request_stream, deadline):
@@ -199,44 +525,57 @@ class GenericSpeechRequest(object):
         """
         return
 
-    def _end_audio_request(self):
+    def _end_audio_request(self, endpointer=SERVER_ENDPOINTER):
+        """Ends the audio when the first endpointer fires, and records when
+        each one did.
+        """
+        with self._endpoints_lock:
+            first = not self._endpoints
+            self._endpoints.setdefault(endpointer, time.monotonic())
+        if not first:
+            return
+
+        trace.mark(trace.ENDPOINT, turn=self._trace)
         self.end_audio()
         if self._endpointer_cb:
             self._endpointer_cb()
 
     def _handle_response_stream(self, response_stream):
         for resp in response_stream:
-            if resp.error.code != error_code.OK:
-                self._end_audio_request()
-                raise Error('Server error: ' + resp.error.message)
-
-            if self._stop_sending_audio(resp):
-                self._end_audio_request()
-
-            self._handle_response(resp)
+            self._process_response(resp)
 
         # Server has closed the connection
         return self._finish_request() or ''
 
-    def _start_logging_request(self):
-        """Open a WAV file to log the request audio."""
-        self._audio_log_ix += 1
-        request_filename = '%s/request.%03d.wav' % (
-            self._audio_log_dir, self._audio_log_ix)
-        logger.info('Writing request to %s', request_filename)
-
-        self._request_log_wav = wave.open(request_filename, 'w')
-
-        self._request_log_wav.setnchannels(1)
-        self._request_log_wav.setsampwidth(AUDIO_SAMPLE_SIZE)
-        self._request_log_wav.setframerate(AUDIO_SAMPLE_RATE_HZ)
+    def _process_response(self, resp):
+        if resp.error.code != error_code.OK:
+            self._end_audio_request()
+            raise Error('Server error: ' + resp.error.message)
+
+        if self._stop_sending_audio(resp):
+            self._end_audio_request()
+
+        self._handle_response(resp)
+
+    def _start_log_entry(self):
+        """Starts collecting the request's audio, if logging is enabled."""
+        self._log_entry = self._audio_log.start_entry() if self._audio_log else None
+
+    def _finish_log_entry(self, timer, result, outcome):
+        """Hands the request's log entry to the writer thread."""
+        entry, self._log_entry = self._log_entry, None
+        if not entry:
+            return
+        if result and result.response_audio:
+            entry.add_response_audio(result.response_audio)
+        with self._endpoints_lock:
+            endpointers = sorted(self._endpoints, key=self._endpoints.get)
+        entry.finish(api=type(self).__name__, transcript=result.transcript if result else None,
+                     outcome=outcome, timing=timer.to_dict(), endpointers=endpointers,
+                     audio_encoding=self._audio_encoding)
 
     def _finish_request(self):
         """Called after the final response is received."""
-
-        if self._request_log_wav:
-            self._request_log_wav.close()
-
         return _Result(None, None)
 
     def do_request(self):
@@ -249,23 +588,90 @@ class GenericSpeechRequest(object):
                 transcript: string with transcript of user query
                 response_audio: optionally, an audio response from the server
 
-        Raises speech.Error on error.
+        Raises speech.Error on error, or if the request takes longer than
+        its deadline.
         """
+        if self._speech_gate and not self._wait_for_speech():
+            return _Result(None, None)
+        if self._cancelled:
+            logger.info('request cancelled before it started')
+            return _Result(None, None)
+
+        timer = aiy._apis._channel.RequestTimer(self._trace)
+        self.last_timing = timer
+        self._start_log_entry()
+        result = None
+        outcome = 'error'
         try:
-            service = self._make_service(self._channel_factory.make_channel())
+            if not self._channel.wait_ready(self.CONNECT_TIMEOUT_SECS):
+                logger.warning('Channel is not connected, sending the request anyway')
+            timer.channel_ready()
+            service = self._make_service(self._channel.get())
 
             response_stream = self._create_response_stream(
-                service, self._request_stream(), self.DEADLINE_SECS)
-
-            if self._audio_logging_enabled:
-                self._start_logging_request()
-
-            return self._handle_response_stream(response_stream)
+                service, timer.requests(self._request_stream()), self._deadline_s)
+            self._call = response_stream
+            if self._cancelled:
+                response_stream.cancel()
+
+            result = self._handle_response_stream(timer.responses(response_stream))
+            outcome = 'ok'
+            return result
         except (
                 google.auth.exceptions.GoogleAuthError,
                 grpc.RpcError,
         ) as exc:
-            raise Error('Exception in speech request') from exc
+            if self._cancelled:
+                logger.info('request cancelled')
+                outcome = 'cancelled'
+                return _Result(None, None)
+            raise self._request_error(exc) from exc
+        finally:
+            self._call = None
+            timer.finish()
+            logger.info('request timing: %s', timer)
+            self._record_endpoints()
+            self._finish_log_entry(timer, result, outcome)
+
+    def _request_error(self, exc):
+        """Returns the Error to raise for a failed call."""
+        code = getattr(exc, 'code', None)
+        if code and code() == grpc.StatusCode.DEADLINE_EXCEEDED:
+            return Error('Speech request took longer than its %g s deadline' % self._deadline_s)
+        return Error('Exception in speech request')
+
+    def _wait_for_speech(self):
+        """Waits for the speech gate to open. If speech doesn't start in time,
+        ends the audio and returns False.
+        """
+        start = time.monotonic()
+        self._audio_released.wait(self._no_speech_timeout_s)
+        return self._check_speech_started(time.monotonic() - start)
+
+    def _check_speech_started(self, waited_s):
+        """Returns True if the speech gate has opened. Otherwise, ends the
+        audio and records a request without speech.
+        """
+        if self._cancelled:
+            return False
+        if self._speech_gate.is_open:
+            logger.info('speech started after %.2f s, skipped %.2f s of leading audio',
+                        waited_s, self._speech_gate.dropped_bytes /
+                        (AUDIO_SAMPLE_SIZE * AUDIO_SAMPLE_RATE_HZ))
+            return True
+
+        logger.info('no speech after %.1f s, not sending the request', waited_s)
+        self._end_audio_request(NO_SPEECH)
+        self._record_endpoints()
+        return False
+
+    def _record_endpoints(self):
+        with self._endpoints_lock:
+            endpoints = dict(self._endpoints)
+        with self._stats_lock:
+            self._endpoint_stats.add(endpoints)
+        if self._vad_endpointer:
+            logger.info('endpointing: %s', self._endpoint_stats)
 
 
 class CloudSpeechRequest(GenericSpeechRequest):
@@ -274,35 +680,58 @@ class CloudSpeechRequest(GenericSpeechRequest):
 
     Args:
         credentials_file: path to service account credentials JSON file
+        credentials: google.auth credentials to use instead of the file
+        channel_factory: makes channels to a different server, for testing
     """
 
     SCOPE = 'https://www.googleapis.com/auth/cloud-platform'
 
-    def __init__(self, credentials_file):
-        os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = credentials_file
-        credentials, _ = google.auth.default(scopes=[self.SCOPE])
+    def __init__(self, credentials_file, credentials=None, channel_factory=None):
+        if credentials is None:
+            os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = credentials_file
+            credentials, _ = google.auth.default(scopes=[self.SCOPE])
 
-        super().__init__('speech.googleapis.com', credentials)
+        super().__init__('speech.googleapis.com', credentials, channel_factory)
 
         self.language_code = aiy.i18n.get_language_code()
 
         if not hasattr(cloud_speech, 'StreamingRecognizeRequest'):
             raise ValueError("cloud_speech_pb2.py doesn't have StreamingRecognizeRequest.")
 
-        self._transcript = None
+        self._early_action_cbs = None
+        self._min_stability = 0.8
 
-    def reset(self):
-        super().reset()
+    def _start_turn(self):
+        super()._start_turn()
         self._transcript = None
+        # The interim transcript that was handled by early action, if any.
+        self.early_transcript = None
+
+    def set_early_action_cb(self, can_handle_cb, handle_cb, min_stability=0.8):
+        """Runs commands from interim results, before the final transcript.
+
+        When the stable part of an interim transcript is one that
+        can_handle_cb(transcript) accepts, the audio is ended and
+        handle_cb(transcript) is called, once per request. Results with a
+        stability below min_stability (0 to 1) are ignored until they settle.
+        The final transcript is still returned by do_request(), so the caller
+        must not handle it again. Pass None to turn this off.
+        """
+        self._early_action_cbs = (can_handle_cb, handle_cb) if can_handle_cb else None
+        self._min_stability = min_stability
 
     def _make_service(self, channel):
         return cloud_speech.SpeechStub(channel)
 
+    def _get_config_key(self):
+        return super()._get_config_key() + (
+            self.language_code, self._early_action_cbs is not None)
+
     def _create_config_request(self):
         recognition_config = cloud_speech.RecognitionConfig(
             # There are a bunch of config options you can specify. See
             # https://goo.gl/KPZn97 for the full list.
-            encoding='LINEAR16',  # raw 16-bit signed LE samples
+            encoding=self._encoder.encoding,
             sample_rate=AUDIO_SAMPLE_RATE_HZ,
             # For a list of supported languages see:
             # https://cloud.google.com/speech/docs/languages.
@@ -312,6 +741,7 @@ class CloudSpeechRequest(GenericSpeechRequest):
         streaming_config = cloud_speech.StreamingRecognitionConfig(
             config=recognition_config,
             single_utterance=True,  # TODO(rodrigoq): find a way to handle pauses
+            interim_results=self._early_action_cbs is not None,
         )
 
         return cloud_speech.StreamingRecognizeRequest(
@@ -339,7 +769,35 @@ class CloudSpeechRequest(GenericSpeechRequest):
         if resp.results:
             self._transcript = ' '.join(
                 result.alternatives[0].transcript for result in resp.results)
-            logger.info('transcript: %s', self._transcript)
+            if all(result.is_final for result in resp.results):
+                trace.mark(trace.FINAL_TRANSCRIPT, turn=self._trace)
+                logger.info('transcript: %s', self._transcript)
+            else:
+                logger.debug('interim transcript: %s', self._transcript)
+
+            if self._early_action_cbs and self.early_transcript is None:
+                self._try_early_action(resp.results)
+
+    def _try_early_action(self, results):
+        """Handles the stable start of an interim transcript as a command,
+        if it is one.
+        """
+        stable = []
+        for result in results:
+            if not (result.is_final or result.stability >= self._min_stability):
+                break
+            if result.alternatives:
+                stable.append(result.alternatives[0].transcript)
+        transcript = ' '.join(stable).strip()
+
+        can_handle_cb, handle_cb = self._early_action_cbs
+        if not transcript or not can_handle_cb(transcript):
+            return
+
+        logger.info('early action on interim transcript: %s', transcript)
+        self.early_transcript = transcript
+        self._end_audio_request(EARLY_ACTION)
+        handle_cb(transcript)
 
     def _finish_request(self):
         super()._finish_request()
@@ -350,25 +808,41 @@ class AssistantSpeechRequest(GenericSpeechRequest):
 
     """A request to the Assistant API, which returns audio and text."""
 
-    def __init__(self, credentials):
+    def __init__(self, credentials, channel_factory=None):
 
-        super().__init__('embeddedassistant.googleapis.com', credentials)
+        super().__init__('embeddedassistant.googleapis.com', credentials, channel_factory)
 
-        self._conversation_state = None
-        self._response_audio = b''
-        self._transcript = None
+        # The conversation continues across sessions, so its state is kept in
+        # a dict that they share.
+        self._conversation = {'state': None}
+        self._response_stream_cb = None
 
-    def reset(self):
-        super().reset()
-        self._response_audio = b''
+    def _start_turn(self):
+        super()._start_turn()
+        # Response audio chunks, joined at the end of the request.
+        self._response_audio = []
+        self._response_stream = None
         self._transcript = None
 
+    def set_response_stream_cb(self, cb):
+        """Plays the response audio while it downloads.
+
+        When the first response audio arrives, cb is called with the
+        transcript, and returns a stream to write the audio to (like
+        Player.open_stream()) or None to not play it. The caller closes the
+        stream. All of the audio is still returned in the result.
+        """
+        self._response_stream_cb = cb
+
     def _make_service(self, channel):
         return embedded_assistant_pb2.EmbeddedAssistantStub(channel)
 
+    def _get_config_key(self):
+        return super()._get_config_key() + (self._conversation['state'],)
+
     def _create_config_request(self):
         audio_in_config = embedded_assistant_pb2.AudioInConfig(
-            encoding='LINEAR16',
+            encoding=self._encoder.encoding,
             sample_rate_hertz=AUDIO_SAMPLE_RATE_HZ,
         )
         audio_out_config = embedded_assistant_pb2.AudioOutConfig(
@@ -377,7 +851,7 @@ class AssistantSpeechRequest(GenericSpeechRequest):
             volume_percentage=50,
         )
         converse_state = embedded_assistant_pb2.ConverseState(
-            conversation_state=self._conversation_state,
+            conversation_state=self._conversation['state'],
         )
         converse_config = embedded_assistant_pb2.ConverseConfig(
             audio_in_config=audio_in_config,
@@ -401,43 +875,71 @@ class AssistantSpeechRequest(GenericSpeechRequest):
                 embedded_assistant_pb2.ConverseResponse.END_OF_UTTERANCE)
 
     def _handle_response(self, resp):
-        """Accumulate audio and text from the remote end. It will be handled
-        in _finish_request().
+        """Accumulate audio and text from the remote end. Audio is streamed
+        to playback if set_response_stream_cb() was called, and everything is
+        returned from _finish_request().
         """
 
         if resp.result.spoken_request_text:
+            trace.mark(trace.FINAL_TRANSCRIPT, turn=self._trace)
             logger.info('transcript: %s', resp.result.spoken_request_text)
             self._transcript = resp.result.spoken_request_text
 
-        self._response_audio += resp.audio_out.audio_data
+        if resp.audio_out.audio_data:
+            self._add_response_audio(resp.audio_out.audio_data)
 
         if resp.result.conversation_state:
-            self._conversation_state = resp.result.conversation_state
+            self._conversation['state'] = resp.result.conversation_state
 
         if resp.result.microphone_mode:
             self.dialog_follow_on = (
                 resp.result.microphone_mode ==
                 embedded_assistant_pb2.ConverseResult.DIALOG_FOLLOW_ON)
 
+    def _add_response_audio(self, data):
+        if not self._response_audio:
+            self.last_timing.first_audio()
+            if self._response_stream_cb:
+                self._response_stream = self._response_stream_cb(self._transcript)
+
+        self._response_audio.append(data)
+        if self._response_stream:
+            self._response_stream.write(data)
+
     def _finish_request(self):
         super()._finish_request()
+        return _Result(self._transcript, b''.join(self._response_audio))
+
+
+class RecordingSession(object):
 
-        if self._response_audio and self._audio_logging_enabled:
-            self._log_audio_out(self._response_audio)
+    """A new session of a request, fed audio by a recorder.
 
-        return _Result(self._transcript, self._response_audio)
+    The recorder stops feeding the session when its endpointer fires, when
+    it is cancelled, or when stop_recording() is called after the request,
+    whichever comes first.
+    """
+
+    def __init__(self, request, recorder, preroll=True):
+        self.session = request.new_session()
+        self._recorder = recorder
+        self._lock = threading.Lock()
+        self._recording = True
+        self.session.set_endpointer_cb(self.stop_recording)
+        recorder.add_processor(self.session, preroll=preroll)
+
+    def stop_recording(self):
+        with self._lock:
+            if not self._recording:
+                return
+            self._recording = False
+        self._recorder.remove_processor(self.session)
 
-    def _log_audio_out(self, frames):
-        response_filename = '%s/response.%03d.wav' % (
-            self._audio_log_dir, self._audio_log_ix)
-        logger.info('Writing response to %s', response_filename)
+    def cancel(self):
+        """Stops recording and cancels the request, from any thread."""
+        self.stop_recording()
+        self.session.cancel()
 
-        response_wav = wave.open(response_filename, 'w')
-        response_wav.setnchannels(1)
-        response_wav.setsampwidth(AUDIO_SAMPLE_SIZE)
-        response_wav.setframerate(AUDIO_SAMPLE_RATE_HZ)
-        response_wav.writeframes(frames)
-        response_wav.close()
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
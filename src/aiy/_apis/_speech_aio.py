@@ -0,0 +1,169 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""asyncio versions of the speech requests, built on grpc.aio.
+
+The request and response streams are async iterators, and audio from the
+recorder's thread is handed to the event loop by an AudioBridge, so a request
+doesn't tie up a thread while it waits for the user or the server.
+"""
+
+import asyncio
+import logging
+import time
+
+import google.auth.exceptions
+import grpc
+
+import aiy._apis._aio
+import aiy._apis._channel
+import aiy._apis._speech
+from aiy._apis._speech import _Result
+
+logger = logging.getLogger('speech')
+
+
+class _AsyncRequestMixin(object):
+
+    """Replaces the blocking parts of a GenericSpeechRequest.
+
+    reset() or new_session() must be called in the event loop's thread before
+    each request, which binds the request to that loop.
+    """
+
+    _bridge = None
+    _speech_started = None
+
+    def _create_channel(self):
+        return aiy._apis._aio.AsyncChannel(
+            self._channel_factory.make_async_channel, aiy._apis._channel.keepalive_options())
+
+    def reset(self):
+        super().reset()
+        self._bind_loop()
+
+    def new_session(self):
+        session = super().new_session()
+        session._bind_loop()
+        return session
+
+    def _bind_loop(self):
+        self._bridge = aiy._apis._aio.AudioBridge()
+        self._speech_started = asyncio.Event()
+
+    def _put_audio(self, data):
+        self._bridge.put(data)
+
+    def cancel(self):
+        """Like GenericSpeechRequest.cancel(). It can be called from any
+        thread, and the call is cancelled in the event loop.
+        """
+        self._cancelled = True
+        self._bridge.close()
+        self._release_audio()
+        call = self._call
+        if call:
+            self._bridge.call_soon(call.cancel)
+
+    def _release_audio(self):
+        self._bridge.call_soon(self._speech_started.set)
+
+    async def _request_stream(self):
+        yield self._start_request_stream()
+
+        async for data in self._bridge:
+            if self._cancelled:
+                return
+            for request in self._create_audio_requests(data):
+                yield request
+
+        for request in self._create_audio_requests(None):
+            yield request
+
+    async def do_request(self):
+        """Like GenericSpeechRequest.do_request(), but a coroutine."""
+        if self._speech_gate and not await self._wait_for_speech():
+            return _Result(None, None)
+        if self._cancelled:
+            logger.info('request cancelled before it started')
+            return _Result(None, None)
+
+        timer = aiy._apis._channel.RequestTimer(self._trace)
+        self.last_timing = timer
+        self._start_log_entry()
+        result = None
+        outcome = 'error'
+        try:
+            if not await self._channel.wait_ready(self.CONNECT_TIMEOUT_SECS):
+                logger.warning('Channel is not connected, sending the request anyway')
+            timer.channel_ready()
+            service = self._make_service(self._channel.get())
+
+            response_stream = self._create_response_stream(
+                service, aiy._apis._aio.timed_requests(timer, self._request_stream()),
+                self._deadline_s)
+            self._call = response_stream
+            if self._cancelled:
+                response_stream.cancel()
+
+            async for resp in aiy._apis._aio.timed_responses(timer, response_stream):
+                self._process_response(resp)
+
+            # Server has closed the connection
+            result = self._finish_request() or ''
+            outcome = 'ok'
+            return result
+        except asyncio.CancelledError:
+            # A cancelled grpc.aio call raises this in the coroutine that
+            # reads it.
+            if not self._cancelled:
+                raise
+            logger.info('request cancelled')
+            outcome = 'cancelled'
+            return _Result(None, None)
+        except (
+                google.auth.exceptions.GoogleAuthError,
+                grpc.RpcError,
+        ) as exc:
+            if self._cancelled:
+                logger.info('request cancelled')
+                outcome = 'cancelled'
+                return _Result(None, None)
+            raise self._request_error(exc) from exc
+        finally:
+            self._call = None
+            timer.finish()
+            logger.info('request timing: %s', timer)
+            self._record_endpoints()
+            self._finish_log_entry(timer, result, outcome)
+
+    async def _wait_for_speech(self):
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(self._speech_started.wait(), self._no_speech_timeout_s)
+        except asyncio.TimeoutError:
+            pass
+        return self._check_speech_started(time.monotonic() - start)
+
+    async def close(self):
+        """Closes the channel. It is opened again by the next request."""
+        await self._channel.close()
+
+
+class AsyncCloudSpeechRequest(_AsyncRequestMixin, aiy._apis._speech.CloudSpeechRequest):
+    pass
+
+
+class AsyncAssistantSpeechRequest(_AsyncRequestMixin, aiy._apis._speech.AssistantSpeechRequest):
+    pass
@@ -0,0 +1,177 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per-turn latency tracing, from the trigger to the first playback.
+
+Each stage of a voice turn calls mark(), which records the time since the
+trigger the first time the stage is reached in the turn. Turns can overlap,
+so code that knows its turn passes it to mark(); the others mark the newest
+turn. end_turn() appends the turn to a JSONL file, which
+checkpoints/trace_summary.py summarizes. Until enable() is called, mark()
+only checks a global, so the calls can stay in the audio and request paths.
+"""
+
+import json
+import threading
+import time
+
+# Stages of a turn, in the order they usually happen.
+TRIGGER = 'trigger'
+FIRST_CHUNK = 'first_chunk'
+FIRST_REQUEST = 'first_request'
+ENDPOINT = 'endpoint'
+FINAL_TRANSCRIPT = 'final_transcript'
+ACTION_START = 'action_start'
+ACTION_END = 'action_end'
+TTS_START = 'tts_start'
+TTS_END = 'tts_end'
+FIRST_PLAYBACK = 'first_playback'
+
+STAGES = (TRIGGER, FIRST_CHUNK, FIRST_REQUEST, ENDPOINT, FINAL_TRANSCRIPT,
+          ACTION_START, ACTION_END, TTS_START, TTS_END, FIRST_PLAYBACK)
+
+# Stages that only count once another has been reached. Playback before the
+# end of speech is the trigger sound, not the response.
+_REQUIRES = {
+    FIRST_PLAYBACK: ENDPOINT,
+}
+
+_tracer = None
+
+
+class Turn(object):
+
+    """The stage times of one turn, in seconds from the trigger."""
+
+    def __init__(self):
+        self._origin = time.monotonic()
+        self.start_time = time.time()
+        self.stages = {TRIGGER: 0.0}
+
+    def mark(self, stage, when=None):
+        if stage in self.stages:
+            return
+        required = _REQUIRES.get(stage)
+        if required and required not in self.stages:
+            return
+        self.stages[stage] = (time.monotonic() if when is None else when) - self._origin
+
+
+class Tracer(object):
+
+    """Writes one JSON line per turn to path."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+        self.turn = None
+
+    def start_turn(self):
+        self.turn = Turn()
+        return self.turn
+
+    def end_turn(self, turn=None, **attributes):
+        if turn is None:
+            turn = self.turn
+        if turn is self.turn:
+            self.turn = None
+        if turn is None:
+            return
+        record = dict(attributes, time=turn.start_time,
+                      stages={stage: round(t, 4) for stage, t in turn.stages.items()})
+        with self._lock:
+            self._file.write(json.dumps(record, sort_keys=True) + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def enable(path):
+    """Starts tracing turns to the JSONL file at path."""
+    global _tracer
+    disable()
+    _tracer = Tracer(path)
+
+
+def disable():
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer:
+        tracer.close()
+
+
+def start_turn():
+    """Starts a new turn at the trigger, and returns it, or None if tracing
+    is disabled. Marks without a turn go to the newest turn.
+    """
+    if _tracer is not None:
+        return _tracer.start_turn()
+    return None
+
+
+def mark(stage, when=None, turn=None):
+    """Records that turn, or the newest turn, reached stage, now or at the
+    time.monotonic() given as when. Only the first time counts.
+    """
+    if _tracer is not None:
+        if turn is None:
+            turn = _tracer.turn
+        if turn is not None:
+            turn.mark(stage, when)
+
+
+def end_turn(turn=None, **attributes):
+    """Writes turn, or the current turn, with any JSON-serializable
+    attributes. A turn that overlapped a newer one can still be written.
+    """
+    if _tracer is not None:
+        _tracer.end_turn(turn, **attributes)
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def summarize(records, percentiles=(50, 95, 99)):
+    """Returns (stage, count, [percentiles of seconds since the trigger],
+    [percentiles of seconds since the previous stage reached]) for each stage
+    in the records, in STAGES order.
+    """
+    since_trigger = {}
+    since_previous = {}
+    for record in records:
+        stages = record['stages']
+        previous = None
+        for stage in STAGES:
+            if stage not in stages:
+                continue
+            since_trigger.setdefault(stage, []).append(stages[stage])
+            if previous is not None:
+                since_previous.setdefault(stage, []).append(stages[stage] - stages[previous])
+            previous = stage
+
+    summary = []
+    for stage in STAGES:
+        if stage not in since_trigger:
+            continue
+        deltas = since_previous.get(stage)
+        summary.append((
+            stage, len(since_trigger[stage]),
+            [_percentile(since_trigger[stage], p) for p in percentiles],
+            [_percentile(deltas, p) for p in percentiles] if deltas else None))
+    return summary
@@ -0,0 +1,284 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Share captured audio with other processes through a memory-mapped ring.
+
+The Recorder can publish the audio it captures to a file, normally on tmpfs,
+that other processes map into memory and read from without any copying
+through pipes. The file starts with a header, followed by the ring:
+
+  magic, sample rate, channels, bytes per sample, ring size, writer pid,
+  closed flag, sequence, committed position, reserved position
+
+Positions are byte counts since the writer started. Before writing, the
+writer advances the reserved position, so readers know which part of the ring
+is being overwritten, and once the data is written it advances the committed
+position. The positions are updated under a sequence lock: the sequence is
+odd while they are being changed, so readers retry rather than see a torn
+update.
+"""
+
+import mmap
+import os
+import struct
+import tempfile
+import time
+import wave
+
+MAGIC = b'AIYBUS1\0'
+
+# Where the Recorder publishes audio unless told otherwise. The path is fixed,
+# so the service started at boot and tools run from a login session find the
+# same bus. /dev/shm is tmpfs, and unlike /run/user it exists without a
+# session.
+DEFAULT_PATH = '/dev/shm/aiy-audio-bus'
+
+_HEADER = struct.Struct('<8sIIIIII')
+_POSITIONS = struct.Struct('<QQQ')  # sequence, committed, reserved
+_CLOSED_OFFSET = _HEADER.size - 4
+_POSITIONS_OFFSET = 40
+HEADER_SIZE = 64
+
+
+class Error(Exception):
+    pass
+
+
+class Overrun(Error):
+
+    """Raised when the writer overwrote audio before the reader read it."""
+
+    def __init__(self, missing_bytes):
+        super().__init__('reader fell behind, %d bytes were lost' % missing_bytes)
+        self.missing_bytes = missing_bytes
+
+
+class AudioBusWriter(object):
+
+    """An audio processor that publishes the audio it receives to a bus file.
+
+    The file is created under a temporary name and renamed into place, so
+    readers never see it half initialized. It is only accessible to the user
+    that created it.
+    """
+
+    def __init__(self, path=None, sample_rate_hz=16000, channels=1, bytes_per_sample=2,
+                 capacity_s=10):
+        self.path = path or DEFAULT_PATH
+        frame_size = channels * bytes_per_sample
+        self._capacity = int(capacity_s * sample_rate_hz) * frame_size
+        self._position = 0
+        self._sequence = 0
+
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(self.path), prefix='.' + os.path.basename(self.path))
+        try:
+            os.ftruncate(fd, HEADER_SIZE + self._capacity)
+            self._map = mmap.mmap(fd, HEADER_SIZE + self._capacity)
+            self._inode = os.fstat(fd).st_ino
+        finally:
+            os.close(fd)
+
+        _HEADER.pack_into(self._map, 0, MAGIC, sample_rate_hz, channels, bytes_per_sample,
+                          self._capacity, os.getpid(), 0)
+        self._publish(0, 0)
+        os.rename(temp_path, self.path)
+
+    def _publish(self, committed, reserved):
+        self._sequence += 1
+        struct.pack_into('<Q', self._map, _POSITIONS_OFFSET, self._sequence)
+        _POSITIONS.pack_into(self._map, _POSITIONS_OFFSET, self._sequence, committed, reserved)
+        self._sequence += 1
+        struct.pack_into('<Q', self._map, _POSITIONS_OFFSET, self._sequence)
+
+    def add_data(self, data):
+        data = memoryview(data).cast('B')
+        end = self._position + len(data)
+        if len(data) > self._capacity:
+            data = data[len(data) - self._capacity:]
+        start = end - len(data)
+
+        self._publish(self._position, end)
+        offset = start % self._capacity
+        first = min(len(data), self._capacity - offset)
+        self._map[HEADER_SIZE + offset:HEADER_SIZE + offset + first] = data[:first]
+        if first < len(data):
+            self._map[HEADER_SIZE:HEADER_SIZE + len(data) - first] = data[first:]
+        self._publish(end, end)
+        self._position = end
+
+    def close(self):
+        """Tells readers the stream has ended and removes the bus file."""
+        if self._map.closed:
+            return
+        struct.pack_into('<I', self._map, _CLOSED_OFFSET, 1)
+        self._map.close()
+        try:
+            # Leave the file alone if another writer has replaced it.
+            if os.stat(self.path).st_ino == self._inode:
+                os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class AudioBusReader(object):
+
+    """Reads audio published by an AudioBusWriter, possibly in another process.
+
+    A new reader starts with the live audio, or with the oldest audio still in
+    the ring if from_oldest is True. If it falls behind by more than the ring
+    size, reads raise Overrun and the reader skips ahead to the oldest audio
+    that is still intact, so the next read carries on from there.
+
+    Reads return b'' once the writer has closed the bus or died, and all
+    audio has been read. A new writer creates a new file, so readers have to
+    be reopened to follow it.
+    """
+
+    # How often a blocking read checks for new audio.
+    POLL_S = 0.01
+
+    def __init__(self, path=None, from_oldest=False):
+        self.path = path or DEFAULT_PATH
+        with open(self.path, 'rb') as bus_file:
+            self._map = mmap.mmap(bus_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._map) < HEADER_SIZE:
+            self._map.close()
+            raise Error('%s is not an audio bus' % self.path)
+        (magic, self.sample_rate_hz, self.channels, self.bytes_per_sample,
+         self.capacity, self._writer_pid, _) = _HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            self._map.close()
+            raise Error('%s is not an audio bus' % self.path)
+
+        self.frame_size = self.channels * self.bytes_per_sample
+        self.overruns = 0
+        self.missing_bytes = 0
+
+        committed, reserved = self._positions()
+        if from_oldest:
+            self._position = max(0, reserved - self.capacity)
+        else:
+            self._position = committed
+
+    def _positions(self):
+        """Returns the committed and reserved positions."""
+        while True:
+            sequence, committed, reserved = _POSITIONS.unpack_from(self._map, _POSITIONS_OFFSET)
+            if not sequence & 1:
+                check, = struct.unpack_from('<Q', self._map, _POSITIONS_OFFSET)
+                if check == sequence:
+                    return committed, reserved
+            time.sleep(0)
+
+    def _is_closed(self):
+        if struct.unpack_from('<I', self._map, _CLOSED_OFFSET)[0]:
+            return True
+        try:
+            os.kill(self._writer_pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+    def available(self):
+        """Returns how many bytes can be read without blocking."""
+        committed, _ = self._positions()
+        return committed - self._position
+
+    def read_nowait(self, size):
+        """Returns up to size bytes of the audio available now, which may be
+        b''. size is rounded down to whole frames.
+        """
+        committed, reserved = self._positions()
+        self._check_overrun(reserved)
+
+        count = min(size, committed - self._position)
+        count -= count % self.frame_size
+        if count <= 0:
+            return b''
+
+        offset = self._position % self.capacity
+        first = min(count, self.capacity - offset)
+        data = self._map[HEADER_SIZE + offset:HEADER_SIZE + offset + first]
+        if first < count:
+            data += self._map[HEADER_SIZE:HEADER_SIZE + count - first]
+
+        # The writer may have started overwriting the audio while it was
+        # being copied.
+        _, reserved = self._positions()
+        self._check_overrun(reserved)
+        self._position += count
+        return data
+
+    def read(self, size, timeout=None):
+        """Waits until size bytes are available and returns them.
+
+        Returns fewer bytes if the timeout (in seconds) expires, or the writer
+        closes the bus, first.
+        """
+        size -= size % self.frame_size
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.available() < size:
+            if self._is_closed():
+                break
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                time.sleep(min(self.POLL_S, remaining))
+            else:
+                time.sleep(self.POLL_S)
+        return self.read_nowait(size)
+
+    def record_to_wave(self, filepath, duration):
+        """Records duration seconds of audio from now on to a wave file."""
+        # Skip the audio published before the call.
+        self.read_nowait(self.available())
+        data = self.read(int(duration * self.sample_rate_hz) * self.frame_size,
+                         timeout=duration + 1)
+        with wave.open(filepath, 'wb') as wav:
+            wav.setnchannels(self.channels)
+            wav.setsampwidth(self.bytes_per_sample)
+            wav.setframerate(self.sample_rate_hz)
+            wav.writeframes(data)
+
+    def _check_overrun(self, reserved):
+        oldest = reserved - self.capacity
+        if self._position >= oldest:
+            return
+
+        missing = oldest - self._position
+        missing += -missing % self.frame_size
+        self._position += missing
+        self.overruns += 1
+        self.missing_bytes += missing
+        raise Overrun(missing)
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,311 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Capture backends that read raw audio samples for the Recorder.
+
+A backend has the following methods:
+
+  open(): starts capturing.
+  readinto(buf): fills buf with up to len(buf) bytes of interleaved samples
+    and returns the number of bytes read, or 0 once the backend has stopped
+    or reached the end of its input.
+  stop(): makes readinto() return 0 soon. Safe to call from any thread.
+  close(): releases the device. Called from the thread that reads.
+
+It may also have these attributes, which the Recorder uses to tell audio the
+backend lost from reads that were merely late:
+
+  buffer_s: how many seconds of audio it can hold while it isn't read.
+  overruns: how many times it has reported losing audio.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import subprocess
+import threading
+
+import aiy._drivers._alsa
+
+logger = logging.getLogger('recorder')
+
+
+class Error(Exception):
+    pass
+
+
+class ArecordBackend(object):
+
+    """Captures audio by reading the stdout pipe of an arecord subprocess."""
+
+    # arecord's ALSA buffer, unless buffer_frames is given, is at most 500 ms.
+    DEFAULT_BUFFER_S = 0.5
+    # Linux's default pipe capacity. arecord keeps writing into the pipe
+    # until it is full.
+    PIPE_BYTES = 65536
+
+    def __init__(self, input_device='default', channels=1, bytes_per_sample=2,
+                 sample_rate_hz=16000, period_frames=None, buffer_frames=None):
+        alsa_buffer_s = (buffer_frames / sample_rate_hz if buffer_frames
+                         else self.DEFAULT_BUFFER_S)
+        self.buffer_s = alsa_buffer_s + self.PIPE_BYTES / (
+            sample_rate_hz * channels * bytes_per_sample)
+
+        self._cmd = [
+            'arecord',
+            '-q',
+            '-t', 'raw',
+            '-D', input_device,
+            '-c', str(channels),
+            '-f', aiy._drivers._alsa.sample_width_to_string(bytes_per_sample),
+            '-r', str(sample_rate_hz),
+        ]
+        if period_frames:
+            self._cmd.append('--period-size=%d' % period_frames)
+        if buffer_frames:
+            self._cmd.append('--buffer-size=%d' % buffer_frames)
+
+        self._arecord = None
+
+    def open(self):
+        # Unbuffered, so that readinto() reads from the pipe straight into the
+        # caller's buffer.
+        self._arecord = subprocess.Popen(self._cmd, stdout=subprocess.PIPE, bufsize=0)
+
+    def readinto(self, buf):
+        return self._arecord.stdout.readinto(buf) or 0
+
+    def stop(self):
+        if self._arecord:
+            self._arecord.kill()
+
+    def close(self):
+        if self._arecord:
+            self._arecord.kill()
+            self._arecord.stdout.close()
+            self._arecord.wait()
+            self._arecord = None
+
+
+class AlsaBackend(object):
+
+    """Captures audio in-process through libasound.
+
+    The PCM is opened with mmap access when the device supports it, falling
+    back to read/write access. Overruns are recovered from and logged rather
+    than stopping the capture.
+    """
+
+    # Constants from alsa/pcm.h.
+    _STREAM_CAPTURE = 1
+    _ACCESS_MMAP_INTERLEAVED = 0
+    _ACCESS_RW_INTERLEAVED = 3
+    _FORMATS = {1: 0, 2: 2, 4: 10}  # bytes per sample -> S8, S16_LE, S32_LE
+
+    # How long readinto() waits for data before checking if it was stopped.
+    WAIT_MS = 200
+
+    _lib = None
+
+    def __init__(self, input_device='default', channels=1, bytes_per_sample=2,
+                 sample_rate_hz=16000, period_frames=None, buffer_frames=None):
+        if bytes_per_sample not in self._FORMATS:
+            raise ValueError('unsupported sample width: %d' % bytes_per_sample)
+
+        self._device = input_device
+        self._channels = channels
+        self._bytes_per_sample = bytes_per_sample
+        self._frame_bytes = channels * bytes_per_sample
+        self._sample_rate_hz = sample_rate_hz
+        self._period_frames = period_frames
+        self._buffer_frames = buffer_frames
+
+        self._pcm = None
+        self._readi = None
+        self._stopped = threading.Event()
+        # Known once the device is open.
+        self.buffer_s = None
+        self.overruns = 0
+
+    @classmethod
+    def _load_library(cls):
+        if cls._lib is None:
+            path = ctypes.util.find_library('asound')
+            if not path:
+                raise Error('libasound not found')
+            lib = ctypes.CDLL(path)
+            lib.snd_strerror.restype = ctypes.c_char_p
+            lib.snd_pcm_readi.restype = ctypes.c_long
+            lib.snd_pcm_readi.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_ulong]
+            lib.snd_pcm_mmap_readi.restype = ctypes.c_long
+            lib.snd_pcm_mmap_readi.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_ulong]
+            cls._lib = lib
+        return cls._lib
+
+    def _check(self, result, what):
+        if result < 0:
+            message = self._lib.snd_strerror(result).decode('utf-8', 'replace')
+            raise Error('%s failed: %s' % (what, message))
+        return result
+
+    def open(self):
+        lib = self._load_library()
+        self._stopped.clear()
+
+        pcm = ctypes.c_void_p()
+        self._check(lib.snd_pcm_open(ctypes.byref(pcm), self._device.encode('utf-8'),
+                                     self._STREAM_CAPTURE, 0), 'snd_pcm_open')
+        self._pcm = pcm
+
+        params = ctypes.c_void_p()
+        self._check(lib.snd_pcm_hw_params_malloc(ctypes.byref(params)),
+                    'snd_pcm_hw_params_malloc')
+        try:
+            self._set_hw_params(lib, params)
+        except Error:
+            lib.snd_pcm_close(self._pcm)
+            self._pcm = None
+            raise
+        finally:
+            lib.snd_pcm_hw_params_free(params)
+
+    def _set_hw_params(self, lib, params):
+        pcm = self._pcm
+        self._check(lib.snd_pcm_hw_params_any(pcm, params), 'snd_pcm_hw_params_any')
+
+        if lib.snd_pcm_hw_params_set_access(pcm, params, self._ACCESS_MMAP_INTERLEAVED) == 0:
+            self._readi = lib.snd_pcm_mmap_readi
+        else:
+            logger.info('%s does not support mmap access, using read access', self._device)
+            self._check(lib.snd_pcm_hw_params_set_access(pcm, params, self._ACCESS_RW_INTERLEAVED),
+                        'snd_pcm_hw_params_set_access')
+            self._readi = lib.snd_pcm_readi
+
+        self._check(lib.snd_pcm_hw_params_set_format(
+            pcm, params, self._FORMATS[self._bytes_per_sample]), 'snd_pcm_hw_params_set_format')
+        self._check(lib.snd_pcm_hw_params_set_channels(pcm, params, self._channels),
+                    'snd_pcm_hw_params_set_channels')
+
+        rate = ctypes.c_uint(self._sample_rate_hz)
+        self._check(lib.snd_pcm_hw_params_set_rate_near(pcm, params, ctypes.byref(rate), None),
+                    'snd_pcm_hw_params_set_rate_near')
+        if rate.value != self._sample_rate_hz:
+            raise Error('%s does not support %d Hz (nearest is %d Hz)' % (
+                self._device, self._sample_rate_hz, rate.value))
+
+        if self._period_frames:
+            period = ctypes.c_ulong(self._period_frames)
+            self._check(lib.snd_pcm_hw_params_set_period_size_near(
+                pcm, params, ctypes.byref(period), None), 'snd_pcm_hw_params_set_period_size_near')
+            logger.info('capture period: %d frames', period.value)
+        if self._buffer_frames:
+            buffer_size = ctypes.c_ulong(self._buffer_frames)
+            self._check(lib.snd_pcm_hw_params_set_buffer_size_near(
+                pcm, params, ctypes.byref(buffer_size)), 'snd_pcm_hw_params_set_buffer_size_near')
+            logger.info('capture buffer: %d frames', buffer_size.value)
+
+        self._check(lib.snd_pcm_hw_params(pcm, params), 'snd_pcm_hw_params')
+
+        buffer_size = ctypes.c_ulong()
+        if lib.snd_pcm_hw_params_get_buffer_size(params, ctypes.byref(buffer_size)) == 0:
+            self.buffer_s = buffer_size.value / self._sample_rate_hz
+
+    def readinto(self, buf):
+        frames = len(buf) // self._frame_bytes
+        if not frames:
+            raise ValueError('buffer is smaller than one frame')
+        target = (ctypes.c_char * len(buf)).from_buffer(buf)
+
+        while not self._stopped.is_set():
+            ready = self._lib.snd_pcm_wait(self._pcm, self.WAIT_MS)
+            if ready == 0:
+                continue  # Timed out, check if we were stopped.
+            if ready > 0:
+                result = self._readi(self._pcm, target, frames)
+                if result > 0:
+                    return result * self._frame_bytes
+                if result == 0:
+                    continue
+            else:
+                result = ready
+
+            # Most likely an overrun (-EPIPE): recover and carry on.
+            if result == -errno.EPIPE:
+                self.overruns += 1
+            logger.warning('capture error: %s',
+                           self._lib.snd_strerror(result).decode('utf-8', 'replace'))
+            self._check(self._lib.snd_pcm_recover(self._pcm, result, 1), 'snd_pcm_recover')
+
+        return 0
+
+    def stop(self):
+        self._stopped.set()
+
+    def close(self):
+        self._stopped.set()
+        if self._pcm:
+            self._lib.snd_pcm_close(self._pcm)
+            self._pcm = None
+
+
+class FileBackend(object):
+
+    """Captures audio from a file, a file-like object or an iterable of chunks.
+
+    This is mostly useful for tests and benchmarks. readinto() returns 0 once
+    the input is exhausted, as if the microphone had died.
+    """
+
+    def __init__(self, source):
+        self._source = source
+        self._file = None
+        self._chunks = None
+        self._pending = b''
+        self._stopped = False
+
+    def open(self):
+        self._stopped = False
+        if isinstance(self._source, str):
+            self._file = open(self._source, 'rb')
+        elif hasattr(self._source, 'readinto'):
+            self._file = self._source
+        else:
+            self._chunks = iter(self._source)
+
+    def readinto(self, buf):
+        if self._stopped:
+            return 0
+
+        if self._file:
+            return self._file.readinto(buf) or 0
+
+        while not self._pending:
+            try:
+                self._pending = memoryview(next(self._chunks)).cast('B')
+            except StopIteration:
+                return 0
+
+        count = min(len(buf), len(self._pending))
+        buf[:count] = self._pending[:count]
+        self._pending = self._pending[count:]
+        return count
+
+    def stop(self):
+        self._stopped = True
+
+    def close(self):
+        if self._file and isinstance(self._source, str):
+            self._file.close()
+        self._file = None
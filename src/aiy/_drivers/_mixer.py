@@ -0,0 +1,122 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Mix multichannel microphone audio down to mono."""
+
+import numpy as np
+
+AVERAGE = 'average'
+BEST_CHANNEL = 'best-channel'
+BEAMFORM = 'beamform'
+
+MODES = (AVERAGE, BEST_CHANNEL, BEAMFORM)
+
+
+class ChannelMixer(object):
+
+    """Mixes chunks of interleaved 16-bit samples down to one channel.
+
+    The mixing modes are:
+    - AVERAGE: the mean of all channels.
+    - BEST_CHANNEL: the channel with the most energy in the chunk. A new
+      channel is only picked if it is SWITCH_RATIO times louder, to avoid
+      flapping between channels of similar level.
+    - BEAMFORM: delay-and-sum. The delay of each channel relative to the first
+      is estimated by cross-correlation over +/- max_delay samples, and the
+      aligned channels are averaged. Delays are only re-estimated on chunks
+      loud enough to hold speech.
+
+    State is kept between chunks, so consecutive chunks of one stream must be
+    mixed by the same mixer.
+    """
+
+    SWITCH_RATIO = 1.25
+    # Mean square level (of 16-bit samples) below which a chunk is treated as
+    # background noise and doesn't update the beamformer's delays.
+    MIN_BEAMFORM_ENERGY = 100.0 ** 2
+
+    def __init__(self, channels, mode=AVERAGE, max_delay=4):
+        if mode not in MODES:
+            raise ValueError('unknown mix mode: %r' % mode)
+        if channels < 2:
+            raise ValueError('mixing needs at least two channels')
+
+        self._channels = channels
+        self._mode = mode
+        self._max_delay = max_delay
+
+        self._best_channel = 0
+        self.delays = np.zeros(channels, dtype=int)
+        # The last 2 * max_delay input samples, so channels can be delayed
+        # across chunk boundaries.
+        self._history = np.zeros((2 * max_delay, channels), dtype=np.float32)
+
+    def mix_into(self, data, out):
+        """Mixes interleaved samples from data into the mono buffer out.
+
+        out must have room for len(data) // channels bytes.
+        """
+        samples = np.frombuffer(data, dtype=np.int16).reshape(-1, self._channels)
+        mono = np.frombuffer(out, dtype=np.int16)
+
+        if self._mode == AVERAGE:
+            np.floor_divide(samples.sum(axis=1, dtype=np.int32), self._channels,
+                            out=mono, casting='unsafe')
+        elif self._mode == BEST_CHANNEL:
+            mono[:] = samples[:, self._pick_best_channel(samples)]
+        else:
+            mono[:] = self._delay_and_sum(samples.astype(np.float32))
+
+    def mix(self, data):
+        """Returns the mono mix of data as bytes."""
+        out = bytearray(len(data) // self._channels)
+        self.mix_into(data, out)
+        return bytes(out)
+
+    def _pick_best_channel(self, samples):
+        energy = np.einsum('ij,ij->j', samples, samples, dtype=np.float64)
+        best = int(np.argmax(energy))
+        if energy[best] > energy[self._best_channel] * self.SWITCH_RATIO:
+            self._best_channel = best
+        return self._best_channel
+
+    def _estimate_delays(self, samples):
+        """Estimates each channel's delay relative to channel 0, in samples."""
+        length = samples.shape[0]
+        n = 1 << int(np.ceil(np.log2(length + self._max_delay)))
+        spectra = np.fft.rfft(samples, n=n, axis=0)
+        # correlation[m, k] = sum_t x0[t + m] * xk[t], which peaks at m = -delay.
+        correlation = np.fft.irfft(spectra[:, :1] * np.conj(spectra), n=n, axis=0)
+        lags = np.arange(-self._max_delay, self._max_delay + 1)
+        peaks = np.argmax(correlation[lags], axis=0)
+        return -lags[peaks]
+
+    def _delay_and_sum(self, samples):
+        length = samples.shape[0]
+        if np.mean(samples * samples) >= self.MIN_BEAMFORM_ENERGY:
+            self.delays = self._estimate_delays(samples)
+
+        history_length = self._history.shape[0]
+        extended = np.concatenate((self._history, samples))
+        self._history = extended[-history_length:]
+
+        # Channel k lags channel 0 by delays[k], so delaying it by
+        # max_delay - delays[k] lines it up with channel 0 delayed by max_delay.
+        total = np.zeros(length, dtype=np.float32)
+        for channel, delay in enumerate(self.delays):
+            start = history_length - (self._max_delay - delay)
+            total += extended[start:start + length, channel]
+
+        total /= self._channels
+        return np.clip(np.rint(total), -32768, 32767)
@@ -15,47 +15,170 @@
 """A driver for audio playback."""
 
 import logging
+import queue
 import subprocess
+import threading
+import time
 import wave
 
+import aiy._apis._trace as trace
 import aiy._drivers._alsa
 
 logger = logging.getLogger('audio')
 
 
+class PlaybackStream(object):
+
+    """Plays audio as it is written, for clips that arrive over time.
+
+    Playback starts once JITTER_BUFFER_S of audio has been written, so that
+    small delays between chunks don't cause underruns. A background thread
+    feeds aplay, so write() doesn't block while earlier audio plays.
+    """
+
+    JITTER_BUFFER_S = 0.1
+
+    def __init__(self, cmd, bytes_per_second, converter=None, trace_turn=None):
+        self._trace_turn = trace_turn
+        self._aplay = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        self._converter = converter
+        self._buffer_bytes = int(self.JITTER_BUFFER_S * bytes_per_second)
+        self._buffered = []
+        self._buffered_size = 0
+        self._started = False
+        self._stopped = False
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._feed_aplay, daemon=True)
+        self._thread.start()
+        # time.monotonic() when audio was first passed to aplay.
+        self.start_time = None
+
+    def write(self, data):
+        """Queues data for playback."""
+        if self._stopped:
+            return
+        if self._started:
+            self._queue.put(data)
+            return
+
+        self._buffered.append(data)
+        self._buffered_size += len(data)
+        if self._buffered_size >= self._buffer_bytes:
+            self._start()
+
+    def _start(self):
+        self._started = True
+        self.start_time = time.monotonic()
+        self._queue.put(b''.join(self._buffered))
+        self._buffered = []
+
+    def _feed_aplay(self):
+        try:
+            while True:
+                data = self._queue.get()
+                if self._stopped:
+                    break
+                if data is None:
+                    if self._converter:
+                        self._aplay.stdin.write(self._converter.flush())
+                    break
+                if self._converter:
+                    data = self._converter.convert(data)
+                self._aplay.stdin.write(data)
+                self._aplay.stdin.flush()
+                trace.mark(trace.FIRST_PLAYBACK, turn=self._trace_turn)
+        except BrokenPipeError:
+            if not self._stopped:
+                logger.error('aplay exited before the end of the audio')
+        finally:
+            try:
+                self._aplay.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def close(self):
+        """Waits until all the audio written has been played."""
+        if not self._started:
+            self._start()
+        self._queue.put(None)
+        self._thread.join()
+        retcode = self._aplay.wait()
+
+        if retcode:
+            logger.error('aplay failed with %d', retcode)
+
+    def stop(self):
+        """Stops playback right away, dropping the audio that hasn't played.
+        It can be called from any thread.
+        """
+        self._stopped = True
+        self._aplay.terminate()
+        self._queue.put(None)
+        self._thread.join()
+        self._aplay.wait()
+
+
 class Player(object):
 
-    """Plays short audio clips from a buffer or file."""
+    """Plays short audio clips from a buffer or file, or streams audio that
+    is still arriving with open_stream().
+
+    By default, aplay is given the clip's own format and the ALSA plug layer
+    converts it for the device. If output_rate_hz is set, clips are converted
+    in-process to that rate, output_channels and 16-bit samples instead, so a
+    device opened in its native format can skip plugin conversion.
+    """
 
-    def __init__(self, output_device='default'):
+    def __init__(self, output_device='default', output_rate_hz=None, output_channels=1):
         self._output_device = output_device
+        self._output_rate_hz = output_rate_hz
+        self._output_channels = output_channels
 
-    def play_bytes(self, audio_bytes, sample_rate, sample_width=2):
+    def play_bytes(self, audio_bytes, sample_rate, sample_width=2, trace_turn=None):
         """Play audio from the given bytes-like object.
 
         Args:
           audio_bytes: audio data (mono)
           sample_rate: sample rate in Hertz (24 kHz by default)
           sample_width: sample width in bytes (eg 2 for 16-bit audio)
+          trace_turn: the _trace.Turn to mark the start of playback in
         """
 
+        stream = self.open_stream(sample_rate, sample_width, trace_turn)
+        stream.write(audio_bytes)
+        stream.close()
+
+    def open_stream(self, sample_rate, sample_width=2, trace_turn=None):
+        """Returns a PlaybackStream to play mono audio as it arrives.
+
+        Write chunks of audio to the stream, then close() it to wait for the
+        end of playback. The start of playback is marked in trace_turn, or
+        in the newest turn.
+        """
+
+        channels = 1
+        converter = None
+        bytes_per_second = sample_rate * sample_width
+        if self._output_rate_hz:
+            # numpy is only needed for conversion, so import it on demand.
+            import aiy._drivers._resample as resample
+            converter = resample.FormatConverter(
+                sample_rate, self._output_rate_hz, 1, self._output_channels, sample_width, 2)
+            sample_rate = self._output_rate_hz
+            sample_width = 2
+            channels = self._output_channels
+
         cmd = [
             'aplay',
             '-q',
             '-t', 'raw',
             '-D', self._output_device,
-            '-c', '1',
+            '-c', str(channels),
             '-f', aiy._drivers._alsa.sample_width_to_string(sample_width),
             '-r', str(sample_rate),
         ]
 
-        aplay = subprocess.Popen(cmd, stdin=subprocess.PIPE)
-        aplay.stdin.write(audio_bytes)
-        aplay.stdin.close()
-        retcode = aplay.wait()
-
-        if retcode:
-            logger.error('aplay failed with %d', retcode)
+        return PlaybackStream(cmd, bytes_per_second, converter, trace_turn)
 
     def play_wav(self, wav_path):
         """Play audio from the given WAV file.
@@ -14,16 +14,301 @@
 
 """A recorder driver capable of recording voice samples from the VoiceHat microphones."""
 
+import collections
 import logging
+import math
 import os
-import subprocess
+import queue
 import threading
+import time
 import wave
 
-import aiy._drivers._alsa
+import aiy._drivers._audiobus
+import aiy._drivers._capture
 
 logger = logging.getLogger('recorder')
 
+# Overflow policies for processors running in fan-out mode.
+DROP_OLDEST = 'drop-oldest'
+DROP_NEWEST = 'drop-newest'
+BLOCK = 'block'
+
+
+# A gap in the audio. restart_s is how long the backend took to restart, or 0
+# if it lost audio without dying.
+Discontinuity = collections.namedtuple(
+    'Discontinuity', ['missing_samples', 'restart_count', 'restart_s'])
+
+# When the first sample of a frame was captured: its index in the stream, and
+# the time.monotonic() at which it was captured.
+Timestamp = collections.namedtuple('Timestamp', ['sample_index', 'capture_time'])
+
+
+class CaptureStats(object):
+
+    """Counters describing the health of the capture backend."""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.restarts = 0
+        self.overruns = 0
+        self.missing_samples = 0
+        self.restart_time_s = 0.0
+        # How fast the sample clock runs compared to time.monotonic(), in
+        # parts per million, or None until it has been measured.
+        self.drift_ppm = None
+        # How late chunks were read compared to the sample clock.
+        self.read_latency = LatencyStats()
+
+    def __repr__(self):
+        drift = 'unknown' if self.drift_ppm is None else '%.0f ppm' % self.drift_ppm
+        return ('CaptureStats(restarts=%d, overruns=%d, missing_samples=%d, '
+                'restart_time=%.2f s, drift=%s, read_latency=%r)') % (
+                    self.restarts, self.overruns, self.missing_samples,
+                    self.restart_time_s, drift, self.read_latency)
+
+
+class LatencyStats(object):
+
+    """Running statistics of the delay between capturing a sample and
+    delivering it to a processor.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+
+    def add(self, latency_s):
+        self.count += 1
+        self.total_s += latency_s
+        self.max_s = max(self.max_s, latency_s)
+
+    @property
+    def mean_s(self):
+        return self.total_s / self.count if self.count else 0.0
+
+    def __repr__(self):
+        return 'LatencyStats(count=%d, mean=%.1f ms, max=%.1f ms)' % (
+            self.count, self.mean_s * 1000, self.max_s * 1000)
+
+
+class _SampleClock(object):
+
+    """Compares the samples captured with the time elapsed, to find audio the
+    backend lost and how far the sample clock drifts from the system clock.
+
+    The lag of a chunk is how much later it was read than its samples imply.
+    It never drops much below the lowest lag seen so far, the floor, which
+    may rise slowly with clock drift. Samples were lost, for example in an
+    ALSA overrun, if the backend says so, or if a chunk's lag exceeds the
+    floor by more than the backend can buffer.
+
+    A chunk that is late by less than that, eg behind a slow processor, was
+    most likely still buffered, and the next reads catch up. If they don't
+    within the buffer's length, the floor is moved up to the new lag without
+    counting any samples as lost.
+    """
+
+    GAP_THRESHOLD_S = 0.5
+    # How fast the floor may rise, as a fraction of elapsed time.
+    MAX_DRIFT = 1e-3
+    # Drift is only reported after measuring for this long.
+    MIN_DRIFT_S = 10.0
+
+    def __init__(self, sample_rate_hz, stats):
+        self._sample_rate_hz = sample_rate_hz
+        self._stats = stats
+        self.reset()
+
+    def reset(self):
+        """Starts measuring again, eg after the backend was restarted."""
+        self._start = None
+        self._last_time = None
+        self._samples = 0
+        self._floor = 0.0
+        self._late_since = None
+        self._restart_fit(None)
+
+    def _restart_fit(self, start):
+        self._fit_start = start
+        # Sums for a least-squares fit of lag against elapsed time.
+        self._sums = [0, 0.0, 0.0, 0.0, 0.0]
+
+    def update(self, capture_time, samples, buffer_s=None, overrun=False):
+        """Accounts for a chunk of samples read at capture_time, and returns
+        how many samples were lost before it.
+
+        buffer_s is how much audio the backend can hold, if known, and
+        overrun is True if it reported losing audio since the last chunk.
+        """
+        if self._start is None:
+            self._start = self._last_time = capture_time
+            self._restart_fit(capture_time)
+            return 0
+
+        self._samples += samples
+        elapsed = capture_time - self._start
+        lag = elapsed - self._samples / self._sample_rate_hz
+        self._floor = min(lag, self._floor + self.MAX_DRIFT * (capture_time - self._last_time))
+        self._last_time = capture_time
+
+        late_s = lag - self._floor
+        capacity_s = max(self.GAP_THRESHOLD_S, buffer_s or 0.0)
+        if overrun or late_s > capacity_s:
+            missing = max(0, int(round(late_s * self._sample_rate_hz)))
+            self._samples += missing
+            self._stats.overruns += 1
+            self._late_since = None
+            return missing
+
+        self._stats.read_latency.add(late_s)
+        if late_s > self.GAP_THRESHOLD_S:
+            if self._late_since is None:
+                self._late_since = capture_time
+            elif capture_time - self._late_since > capacity_s:
+                # Buffered audio would have been read by now.
+                self._floor = lag
+                self._late_since = None
+                self._restart_fit(capture_time)
+            return 0
+        self._late_since = None
+
+        sums = self._sums
+        sums[0] += 1
+        sums[1] += elapsed
+        sums[2] += lag
+        sums[3] += elapsed * elapsed
+        sums[4] += elapsed * lag
+        if capture_time - self._fit_start >= self.MIN_DRIFT_S:
+            count, sum_t, sum_lag, sum_tt, sum_tlag = sums
+            slope = (count * sum_tlag - sum_t * sum_lag) / (count * sum_tt - sum_t * sum_t)
+            # The lag shrinks if the sample clock runs fast.
+            self._stats.drift_ppm = -slope * 1e6
+        return 0
+
+
+class _ProcessorWorker(threading.Thread):
+
+    """Delivers frames to a processor from a bounded queue in its own thread.
+
+    put() only waits for the consumer if the overflow policy is BLOCK. If the
+    processor raises an exception, failed is set and the worker keeps
+    draining the queue without delivering, so put() never waits on it; the
+    recorder then removes the processor.
+    """
+
+    def __init__(self, processor, max_frames, overflow, latency):
+        if overflow not in (DROP_OLDEST, DROP_NEWEST, BLOCK):
+            raise ValueError('unknown overflow policy: %r' % overflow)
+
+        super().__init__(daemon=True)
+
+        self.processor = processor
+        self.dropped = 0
+        self.failed = False
+        self._latency = latency
+        self._overflow = overflow
+        self._queue = queue.Queue(max_frames)
+        self._stopped = False
+
+    def put(self, data, timestamp):
+        """Queues a frame, along with the Timestamp of its first sample."""
+        item = (data, timestamp)
+        if self._overflow == BLOCK:
+            self._queue.put(item)
+            return
+
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                self.dropped += 1
+                if self._overflow == DROP_NEWEST:
+                    return
+
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+
+    def stop(self):
+        """Stops the worker once it has finished the frame it is handling."""
+        self._stopped = True
+        while True:
+            try:
+                self._queue.put_nowait(None)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def run(self):
+        while True:
+            item = self._queue.get()
+            if self._stopped:
+                return
+            if self.failed:
+                continue
+            data, timestamp = item
+            try:
+                if isinstance(data, Discontinuity):
+                    _notify_discontinuity(self.processor, data)
+                    continue
+                self._latency.add(time.monotonic() - timestamp.capture_time)
+                _add_data(self.processor, data, timestamp)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('audio processor %r failed, removing it', self.processor)
+                self.failed = True
+
+
+def _add_data(processor, data, timestamp):
+    add_timed_data = getattr(processor, 'add_timed_data', None)
+    if add_timed_data:
+        add_timed_data(data, timestamp)
+    else:
+        processor.add_data(data)
+
+
+def _notify_discontinuity(processor, discontinuity):
+    notify = getattr(processor, 'add_discontinuity', None)
+    if notify:
+        notify(discontinuity)
+
+
+class _Subscription(object):
+
+    """Delivery state of one processor: its framing and read position."""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, processor, worker, frame_bytes, hop_bytes, preroll):
+        self.processor = processor
+        self.worker = worker
+        self.keeps_data = bool(worker) or getattr(processor, 'keeps_data', False)
+        self.frame_bytes = frame_bytes
+        self.hop_bytes = hop_bytes
+        self.preroll = preroll
+        # Stream position (in bytes) of the next frame, set on first delivery.
+        self.position = None
+        self.latency = worker._latency if worker else LatencyStats()
+        # Capture times (start, end) of audio to leave out, or None. The end
+        # is None until it is known.
+        self.skip = None
+
+    def skips(self, capture_time, duration_s):
+        """Returns True if a frame captured at capture_time overlaps the
+        audio to leave out.
+        """
+        if self.skip is None:
+            return False
+        start, end = self.skip
+        return capture_time + duration_s > start and (end is None or capture_time < end)
+
 
 class Recorder(threading.Thread):
 
@@ -33,16 +318,51 @@ class Recorder(threading.Thread):
     callbacks. It reads audio in a configurable format from the microphone,
     then converts it to a known format before passing it to the processors.
 
-    This driver accumulates input (audio samples) in a local buffer. Once the
-    buffer contains more than CHUNK_S seconds, it passes the chunk to all
+    The samples come from a capture backend (see aiy._drivers._capture), by
+    default an arecord subprocess. This driver reads input (audio samples)
+    straight into a preallocated ring buffer of RING_CHUNKS slots of CHUNK_S
+    seconds. Each time a slot is filled, it passes the new audio to all
     processors. An audio processor defines a 'add_data' method that receives
     the chunk of audio samples to process.
+
+    Processors may ask for frames of a different duration, possibly
+    overlapping. Frames are cut from the ring buffer itself, so they are only
+    copied if they wrap around its end or the processor keeps them.
+
+    The ring buffer can also be made large enough to hold a pre-roll window of
+    recent audio, which is replayed to processors that ask for it when they are
+    added. This way, speech that started just before a trigger is not lost.
+
+    The audio can also be published to a shared-memory bus that other
+    processes read from, so they don't need to own the microphone.
+
+    Multichannel audio can be mixed down to mono (see aiy._drivers._mixer)
+    before it reaches the ring buffer, so processors still receive mono audio.
+
+    If the capture backend dies, it is restarted in place with exponential
+    backoff, and processors are told about the gap in the audio. The process
+    only exits if the backend dies more than max_restarts times within
+    restart_window_s.
+
+    The number of samples read is checked against the time elapsed, so audio
+    lost by the backend without dying (eg in an overrun) is detected and
+    reported like a restart. This also measures how far the sample clock
+    drifts (see get_capture_stats()).
     """
 
     CHUNK_S = 0.1
+    RING_CHUNKS = 4
+
+    RESTART_DELAY_S = 0.1
+    MAX_RESTART_DELAY_S = 5.0
 
     def __init__(self, input_device='default',
-                 channels=1, bytes_per_sample=2, sample_rate_hz=16000):
+                 channels=1, bytes_per_sample=2, sample_rate_hz=16000,
+                 fanout=False, queue_chunks=10, overflow=DROP_OLDEST,
+                 backend=None, chunk_s=None, preroll_s=0,
+                 max_restarts=5, restart_window_s=60, mix_mode=None,
+                 capture_rate_hz=None, capture_bytes_per_sample=None,
+                 bus_path=None, bus_s=10):
         """Create a Recorder with the given audio format.
 
         The Recorder will not start until start() is called. start() is called
@@ -52,27 +372,123 @@ class Recorder(threading.Thread):
         - channels: number of channels in audio read from the mic
         - bytes_per_sample: sample width in bytes (eg 2 for 16-bit audio)
         - sample_rate_hz: sample rate in hertz
+        - fanout: if True, each processor gets its own thread and bounded queue,
+          so a slow processor can't stall the capture thread
+        - queue_chunks: default queue length (in frames) in fan-out mode
+        - overflow: default policy when a queue is full in fan-out mode, one of
+          DROP_OLDEST, DROP_NEWEST or BLOCK
+        - backend: capture backend to read from, by default an ArecordBackend
+          for input_device. Its format must match the arguments above.
+        - chunk_s: how often audio is read and delivered, CHUNK_S by default.
+          Use a shorter chunk and backend period for lower latency.
+        - preroll_s: how much audio to keep for replay to new processors. It is
+          rounded up to a whole number of chunks.
+        - max_restarts: how many times the backend may be restarted within
+          restart_window_s seconds before the process exits
+        - mix_mode: if set, capture all channels and mix them down to mono with
+          this aiy._drivers._mixer mode. Requires numpy.
+        - capture_rate_hz, capture_bytes_per_sample: if set, capture at this
+          rate and sample width (eg the codec's native 48 kHz s32) and convert
+          to sample_rate_hz and bytes_per_sample before the processors.
+          Requires numpy, and the rates must be integer multiples.
+        - bus_path: if set, publish the processors' audio to a shared-memory
+          audio bus at this path (see aiy._drivers._audiobus) while recording,
+          so other processes can read it. The bus holds bus_s seconds.
         """
 
         super().__init__()
 
-        self._processors = []
-
-        self._chunk_bytes = int(self.CHUNK_S * sample_rate_hz) * channels * bytes_per_sample
-
-        self._cmd = [
-            'arecord',
-            '-q',
-            '-t', 'raw',
-            '-D', input_device,
-            '-c', str(channels),
-            '-f', aiy._drivers._alsa.sample_width_to_string(bytes_per_sample),
-            '-r', str(sample_rate_hz),
+        # The capture thread iterates over this list without locking, so it is
+        # replaced rather than modified in place.
+        self._subscriptions = []
+        self._subscriptions_lock = threading.Lock()
+
+        self._fanout = fanout
+        self._queue_chunks = queue_chunks
+        self._overflow = overflow
+
+        chunk_s = chunk_s or self.CHUNK_S
+        chunk_frames = int(chunk_s * sample_rate_hz)
+        capture_rate_hz = capture_rate_hz or sample_rate_hz
+        capture_bytes_per_sample = capture_bytes_per_sample or bytes_per_sample
+        output_channels = 1 if mix_mode else channels
+
+        # Stages that turn captured samples into the processors' format.
+        self._pre_mix_converter = None
+        self._mixer = None
+        self._converter = None
+        if mix_mode and channels > 1:
+            # numpy is only needed for conversions, so import it on demand.
+            import aiy._drivers._mixer as mixer
+            if capture_bytes_per_sample != 2:
+                self._pre_mix_converter = self._make_converter(
+                    capture_rate_hz, capture_rate_hz, channels, capture_bytes_per_sample, 2)
+            self._mixer = mixer.ChannelMixer(channels, mix_mode)
+            channels_to_convert, width_to_convert = 1, 2
+        else:
+            channels_to_convert, width_to_convert = channels, capture_bytes_per_sample
+        if capture_rate_hz != sample_rate_hz or width_to_convert != bytes_per_sample:
+            if capture_rate_hz % sample_rate_hz and sample_rate_hz % capture_rate_hz:
+                raise ValueError('capture rate must be a multiple or a divisor of the sample rate')
+            self._converter = self._make_converter(
+                capture_rate_hz, sample_rate_hz, channels_to_convert, width_to_convert,
+                bytes_per_sample)
+
+        # Captured samples are read here and converted into the ring.
+        self._capture_buffer = None
+        if self._mixer or self._converter:
+            capture_frames = chunk_frames * capture_rate_hz // sample_rate_hz
+            self._capture_buffer = memoryview(
+                bytearray(capture_frames * channels * capture_bytes_per_sample))
+
+        self._bus_path = bus_path
+        self._bus_s = bus_s
+        self._bus_format = (sample_rate_hz, output_channels, bytes_per_sample)
+
+        self._frame_size = output_channels * bytes_per_sample
+        self._bytes_per_second = sample_rate_hz * self._frame_size
+        self._chunk_bytes = chunk_frames * self._frame_size
+
+        self._preroll_chunks = int(math.ceil(preroll_s / chunk_s - 1e-9))
+        # Total number of bytes captured so far.
+        self._stream_bytes = 0
+
+        # The ring buffer is allocated once and filled with readinto(), so the
+        # capture loop doesn't allocate or copy while the daemon is running.
+        # The pre-roll window is the slots before the one being delivered.
+        ring_chunks = self.RING_CHUNKS + self._preroll_chunks
+        self._ring = bytearray(self._chunk_bytes * ring_chunks)
+        self._ring_view = memoryview(self._ring)
+        self._slots = [
+            self._ring_view[i * self._chunk_bytes:(i + 1) * self._chunk_bytes]
+            for i in range(ring_chunks)
         ]
-        self._arecord = None
-        self._closed = False
 
-    def add_processor(self, processor):
+        self._backend = backend or aiy._drivers._capture.ArecordBackend(
+            input_device, channels, capture_bytes_per_sample, capture_rate_hz)
+        self._started = threading.Event()
+        self._closed = threading.Event()
+
+        self._max_restarts = max_restarts
+        self._restart_window_s = restart_window_s
+        self._restart_times = collections.deque()
+        self._capture_stats = CaptureStats()
+        self._clock = _SampleClock(sample_rate_hz, self._capture_stats)
+        # (stream position, samples lost before it) after each gap, to index
+        # samples in the ring.
+        self._gaps = collections.deque([(0, 0)])
+        # Capture time of the last sample before the backend died.
+        self._last_capture_time = None
+        self._died_at = None
+        self._reopened_at = None
+
+    @staticmethod
+    def _make_converter(from_rate_hz, to_rate_hz, channels, from_width, to_width):
+        import aiy._drivers._resample as resample
+        return resample.FormatConverter(
+            from_rate_hz, to_rate_hz, channels, channels, from_width, to_width)
+
+    def add_processor(self, processor, queue_chunks=None, overflow=None, preroll=False):
         """Adds an audio processor.
 
         An audio processor is an object that has an 'add_data' method with the
@@ -85,58 +501,365 @@ class Recorder(threading.Thread):
             # processes the chunk of data here.
 
         The added processor may be called multiple times with chunks of audio data.
+
+        By default, 'data' is a memoryview into the recorder's ring buffer, which
+        is overwritten as recording continues. A processor that keeps the data
+        after add_data returns (eg in a queue) should set a 'keeps_data'
+        attribute to True, and will then receive a bytes copy of the chunk.
+
+        A processor can set a 'frame_s' attribute to receive frames of that
+        duration instead of chunks, and 'frame_overlap_s' to make consecutive
+        frames overlap. Frames can't be longer than the ring buffer, minus one
+        chunk.
+
+        In fan-out mode, the processor is called from its own thread and always
+        receives bytes. queue_chunks and overflow override the recorder's
+        defaults for this processor.
+
+        If preroll is True, the processor first receives the pre-roll window,
+        then the live chunks, starting from the next chunk boundary.
+
+        If the capture backend has to be restarted or loses audio, processors
+        that have an 'add_discontinuity' method are passed a Discontinuity
+        before the first chunk captured after the gap.
+
+        A processor that needs to know when its audio was captured can define
+        an 'add_timed_data' method instead of 'add_data':
+
+          def add_timed_data(self, data, timestamp):
+            # timestamp.sample_index counts samples since recording started,
+            # including lost ones, and timestamp.capture_time is the
+            # time.monotonic() at which the first sample was captured.
         """
-        self._processors.append(processor)
+        frame_bytes = self._duration_to_bytes(getattr(processor, 'frame_s', None))
+        frame_bytes = frame_bytes or self._chunk_bytes
+        hop_bytes = frame_bytes - self._duration_to_bytes(
+            getattr(processor, 'frame_overlap_s', None))
+        if frame_bytes > len(self._ring) - self._chunk_bytes:
+            raise ValueError('frame_s is longer than the recorder can buffer')
+        if hop_bytes <= 0:
+            raise ValueError('frame_overlap_s must be shorter than frame_s')
+
+        worker = None
+        if self._fanout:
+            worker = _ProcessorWorker(
+                processor,
+                queue_chunks or self._queue_chunks,
+                overflow or self._overflow,
+                LatencyStats())
+            worker.start()
+
+        subscription = _Subscription(processor, worker, frame_bytes, hop_bytes, preroll)
+        with self._subscriptions_lock:
+            self._subscriptions = self._subscriptions + [subscription]
 
     def remove_processor(self, processor):
         """Removes an added audio processor."""
 
-        try:
-            self._processors.remove(processor)
-        except ValueError:
-            logger.warn("processor was not found in the list")
+        with self._subscriptions_lock:
+            subscription = self._find_subscription(processor)
+            if not subscription:
+                logger.warn("processor was not found in the list")
+                return
+        self._remove_subscription(subscription)
+
+    def _remove_subscription(self, subscription):
+        with self._subscriptions_lock:
+            self._subscriptions = [s for s in self._subscriptions if s is not subscription]
+
+        if subscription.worker:
+            subscription.worker.stop()
+
+    def skip_audio(self, processor, start_time, end_time=None):
+        """Leaves audio captured from start_time until end_time (both
+        time.monotonic() values) out of what a processor receives.
+
+        Frames that overlap the span are dropped, including ones replayed from
+        the pre-roll. Until the end is known, all audio captured after
+        start_time is dropped; call again with the end_time to resume. This
+        keeps sounds the device plays itself, like a trigger sound, away
+        from processors that listen to the user.
+        """
+        subscription = self._find_subscription(processor)
+        if subscription:
+            subscription.skip = (start_time, end_time)
 
-    def run(self):
-        """Reads data from arecord and passes to processors."""
+    def get_dropped_chunks(self, processor):
+        """Returns how many frames were dropped for a processor in fan-out mode."""
 
-        self._arecord = subprocess.Popen(self._cmd, stdout=subprocess.PIPE)
-        logger.info("started recording")
+        subscription = self._find_subscription(processor)
+        return subscription.worker.dropped if subscription and subscription.worker else 0
 
-        # Check for race-condition when __exit__ is called at the same time as
-        # the process is started by the background thread
-        if self._closed:
-            self._arecord.kill()
-            return
+    def get_latency(self, processor):
+        """Returns LatencyStats from sample capture to delivery for a processor.
 
-        this_chunk = b''
+        Replayed pre-roll audio is not included.
+        """
 
+        subscription = self._find_subscription(processor)
+        return subscription.latency if subscription else None
+
+    def _find_subscription(self, processor):
+        for subscription in self._subscriptions:
+            if subscription.processor is processor:
+                return subscription
+        return None
+
+    def _duration_to_bytes(self, duration_s):
+        if not duration_s:
+            return 0
+        return int(round(duration_s * self._bytes_per_second / self._frame_size)) * self._frame_size
+
+    def get_capture_stats(self):
+        """Returns CaptureStats for the capture backend: restarts, overruns,
+        lost samples, clock drift and read latency.
+        """
+        return self._capture_stats
+
+    def run(self):
+        """Reads data from the capture backend and passes to processors,
+        restarting the backend if it dies.
+        """
+
+        bus = None
+        if self._bus_path:
+            sample_rate_hz, channels, bytes_per_sample = self._bus_format
+            bus = aiy._drivers._audiobus.AudioBusWriter(
+                self._bus_path, sample_rate_hz, channels, bytes_per_sample, self._bus_s)
+            logger.info('publishing audio to %s', bus.path)
+            self.add_processor(bus)
+        try:
+            self._supervise()
+        finally:
+            if bus:
+                self.remove_processor(bus)
+                bus.close()
+
+    def _supervise(self):
         while True:
-            input_data = self._arecord.stdout.read(self._chunk_bytes)
-            if not input_data:
+            self._run_backend()
+            if self._closed.is_set():
+                return
+
+            self._died_at = time.monotonic()
+            delay = self._get_restart_delay(self._died_at)
+            if delay is None:
+                logger.error('Microphone recorder died unexpectedly, aborting...')
+                # sys.exit doesn't work from background threads, so use os._exit
+                # as an emergency measure.
+                logging.shutdown()
+                os._exit(1)  # pylint: disable=protected-access
+                return
+
+            logger.warning('Microphone recorder died, restarting in %.2f s', delay)
+            if self._closed.wait(delay):
+                return
+
+    def _run_backend(self):
+        """Opens the backend and captures from it until it stops or dies."""
+        try:
+            self._backend.open()
+            self._reopened_at = time.monotonic()
+            self._started.set()
+            logger.info("started recording")
+
+            # Check for race-condition when __exit__ is called at the same time
+            # as the backend is opened by the background thread
+            if not self._closed.is_set():
+                self._capture(self._backend)
+        except (OSError, aiy._drivers._capture.Error):
+            logger.exception('Microphone recorder failed')
+        finally:
+            self._backend.close()
+
+    def _get_restart_delay(self, now):
+        """Returns how long to wait before restarting the backend, or None if
+        it has died too often.
+        """
+        while self._restart_times and self._restart_times[0] < now - self._restart_window_s:
+            self._restart_times.popleft()
+        if len(self._restart_times) >= self._max_restarts:
+            return None
+
+        delay = self.RESTART_DELAY_S * 2 ** len(self._restart_times)
+        self._restart_times.append(now)
+        return min(delay, self.MAX_RESTART_DELAY_S)
+
+    def _account_for_restart(self, capture_time):
+        """Tells processors how much audio was lost while restarting."""
+        stats = self._capture_stats
+        stats.restarts += 1
+        restart_s = self._reopened_at - self._died_at
+        stats.restart_time_s += restart_s
+
+        missing_samples = 0
+        if self._last_capture_time is not None:
+            first_sample_time = capture_time - self._chunk_bytes / self._bytes_per_second
+            missing_s = max(0.0, first_sample_time - self._last_capture_time)
+            missing_samples = int(round(missing_s * self._bytes_per_second / self._frame_size))
+        stats.missing_samples += missing_samples
+
+        discontinuity = Discontinuity(missing_samples, stats.restarts, restart_s)
+        logger.warning('Microphone recorder restarted: %s', discontinuity)
+        self._died_at = None
+        self._clock.reset()
+        self._add_gap(discontinuity)
+
+    def _account_for_overrun(self, missing_samples):
+        """Tells processors how much audio the backend lost while running."""
+        stats = self._capture_stats
+        stats.missing_samples += missing_samples
+        discontinuity = Discontinuity(missing_samples, stats.restarts, 0.0)
+        logger.warning('Microphone recorder lost audio: %s', discontinuity)
+        self._add_gap(discontinuity)
+
+    def _add_gap(self, discontinuity):
+        """Records a gap before the chunk being captured."""
+        if discontinuity.missing_samples:
+            lost = self._gaps[-1][1] + discontinuity.missing_samples
+            self._gaps.append((self._stream_bytes, lost))
+            # Forget gaps before the oldest audio in the ring.
+            oldest = self._stream_bytes - len(self._ring)
+            while len(self._gaps) > 1 and self._gaps[1][0] <= oldest:
+                self._gaps.popleft()
+
+        for sub in self._subscriptions:
+            if sub.worker:
+                sub.worker.put(discontinuity, None)
+                continue
+            try:
+                _notify_discontinuity(sub.processor, discontinuity)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('audio processor %r failed, removing it', sub.processor)
+                self._remove_subscription(sub)
+
+    def _sample_index(self, position):
+        """Returns the index of the sample at a stream position."""
+        lost = 0
+        for gap_position, gap_lost in self._gaps:
+            if gap_position > position:
                 break
+            lost = gap_lost
+        return position // self._frame_size + lost
 
-            this_chunk += input_data
-            if len(this_chunk) >= self._chunk_bytes:
-                self._handle_chunk(this_chunk[:self._chunk_bytes])
-                this_chunk = this_chunk[self._chunk_bytes:]
+    def _capture(self, stream):
+        """Reads stream into the ring buffer until EOF, one slot at a time."""
 
-        if not self._closed:
-            logger.error('Microphone recorder died unexpectedly, aborting...')
-            # sys.exit doesn't work from background threads, so use os._exit as
-            # an emergency measure.
-            logging.shutdown()
-            os._exit(1)  # pylint: disable=protected-access
+        # Carry on where the last chunk ended if the backend was restarted.
+        slot_index = (self._stream_bytes // self._chunk_bytes) % len(self._slots)
+        chunk_samples = self._chunk_bytes // self._frame_size
+        overruns = getattr(stream, 'overruns', 0)
+        while True:
+            slot = self._slots[slot_index]
+            target = slot if self._capture_buffer is None else self._capture_buffer
+            filled = 0
+            while filled < len(target):
+                count = stream.readinto(target[filled:])
+                if not count:
+                    return
+                filled += count
+
+            if target is not slot:
+                self._convert_into(target, slot)
+
+            capture_time = time.monotonic()
+            if self._died_at is not None:
+                self._account_for_restart(capture_time)
+            overrun = getattr(stream, 'overruns', 0) != overruns
+            overruns = getattr(stream, 'overruns', 0)
+            missing_samples = self._clock.update(
+                capture_time, chunk_samples, getattr(stream, 'buffer_s', None), overrun)
+            if missing_samples:
+                self._account_for_overrun(missing_samples)
+            self._stream_bytes += self._chunk_bytes
+            self._deliver(capture_time)
+            self._last_capture_time = capture_time
+            slot_index = (slot_index + 1) % len(self._slots)
+
+    def _convert_into(self, data, slot):
+        """Converts captured samples to the processors' format in slot."""
+        if self._pre_mix_converter:
+            data = self._pre_mix_converter.convert(data)
+
+        if self._mixer and not self._converter:
+            self._mixer.mix_into(data, slot)
+            return
 
-    def _handle_chunk(self, chunk):
-        """Send audio chunk to all processors."""
-        for p in self._processors:
-            p.add_data(chunk)
+        if self._mixer:
+            data = self._mixer.mix(data)
+        slot[:] = self._converter.convert(data)
+
+    def _frame(self, position, size):
+        """Returns the frame at a stream position, copying only if it wraps."""
+        offset = position % len(self._ring)
+        end = offset + size
+        if end <= len(self._ring):
+            return self._ring_view[offset:end]
+        return b''.join((self._ring_view[offset:], self._ring_view[:end - len(self._ring)]))
+
+    def _deliver(self, capture_time):
+        """Sends all complete frames to the processors.
+
+        capture_time is when the last sample in the ring buffer was captured.
+        """
+        end = self._stream_bytes
+        chunk_start = end - self._chunk_bytes
+        copies = {}
+        # Processors that raised are removed, so one broken processor
+        # doesn't stop the audio of all the others.
+        failed = [sub for sub in self._subscriptions if sub.worker and sub.worker.failed]
+
+        for sub in self._subscriptions:
+            if sub in failed:
+                continue
+            if sub.position is None:
+                sub.position = chunk_start
+                if sub.preroll:
+                    sub.position = max(0, chunk_start - self._preroll_chunks * self._chunk_bytes)
+                    logger.info('replaying %.1f s of pre-roll',
+                                (chunk_start - sub.position) / self._bytes_per_second)
+
+            while sub.position + sub.frame_bytes <= end:
+                timestamp = Timestamp(
+                    self._sample_index(sub.position),
+                    capture_time - (end - sub.position) / self._bytes_per_second)
+                if sub.skips(timestamp.capture_time, sub.frame_bytes / self._bytes_per_second):
+                    sub.position += sub.hop_bytes
+                    continue
+
+                frame = self._frame(sub.position, sub.frame_bytes)
+                if sub.keeps_data and not isinstance(frame, bytes):
+                    key = (sub.position, sub.frame_bytes)
+                    if key not in copies:
+                        copies[key] = bytes(frame)
+                    frame = copies[key]
+
+                replayed = sub.position + sub.frame_bytes <= chunk_start
+                sub.position += sub.hop_bytes
+
+                if sub.worker:
+                    sub.worker.put(frame, timestamp)
+                    continue
+                if not replayed:
+                    sub.latency.add(time.monotonic() - timestamp.capture_time)
+                try:
+                    _add_data(sub.processor, frame, timestamp)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception('audio processor %r failed, removing it', sub.processor)
+                    failed.append(sub)
+                    break
+
+        for sub in failed:
+            self._remove_subscription(sub)
 
     def __enter__(self):
         self.start()
         return self
 
     def __exit__(self, *args):
-        self._closed = True
-        if self._arecord:
-            self._arecord.kill()
+        self._closed.set()
+        if self._started.is_set():
+            self._backend.stop()
+        for subscription in self._subscriptions:
+            if subscription.worker:
+                subscription.worker.stop()
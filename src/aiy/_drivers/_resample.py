@@ -0,0 +1,168 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Streaming sample rate and sample format conversion."""
+
+try:
+    from math import gcd
+except ImportError:  # Python < 3.5
+    from fractions import gcd  # pylint: disable=deprecated-method
+
+import numpy as np
+
+_DTYPES = {2: np.int16, 4: np.int32}
+
+
+def _check_width(width):
+    if width not in _DTYPES:
+        raise ValueError('unsupported sample width: %d' % width)
+
+
+def to_float(data, width):
+    """Converts little-endian signed samples to floats in the 16-bit range."""
+    _check_width(width)
+    samples = np.frombuffer(data, dtype=_DTYPES[width]).astype(np.float32)
+    if width == 4:
+        samples *= 1.0 / 65536
+    return samples
+
+
+def from_float(samples, width):
+    """Converts floats in the 16-bit range to signed samples, with clipping."""
+    _check_width(width)
+    if width == 4:
+        samples = samples * 65536.0
+    info = np.iinfo(_DTYPES[width])
+    return np.clip(np.rint(samples), info.min, info.max).astype(_DTYPES[width])
+
+
+class Resampler(object):
+
+    """A polyphase resampler for streams of float samples.
+
+    The rate is changed by to_rate/from_rate, reduced to L/M: conceptually the
+    input is upsampled by L, low-pass filtered and downsampled by M. Only the
+    filter phases that produce output samples are evaluated. The last input
+    samples are kept between calls, so a stream can be resampled in chunks of
+    any size with the same result as all at once.
+
+    The filter is a Kaiser-windowed sinc spanning 'lobes' zero crossings of
+    the sinc. It delays the output by lobes / 2 samples at the lower rate.
+    """
+
+    KAISER_BETA = 8.0
+    # Cutoff as a fraction of the lower Nyquist frequency, leaving room for
+    # the transition band.
+    CUTOFF = 0.9
+
+    def __init__(self, from_rate_hz, to_rate_hz, channels=1, lobes=24):
+        divisor = gcd(from_rate_hz, to_rate_hz)
+        self._up = to_rate_hz // divisor
+        self._down = from_rate_hz // divisor
+        self._channels = channels
+
+        # Zero crossings are max(L, M) upsampled samples apart.
+        taps_per_phase = -(-lobes * max(self._up, self._down) // self._up)
+        self._taps = taps_per_phase
+        length = taps_per_phase * self._up
+        cutoff = self.CUTOFF * 0.5 / max(self._up, self._down)
+        t = np.arange(length) - (length - 1) / 2.0
+        prototype = 2 * cutoff * np.sinc(2 * cutoff * t) * np.kaiser(length, self.KAISER_BETA)
+        prototype *= self._up / prototype.sum()
+        # phases[p, k] is the weight of the input sample k samples before the
+        # output sample, for upsampled phase p.
+        self._phases = prototype.reshape(taps_per_phase, self._up).T.astype(np.float32)
+
+        self._history = np.zeros((taps_per_phase - 1, channels), dtype=np.float32)
+        self._consumed = 0  # input samples seen
+        self._next_output = 0  # index of the next output sample
+
+    def process(self, samples):
+        """Resamples a chunk of float samples, interleaved if multichannel.
+
+        Returns the output samples that can be computed so far.
+        """
+        samples = np.asarray(samples, dtype=np.float32).reshape(-1, self._channels)
+        extended = np.concatenate((self._history, samples))
+        # Input sample i is at extended[i - base].
+        base = self._consumed - len(self._history)
+        self._consumed += len(samples)
+        self._history = extended[len(extended) - len(self._history):]
+
+        last_output = (self._consumed * self._up - 1) // self._down
+        outputs = np.arange(self._next_output, last_output + 1)
+        self._next_output = last_output + 1
+
+        upsampled = outputs * self._down
+        newest = upsampled // self._up - base
+        indices = newest[:, np.newaxis] - np.arange(self._taps)
+        weights = self._phases[upsampled % self._up]
+        result = np.einsum('nkc,nk->nc', extended[indices], weights)
+        return result.reshape(-1) if self._channels > 1 else result[:, 0]
+
+    def flush(self):
+        """Returns the output delayed by the filter, by feeding silence."""
+        return self.process(np.zeros(self._taps * self._channels, dtype=np.float32))
+
+
+class FormatConverter(object):
+
+    """Converts a stream of raw samples to another rate, channel count and
+    sample width.
+
+    Multichannel input is mixed down to mono by averaging, and mono is copied
+    to all output channels. Other channel conversions are not supported.
+    """
+
+    def __init__(self, from_rate_hz, to_rate_hz, from_channels=1, to_channels=1,
+                 from_width=2, to_width=2):
+        if from_channels != to_channels and 1 not in (from_channels, to_channels):
+            raise ValueError('can only convert channels to or from mono')
+        _check_width(from_width)
+        _check_width(to_width)
+
+        self._from_channels = from_channels
+        self._to_channels = to_channels
+        self._from_width = from_width
+        self._to_width = to_width
+
+        # Resample as few channels as possible.
+        self._resampled_channels = min(from_channels, to_channels)
+        self._resampler = None
+        if from_rate_hz != to_rate_hz:
+            self._resampler = Resampler(from_rate_hz, to_rate_hz, self._resampled_channels)
+
+    def convert(self, data):
+        """Converts a chunk of raw samples, returning bytes."""
+        samples = to_float(data, self._from_width)
+        return self._finish(self._resample(self._downmix(samples)))
+
+    def flush(self):
+        """Returns any converted samples still held by the resampler."""
+        if not self._resampler:
+            return b''
+        return self._finish(self._resampler.flush())
+
+    def _downmix(self, samples):
+        if self._from_channels > self._to_channels:
+            return samples.reshape(-1, self._from_channels).mean(axis=1)
+        return samples
+
+    def _resample(self, samples):
+        return self._resampler.process(samples) if self._resampler else samples
+
+    def _finish(self, samples):
+        if self._to_channels > self._from_channels:
+            samples = np.repeat(samples, self._to_channels)
+        return from_float(samples, self._to_width).tobytes()
@@ -20,6 +20,7 @@ import os
 import subprocess
 import tempfile
 
+import aiy._apis._trace as trace
 import aiy.i18n
 
 # Path to a tmpfs directory to avoid SD card wear
@@ -55,7 +56,9 @@ def say(player, words, lang='en-US'):
     words = '<volume level="60"><pitch level="130">%s</pitch></volume>' % words
 
     try:
+        trace.mark(trace.TTS_START)
         subprocess.call(['pico2wave', '--lang', lang, '-w', tts_wav, words])
+        trace.mark(trace.TTS_END)
         player.play_wav(tts_wav)
     finally:
         os.unlink(tts_wav)
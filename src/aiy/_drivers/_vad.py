@@ -0,0 +1,190 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Voice activity detection, to find where speech starts and ends locally."""
+
+import collections
+
+import numpy as np
+
+FRAME_S = 0.01
+
+DEFAULT_THRESHOLD_DB = 10.0
+DEFAULT_HANGOVER_S = 0.8
+
+
+class VoiceActivityDetector(object):
+
+    """Classifies 10 ms frames of 16-bit mono audio as speech or not.
+
+    A frame is speech if its energy is threshold_db above the background
+    noise level, or half that for frames with a high zero crossing rate, which
+    catches quieter fricatives like "s" and "f". The signal is pre-emphasized
+    first, so that hum and rumble, which are common with small enclosures,
+    don't hide speech. The noise level follows quiet frames down at once and
+    rises slowly, so it adapts to the room without learning speech as noise.
+    """
+
+    # How fast the noise level can rise.
+    NOISE_RISE_DB_PER_S = 2.0
+    # Noise level bounds, in dB relative to full scale. The lower bound stops
+    # digital silence from making any sound count as speech.
+    MIN_NOISE_DB = -70.0
+    MAX_INITIAL_NOISE_DB = -40.0
+    # Zero crossing rate (crossings per sample) of fricatives.
+    FRICATIVE_ZCR = 0.3
+
+    def __init__(self, sample_rate_hz=16000, threshold_db=DEFAULT_THRESHOLD_DB):
+        self.threshold_db = threshold_db
+        self._frame_samples = int(sample_rate_hz * FRAME_S)
+        self._pending = np.zeros(0, dtype=np.int16)
+        self._last_sample = 0.0
+        self.noise_db = None
+
+    def process(self, data):
+        """Returns a list with True for each complete speech frame in data.
+        Samples left over are kept for the next call.
+        """
+        samples = np.concatenate((self._pending, np.frombuffer(data, dtype='<i2')))
+        count = len(samples) // self._frame_samples
+        self._pending = samples[count * self._frame_samples:]
+        if not count:
+            return []
+
+        samples = samples[:count * self._frame_samples].astype(np.float64)
+        # np.diff() only takes prepend= from numpy 1.16, newer than Raspbian's.
+        emphasized = np.diff(np.concatenate(([self._last_sample], samples)))
+        self._last_sample = samples[-1]
+
+        frames = emphasized.reshape(count, self._frame_samples)
+        power = np.mean(frames ** 2, axis=1) / (32768.0 ** 2)
+        energy_db = 10 * np.log10(power + 1e-12)
+        raw_frames = samples.reshape(count, self._frame_samples)
+        zcr = np.mean(np.signbit(raw_frames[:, 1:]) != np.signbit(raw_frames[:, :-1]), axis=1)
+
+        return [self._classify(energy, rate) for energy, rate in zip(energy_db, zcr)]
+
+    def _classify(self, energy_db, zcr):
+        if self.noise_db is None:
+            self.noise_db = min(energy_db, self.MAX_INITIAL_NOISE_DB)
+
+        above_noise_db = energy_db - self.noise_db
+        if above_noise_db < 0:
+            self.noise_db = max(energy_db, self.MIN_NOISE_DB)
+        else:
+            self.noise_db += min(above_noise_db, self.NOISE_RISE_DB_PER_S * FRAME_S)
+
+        if above_noise_db > self.threshold_db:
+            return True
+        return above_noise_db > self.threshold_db / 2 and zcr > self.FRICATIVE_ZCR
+
+
+class Endpointer(object):
+
+    """Finds the start and end of an utterance in a stream of audio.
+
+    Only runs of at least MIN_SPEECH_S of speech frames count, so that clicks
+    and bumps don't start an utterance or keep it going. The utterance ends
+    when hangover_s passes without speech. Times are in seconds from the start
+    of the stream.
+    """
+
+    MIN_SPEECH_S = 0.1
+
+    def __init__(self, sample_rate_hz=16000, threshold_db=DEFAULT_THRESHOLD_DB,
+                 hangover_s=DEFAULT_HANGOVER_S):
+        self._vad = VoiceActivityDetector(sample_rate_hz, threshold_db)
+        self._min_speech_frames = int(round(self.MIN_SPEECH_S / FRAME_S))
+        self._hangover_frames = int(round(hangover_s / FRAME_S))
+        self._frames = 0
+        self._speech_run = 0
+        self._last_speech_frame = 0
+        self.speech_start_s = None
+        self.speech_end_s = None
+
+    @property
+    def in_speech(self):
+        return self.speech_start_s is not None and self.speech_end_s is None
+
+    def add_data(self, data):
+        """Processes audio, and returns True if the utterance ended in it."""
+        if self.speech_end_s is not None:
+            return False
+
+        for is_speech in self._vad.process(data):
+            self._frames += 1
+            self._speech_run = self._speech_run + 1 if is_speech else 0
+
+            if self._speech_run >= self._min_speech_frames:
+                if self.speech_start_s is None:
+                    self.speech_start_s = (self._frames - self._speech_run) * FRAME_S
+                self._last_speech_frame = self._frames
+            elif (self.speech_start_s is not None and
+                  self._frames - self._last_speech_frame >= self._hangover_frames):
+                self.speech_end_s = self._last_speech_frame * FRAME_S
+                return True
+        return False
+
+
+class SpeechGate(object):
+
+    """Holds audio back until an Endpointer finds the start of speech, then
+    releases it from lead_in_s before the start.
+
+    The endpointer must be given the same audio before the gate is.
+    """
+
+    def __init__(self, endpointer, lead_in_s=0.3, sample_rate_hz=16000, bytes_per_sample=2):
+        self._endpointer = endpointer
+        self._bytes_per_second = sample_rate_hz * bytes_per_sample
+        self._bytes_per_sample = bytes_per_sample
+        self._lead_in_s = lead_in_s
+        # Speech is found MIN_SPEECH_S after it starts, and the lead-in goes
+        # back further than that.
+        self._max_held_bytes = int((lead_in_s + endpointer.MIN_SPEECH_S + FRAME_S) *
+                                   self._bytes_per_second)
+        self._held = collections.deque()
+        self._held_bytes = 0
+        self._position = 0
+        self.is_open = False
+        # How much audio was held back and dropped, in bytes.
+        self.dropped_bytes = 0
+
+    def add_data(self, data):
+        """Returns the audio to pass on, which is empty while it's held."""
+        self._position += len(data)
+        if self.is_open:
+            return data
+
+        self._held.append(data)
+        self._held_bytes += len(data)
+        start_s = self._endpointer.speech_start_s
+        if start_s is None:
+            while self._held_bytes - len(self._held[0]) >= self._max_held_bytes:
+                self._drop(len(self._held.popleft()))
+            return b''
+
+        self.is_open = True
+        held = b''.join(self._held)
+        self._held.clear()
+        held_start = self._position - len(held)
+        start = int(max(0, start_s - self._lead_in_s) * self._bytes_per_second)
+        start -= start % self._bytes_per_sample
+        skip = max(0, start - held_start)
+        self._drop(skip)
+        return held[skip:]
+
+    def _drop(self, size):
+        self._held_bytes -= size
+        self.dropped_bytes += size
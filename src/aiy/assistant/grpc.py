@@ -23,14 +23,19 @@ import aiy.voicehat
 
 # Global variables. They are lazily initialized.
 _assistant_recognizer = None
+_async_assistant_recognizer = None
 
 
 class _AssistantRecognizer(object):
     """Your personal Google Assistant."""
 
     def __init__(self, credentials):
-        self._request = aiy._apis._speech.AssistantSpeechRequest(credentials)
+        self._request = self._make_request(credentials)
         self._recorder = aiy.audio.get_recorder()
+        self._recording = None
+
+    def _make_request(self, credentials):
+        return aiy._apis._speech.AssistantSpeechRequest(credentials)
 
     def recognize(self):
         """Recognizes the user's speech and gets answers from Google Assistant.
@@ -44,15 +49,41 @@ class _AssistantRecognizer(object):
             if transcript is not None:
                 print('You said ', transcript)
                 aiy.audio.play_audio(audio)
+
+        If cancel() is called meanwhile, it returns (None, None).
         """
-        self._request.reset()
-        self._request.set_endpointer_cb(self._endpointer_callback)
-        self._recorder.add_processor(self._request)
-        response = self._request.do_request()
+        recording = self._start_recording()
+        try:
+            response = recording.session.do_request()
+        finally:
+            self._finish_recording(recording)
         return response.transcript, response.response_audio
 
-    def _endpointer_callback(self):
-        self._recorder.remove_processor(self._request)
+    def cancel(self):
+        """Stops a recognize() call in progress, from another thread.
+
+        Recording stops and the request is cancelled, so recognize() returns
+        (None, None) right away. For example, a second button press can
+        cancel the current request and start a new one.
+        """
+        recording = self._recording
+        if recording:
+            recording.cancel()
+
+    def set_deadline(self, deadline_s):
+        """Makes recognize() fail with an error if it takes longer than
+        deadline_s, including the time the user is speaking.
+        """
+        self._request.set_deadline(deadline_s)
+
+    def _start_recording(self):
+        self._recording = aiy._apis._speech.RecordingSession(self._request, self._recorder)
+        return self._recording
+
+    def _finish_recording(self, recording):
+        recording.stop_recording()
+        if self._recording is recording:
+            self._recording = None
 
 
 def get_assistant():
@@ -77,3 +108,25 @@ def get_assistant():
         credentials = aiy.assistant.auth_helpers.get_assistant_credentials()
         _assistant_recognizer = _AssistantRecognizer(credentials)
     return _assistant_recognizer
+
+
+def get_async_assistant():
+    """Returns a recognizer for asyncio that uses Google Assistant APIs. It
+    requires Python 3.6 or later.
+
+    Sample usage:
+        recognizer = aiy.assistant.grpc.get_async_assistant()
+        while True:
+            transcript, audio = await recognizer.recognize()
+            if audio:
+                aiy.audio.play_audio(audio)
+    """
+    global _async_assistant_recognizer
+    if _async_assistant_recognizer is None:
+        # Coroutines are a syntax error before Python 3.5, so they live in a
+        # module that is only imported here.
+        import aiy._apis._recognizers_aio
+        credentials = aiy.assistant.auth_helpers.get_assistant_credentials()
+        _async_assistant_recognizer = aiy._apis._recognizers_aio.AsyncAssistantRecognizer(
+            credentials)
+    return _async_assistant_recognizer
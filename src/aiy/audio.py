@@ -24,6 +24,20 @@ import aiy._drivers._tts
 AUDIO_SAMPLE_SIZE = 2  # bytes per sample
 AUDIO_SAMPLE_RATE_HZ = 16000
 
+# Audio recorded before a recognizer is started and replayed to it, so that
+# speech started just before the trigger is not lost.
+AUDIO_PREROLL_S = 0.5
+
+# The VoiceHat has two microphones. To use both, set the channels to 2 and
+# pick one of the aiy._drivers._mixer modes to mix them down to mono.
+AUDIO_CAPTURE_CHANNELS = 1
+AUDIO_MIX_MODE = 'average'
+
+# If set, the recorder publishes its audio to a shared-memory bus at this path
+# (eg aiy._drivers._audiobus.DEFAULT_PATH), so that other processes can
+# listen in while it owns the microphone.
+AUDIO_BUS_PATH = None
+
 # Global variables. They are lazily initialized.
 _voicehat_recorder = None
 _voicehat_player = None
@@ -79,7 +93,9 @@ def get_recorder():
     """
     global _voicehat_recorder
     if _voicehat_recorder is None:
-        _voicehat_recorder = aiy._drivers._recorder.Recorder()
+        _voicehat_recorder = aiy._drivers._recorder.Recorder(
+            channels=AUDIO_CAPTURE_CHANNELS, mix_mode=AUDIO_MIX_MODE,
+            preroll_s=AUDIO_PREROLL_S, bus_path=AUDIO_BUS_PATH)
     return _voicehat_recorder
 
 
@@ -22,6 +22,7 @@ import aiy.voicehat
 
 # Global variables. They are lazily initialized.
 _cloudspeech_recognizer = None
+_async_cloudspeech_recognizer = None
 
 # Expected location of the CloudSpeech credentials file:
 CLOUDSPEECH_CREDENTIALS_FILE = os.path.expanduser('~/cloud_speech.json')
@@ -32,19 +33,42 @@ class _CloudSpeechRecognizer(object):
     """
 
     def __init__(self, credentials_file):
-        self._request = aiy._apis._speech.CloudSpeechRequest(credentials_file)
+        self._request = self._make_request(credentials_file)
         self._recorder = aiy.audio.get_recorder()
+        self._recording = None
+
+    def _make_request(self, credentials_file):
+        return aiy._apis._speech.CloudSpeechRequest(credentials_file)
 
     def recognize(self):
         """Recognizes the user's speech and transcript it into text.
 
         This function listens to the user's speech via the VoiceHat speaker. Then it
         contacts Google CloudSpeech APIs and returns a textual transcript if possible.
+        It returns None if cancel() is called meanwhile.
+        """
+        recording = self._start_recording()
+        try:
+            return recording.session.do_request().transcript
+        finally:
+            self._finish_recording(recording)
+
+    def cancel(self):
+        """Stops a recognize() call in progress, from another thread.
+
+        Recording stops and the request is cancelled, so recognize() returns
+        None right away. For example, a second button press can cancel the
+        current request and start a new one.
+        """
+        recording = self._recording
+        if recording:
+            recording.cancel()
+
+    def set_deadline(self, deadline_s):
+        """Makes recognize() fail with an error if it takes longer than
+        deadline_s, including the time the user is speaking.
         """
-        self._request.reset()
-        self._request.set_endpointer_cb(self._endpointer_callback)
-        self._recorder.add_processor(self._request)
-        return self._request.do_request().transcript
+        self._request.set_deadline(deadline_s)
 
     def expect_phrase(self, phrase):
         """Explicitly tells the engine that the phrase is more likely to appear.
@@ -59,8 +83,14 @@ class _CloudSpeechRecognizer(object):
         """
         self._request.add_phrase(phrase)
 
-    def _endpointer_callback(self):
-        self._recorder.remove_processor(self._request)
+    def _start_recording(self):
+        self._recording = aiy._apis._speech.RecordingSession(self._request, self._recorder)
+        return self._recording
+
+    def _finish_recording(self, recording):
+        recording.stop_recording()
+        if self._recording is recording:
+            self._recording = None
 
 
 def get_recognizer():
@@ -82,3 +112,25 @@ def get_recognizer():
     if _cloudspeech_recognizer is None:
         _cloudspeech_recognizer = _CloudSpeechRecognizer(CLOUDSPEECH_CREDENTIALS_FILE)
     return _cloudspeech_recognizer
+
+
+def get_async_recognizer():
+    """Returns a recognizer for asyncio that uses Google CloudSpeech APIs.
+    It requires Python 3.6 or later.
+
+    Sample usage:
+        recognizer = aiy.cloudspeech.get_async_recognizer()
+        recognizer.expect_phrase('light on')
+        while True:
+            text = await recognizer.recognize()
+            if 'light on' in text:
+                turn_on_light()
+    """
+    global _async_cloudspeech_recognizer
+    if _async_cloudspeech_recognizer is None:
+        # Coroutines are a syntax error before Python 3.5, so they live in a
+        # module that is only imported here.
+        import aiy._apis._recognizers_aio
+        _async_cloudspeech_recognizer = aiy._apis._recognizers_aio.AsyncCloudSpeechRecognizer(
+            CLOUDSPEECH_CREDENTIALS_FILE)
+    return _async_cloudspeech_recognizer
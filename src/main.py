@@ -25,6 +25,10 @@ import time
 
 import configargparse
 
+import aiy._apis._audiolog
+import aiy._apis._hedge
+import aiy._apis._trace
+import aiy._drivers._audiobus
 import aiy.audio
 import aiy.i18n
 import auth_helpers
@@ -129,6 +133,22 @@ def main():
                         choices=['clap', 'gpio', 'ok-google'], help='Trigger to use')
     parser.add_argument('--cloud-speech', action='store_true',
                         help='Use the Cloud Speech API instead of the Assistant API')
+    parser.add_argument('--hedged', action='store_true',
+                        help='Send audio to both the Cloud Speech API and the Assistant '
+                        'API. Local commands run as soon as Cloud Speech recognizes them, '
+                        'and everything else gets the Assistant response')
+    parser.add_argument('--early-action', action='store_true',
+                        help='Run local commands as soon as an interim Cloud Speech '
+                        'result matches one, before the final transcript. Needs '
+                        '--cloud-speech or --hedged')
+    parser.add_argument('--early-action-stability', type=float, default=0.8,
+                        help='How stable (0 to 1) an interim result must be, for '
+                        '--early-action (default: 0.8)')
+    parser.add_argument('--deadline-s', type=float,
+                        default=speech.GenericSpeechRequest.DEADLINE_SECS,
+                        help='Give up on a request that takes longer than this, '
+                        'including the time spent speaking (default: %d)' %
+                        speech.GenericSpeechRequest.DEADLINE_SECS)
     parser.add_argument('-L', '--language', default='en-US',
                         help='Language code to use for speech (default: en-US)')
     parser.add_argument('-l', '--led-fifo', default='/tmp/status-led',
@@ -136,7 +156,21 @@ def main():
     parser.add_argument('-p', '--pid-file',
                         help='File containing our process id for monitoring')
     parser.add_argument('--audio-logging', action='store_true',
-                        help='Log all requests and responses to WAV files in /tmp')
+                        help='Log all requests and responses to audio files, with a '
+                        'JSON file of the transcript and timings for each')
+    parser.add_argument('--audio-log-dir', default=aiy._apis._audiolog.DEFAULT_LOG_DIR,
+                        help='Where to write --audio-logging files (default: %(default)s)')
+    parser.add_argument('--audio-log-flac', action='store_true',
+                        help='Compress --audio-logging files with FLAC. Requires numpy')
+    parser.add_argument('--audio-log-max-mb', type=float, default=100,
+                        help='Remove the oldest --audio-logging files when they take up '
+                        'more than this (default: 100)')
+    parser.add_argument('--audio-log-max-age-h', type=float, default=0,
+                        help='Remove --audio-logging files older than this many hours '
+                        '(default: 0, keep them)')
+    parser.add_argument('--trace-file',
+                        help='Append the time each stage of every turn took to this '
+                        'JSONL file, for checkpoints/trace_summary.py')
     parser.add_argument('--assistant-always-responds', action='store_true',
                         help='Play Assistant responses for local actions.'
                         ' You should make sure that you have IFTTT applets for'
@@ -151,24 +185,64 @@ def main():
                         'Cloud Speech API')
     parser.add_argument('--trigger-sound', default=None,
                         help='Sound when trigger is activated (WAV format)')
+    parser.add_argument('--audio-bus', action='store_true',
+                        help='Share recorded audio with other processes, such as '
+                        'checkpoints/check_audio.py, through a file in memory')
+    parser.add_argument('--audio-bus-path', default=aiy._drivers._audiobus.DEFAULT_PATH,
+                        help='Where to publish audio for --audio-bus. Other '
+                        'processes must use the same path (default: %(default)s)')
+    parser.add_argument('--audio-encoding', choices=speech.AUDIO_ENCODINGS,
+                        default=speech.DEFAULT_AUDIO_ENCODING,
+                        help='How to encode audio sent to the cloud (default: FLAC '
+                        'if numpy is installed, otherwise LINEAR16)')
+    parser.add_argument('--local-endpointer', action='store_true',
+                        help='Stop sending audio when a local voice activity detector '
+                        'hears the end of speech, without waiting for the server. '
+                        'Requires numpy')
+    parser.add_argument('--vad-threshold-db', type=float, default=10.0,
+                        help='How far above background noise speech must be, for '
+                        '--local-endpointer (default: 10)')
+    parser.add_argument('--vad-hangover-s', type=float, default=0.8,
+                        help='Seconds of silence that end an utterance, for '
+                        '--local-endpointer (default: 0.8)')
+    parser.add_argument('--speech-gate', action='store_true',
+                        help="Don't send audio until the user starts speaking, and give "
+                        'up without contacting the server if they never do. Requires numpy')
+    parser.add_argument('--lead-in-s', type=float, default=0.3,
+                        help='Seconds of audio to send from before the start of speech, '
+                        'for --speech-gate (default: 0.3)')
+    parser.add_argument('--no-speech-timeout-s', type=float, default=5.0,
+                        help='Seconds to wait for speech, for --speech-gate (default: 5)')
 
     args = parser.parse_args()
 
     create_pid_file(args.pid_file)
+    if args.trace_file:
+        aiy._apis._trace.enable(os.path.expanduser(args.trace_file))
     aiy.i18n.set_locale_dir(LOCALE_DIR)
     aiy.i18n.set_language_code(args.language, gettext_install=True)
 
     player = aiy.audio.get_player()
 
-    if args.cloud_speech:
+    if args.cloud_speech or args.hedged:
         credentials_file = os.path.expanduser(args.cloud_speech_secrets)
         if not os.path.exists(credentials_file) and os.path.exists(OLD_SERVICE_CREDENTIALS):
             credentials_file = OLD_SERVICE_CREDENTIALS
         recognizer = speech.CloudSpeechRequest(credentials_file)
-    else:
+    if not args.cloud_speech:
         credentials = try_to_get_credentials(
             os.path.expanduser(args.assistant_secrets))
-        recognizer = speech.AssistantSpeechRequest(credentials)
+        if args.hedged:
+            recognizer = aiy._apis._hedge.HedgedRequest(
+                recognizer, speech.AssistantSpeechRequest(credentials))
+        else:
+            recognizer = speech.AssistantSpeechRequest(credentials)
+    recognizer.set_audio_encoding(args.audio_encoding)
+    recognizer.set_deadline(args.deadline_s)
+    recognizer.set_local_endpointer_enabled(
+        args.local_endpointer, args.vad_threshold_db, args.vad_hangover_s)
+    recognizer.set_speech_gate_enabled(
+        args.speech_gate, args.lead_in_s, args.no_speech_timeout_s)
 
     status_ui = StatusUi(player, args.led_fifo, args.trigger_sound)
     # switch = GpioSwitch([action.reboot, action.shutdown])
@@ -177,12 +251,14 @@ def main():
     # The ok-google trigger is handled with the Assistant Library, so we need
     # to catch this case early.
     if args.trigger == 'ok-google':
-        if args.cloud_speech:
+        if args.cloud_speech or args.hedged:
             print('trigger=ok-google only works with the Assistant, not with '
                   'the Cloud Speech API.')
             sys.exit(1)
         do_assistant_library(args, credentials, player, status_ui)
     else:
+        if args.audio_bus:
+            aiy.audio.AUDIO_BUS_PATH = args.audio_bus_path
         recorder = aiy.audio.get_recorder()
         with recorder:
             do_recognition(args, recorder, recognizer, player, status_ui)
@@ -261,7 +337,13 @@ def do_recognition(args, recorder, recognizer, player, status_ui):
         action.add_commands_just_for_cloud_speech_api(actor, say)
 
     recognizer.add_phrases(actor)
-    recognizer.set_audio_logging_enabled(args.audio_logging)
+    if args.audio_logging:
+        audio_log = aiy._apis._audiolog.AudioLog(
+            args.audio_log_dir, speech.AUDIO_SAMPLE_RATE_HZ, compress=args.audio_log_flac,
+            max_bytes=int(args.audio_log_max_mb * 1024 * 1024),
+            max_age_s=args.audio_log_max_age_h * 3600 or None)
+        audio_log.start()
+        recognizer.set_audio_log(audio_log)
 
     if args.trigger == 'gpio':
         import triggers.gpio
@@ -278,6 +360,8 @@ def do_recognition(args, recorder, recognizer, player, status_ui):
     mic_recognizer = SyncMicRecognizer(
         actor, recognizer, recorder, player, say, triggerer, status_ui,
         args.assistant_always_responds)
+    if args.early_action:
+        mic_recognizer.enable_early_action(args.early_action_stability)
 
     with mic_recognizer:
         if sys.stdout.isatty():
@@ -327,99 +411,276 @@ class StatusUi(object):
             self.player.play_wav(self.trigger_sound)
 
 
+class _Turn(object):
+
+    """The session of one trigger, and the response it plays."""
+
+    def __init__(self, session):
+        self.session = session
+        self.listening = True
+        self.cancelled = False
+        self.response_stream = None
+        self.early_transcript = None
+        self.trace = None
+
+
 class SyncMicRecognizer(object):
 
-    """Detects triggers and runs recognition in a background thread.
+    """Detects triggers and runs recognition in background threads.
 
-    This is a context manager, so it will clean up the background thread if the
-    main program is interrupted.
+    Each trigger starts a session of the recognizer in its own thread. Once
+    the session's result arrives, a new trigger can start the next session
+    while the command runs or the response plays. A trigger before then
+    cancels the session and starts again.
+
+    This is a context manager, so it will clean up the background threads if
+    the main program is interrupted.
     """
 
     # pylint: disable=too-many-instance-attributes
 
+    # How long the trigger sound may still be heard after it finished playing,
+    # allowing for the capture latency.
+    TRIGGER_SOUND_ECHO_S = 0.1
+
     def __init__(self, actor, recognizer, recorder, player, say, triggerer,
                  status_ui, assistant_always_responds):
         self.actor = actor
         self.player = player
         self.recognizer = recognizer
-        self.recognizer.set_endpointer_cb(self.endpointer_cb)
         self.recorder = recorder
         self.say = say
         self.triggerer = triggerer
         self.triggerer.set_callback(self.recognize)
         self.status_ui = status_ui
         self.assistant_always_responds = assistant_always_responds
+        self.streams_response = isinstance(
+            recognizer, (speech.AssistantSpeechRequest, aiy._apis._hedge.HedgedRequest))
+        if isinstance(recognizer, aiy._apis._hedge.HedgedRequest):
+            recognizer.set_can_handle_cb(actor.can_handle, assistant_always_responds)
+        self.early_action_stability = None
 
         self.running = False
 
-        self.recognizer_event = threading.Event()
+        # The turn that is still waiting for its result, if any.
+        self._pending_turn = None
+        self._lock = threading.Lock()
+
+    def enable_early_action(self, min_stability):
+        """Runs local commands from interim Cloud Speech results."""
+        cloud_request = getattr(self.recognizer, 'cloud_request', self.recognizer)
+        if not isinstance(cloud_request, speech.CloudSpeechRequest):
+            logger.warning('Early action needs the Cloud Speech API, ignoring it')
+            return
+        self.early_action_stability = min_stability
 
     def __enter__(self):
         self.running = True
-        threading.Thread(target=self._recognize).start()
         self.triggerer.start()
         self.status_ui.status('ready')
 
     def __exit__(self, *args):
         self.running = False
-        self.recognizer_event.set()
+        with self._lock:
+            turn = self._pending_turn
+        if turn:
+            self._cancel_turn(turn)
 
-        self.recognizer.end_audio()
+    def recognize(self, preroll=True):
+        with self._lock:
+            if not self.running:
+                return
+            previous = self._pending_turn
+            turn = self._start_turn()
+            self._pending_turn = turn
+
+        if previous:
+            # Pressing again cancels the current request and starts over.
+            logger.info('triggered again, cancelling the current request')
+            self._cancel_turn(previous)
+
+        # Start recording before the trigger sound plays, and include the
+        # pre-roll so speech that started with the trigger isn't cut off.
+        turn.trace = aiy._apis._trace.start_turn()
+        turn.session.set_trace(turn.trace)
+        self.recorder.add_processor(turn.session, preroll=preroll)
+        self._play_trigger_sound(turn)
+        # Triggering again cancels this turn, so re-arm the trigger now.
+        # GpioTrigger stays armed, but ClapTrigger ignores claps until it is
+        # started again. The trigger sound has played, so it can't clap.
+        self.triggerer.start()
+        threading.Thread(target=self._recognize, args=(turn,)).start()
+
+    def _play_trigger_sound(self, turn):
+        """Shows the listening status, and leaves the trigger sound out of
+        the turn's audio: the endpointers would take it for speech.
+        """
+        if not getattr(self.status_ui, 'trigger_sound', None):
+            self.status_ui.status('listening')
+            return
+        sound_start = time.monotonic()
+        self.recorder.skip_audio(turn.session, sound_start)
+        self.status_ui.status('listening')
+        self.recorder.skip_audio(turn.session, sound_start,
+                                 time.monotonic() + self.TRIGGER_SOUND_ECHO_S)
+
+    def _start_turn(self):
+        """Returns a turn with a new session, and its callbacks set."""
+        turn = _Turn(self.recognizer.new_session())
+        turn.session.set_endpointer_cb(lambda: self.endpointer_cb(turn))
+        if self.streams_response:
+            turn.session.set_response_stream_cb(
+                lambda transcript: self._open_response_stream(turn, transcript))
+        if self.early_action_stability is not None:
+            turn.session.set_early_action_cb(
+                self.actor.can_handle,
+                lambda transcript: self._run_early_action(turn, transcript),
+                self.early_action_stability)
+        return turn
+
+    def endpointer_cb(self, turn):
+        if self._stop_listening(turn) and not turn.cancelled:
+            self.status_ui.status('thinking')
+
+    def _stop_listening(self, turn):
+        """Stops recording for turn. Returns False if it already stopped."""
+        with self._lock:
+            if not turn.listening:
+                return False
+            turn.listening = False
+        self.recorder.remove_processor(turn.session)
+        return True
+
+    def _cancel_turn(self, turn):
+        """Stops recording and cancels the request, so its thread finishes
+        right away. A response that is already playing is cut off.
+        """
+        turn.cancelled = True
+        self._stop_listening(turn)
+        turn.session.cancel()
+        self._finish_response_stream(turn)
+
+    def _ready(self):
+        self.triggerer.start()
+        self.status_ui.status('ready')
 
-    def recognize(self):
-        if self.recognizer_event.is_set():
-            # Duplicate trigger (eg multiple button presses)
+    def _recognize(self, turn):
+        logger.info('recognizing...')
+        result = None
+        ready = False
+        try:
+            result = turn.session.do_request()
+            self._stop_listening(turn)
+            with self._lock:
+                if self._pending_turn is turn:
+                    self._pending_turn = None
+            if turn.cancelled:
+                # The turn that cancelled this one has the trigger now.
+                return
+            if not turn.session.dialog_follow_on:
+                # The next trigger can start a new turn while this one's
+                # command runs or its response plays.
+                self._ready()
+                ready = True
+            self._handle_result(turn, result)
+        except Exception:  # pylint: disable=broad-except
+            # Not just speech.Error: a hedged request passes on the
+            # Assistant's errors as they are, and anything that ends this
+            # thread would leave the trigger disarmed.
+            with self._lock:
+                if self._pending_turn is turn:
+                    self._pending_turn = None
+            logger.exception('Unexpected error')
+            self.say(_('Unexpected error. Try again or check the logs.'))
+        finally:
+            self._stop_listening(turn)
+            self._finish_response_stream(turn)
+            aiy._apis._trace.end_turn(
+                turn.trace,
+                transcript=result.transcript if result else None,
+                early_action=turn.early_transcript is not None,
+                cancelled=turn.cancelled,
+                error=result is None)
+
+        if not self.running or turn.cancelled:
+            return
+        if result and turn.session.dialog_follow_on:
+            # The pre-roll would contain the end of the Assistant's reply.
+            self.recognize(preroll=False)
+        elif not ready:
+            self._ready()
+
+    def _run_early_action(self, turn, transcript):
+        turn.early_transcript = transcript
+        self._handle_command(turn, transcript)
+
+    def _handle_command(self, turn, transcript):
+        """Runs the local command for transcript, if there is one."""
+        start = time.monotonic()
+        if not self.actor.handle(transcript):
+            return False
+        aiy._apis._trace.mark(aiy._apis._trace.ACTION_START, start, turn=turn.trace)
+        aiy._apis._trace.mark(aiy._apis._trace.ACTION_END, turn=turn.trace)
+        return True
+
+    def _handle_result(self, turn, result):
+        if turn.early_transcript:
+            # The command already ran, so don't run it again for the final
+            # transcript.
+            logger.info('handled local command early: %s (final: %s)',
+                        turn.early_transcript, result.transcript)
+            if result.response_audio and self.assistant_always_responds:
+                self._play_assistant_response(turn, result.response_audio)
             return
 
-        self.status_ui.status('listening')
-        self.recognizer.reset()
-        self.recorder.add_processor(self.recognizer)
-        # Tell recognizer to run
-        self.recognizer_event.set()
-
-    def endpointer_cb(self):
-        self.recorder.remove_processor(self.recognizer)
-        self.status_ui.status('thinking')
-
-    def _recognize(self):
-        while self.running:
-            self.recognizer_event.wait()
-            if not self.running:
-                break
-
-            logger.info('recognizing...')
-            try:
-                self._handle_result(self.recognizer.do_request())
-            except speech.Error:
-                logger.exception('Unexpected error')
-                self.say(_('Unexpected error. Try again or check the logs.'))
-
-            self.recognizer_event.clear()
-            if self.recognizer.dialog_follow_on:
-                self.recognize()
-            else:
-                self.triggerer.start()
-                self.status_ui.status('ready')
-
-    def _handle_result(self, result):
-        if result.transcript and self.actor.handle(result.transcript):
+        if result.transcript and self._handle_command(turn, result.transcript):
             logger.info('handled local command: %s', result.transcript)
             if result.response_audio and self.assistant_always_responds:
-                self._play_assistant_response(result.response_audio)
+                self._play_assistant_response(turn, result.response_audio)
         elif result.response_audio:
-            self._play_assistant_response(result.response_audio)
+            self._play_assistant_response(turn, result.response_audio)
         elif result.transcript:
             logger.warning('%r was not handled', result.transcript)
         else:
             logger.warning('no command recognized')
 
-    def _play_assistant_response(self, audio_bytes):
+    def _open_response_stream(self, turn, transcript):
+        """Starts playing the Assistant's response while it downloads, unless
+        it's for a local command that the Assistant shouldn't answer.
+        """
+        if turn.cancelled:
+            return None
+        if (transcript and self.actor.can_handle(transcript) and
+                not self.assistant_always_responds):
+            return None
+        turn.response_stream = self.player.open_stream(
+            speech.AUDIO_SAMPLE_RATE_HZ, speech.AUDIO_SAMPLE_SIZE, trace_turn=turn.trace)
+        return turn.response_stream
+
+    def _finish_response_stream(self, turn):
+        """Waits for the end of the streamed response, if any. The response
+        of a cancelled turn is stopped instead.
+        """
+        stream, turn.response_stream = turn.response_stream, None
+        if not stream:
+            return
+        if turn.cancelled:
+            stream.stop()
+        else:
+            stream.close()
+
+    def _play_assistant_response(self, turn, audio_bytes):
+        if turn.response_stream:
+            # Already playing while it downloaded.
+            self._finish_response_stream(turn)
+            return
+
         bytes_per_sample = speech.AUDIO_SAMPLE_SIZE
         sample_rate_hz = speech.AUDIO_SAMPLE_RATE_HZ
         logger.info('Playing %.4f seconds of audio...',
                     len(audio_bytes) / (bytes_per_sample * sample_rate_hz))
         self.player.play_bytes(audio_bytes, sample_width=bytes_per_sample,
-                               sample_rate=sample_rate_hz)
+                               sample_rate=sample_rate_hz, trace_turn=turn.trace)
 
 
 if __name__ == '__main__':
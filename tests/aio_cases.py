@@ -0,0 +1,205 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The asyncio tests, which test_aio.py runs where they can.
+
+This module only parses on Python 3.6 and later, and needs grpc.aio, so it
+isn't imported on the Python that the rest of the tests support. The
+classes are mixins: test_aio.py makes TestCases of them.
+"""
+
+import asyncio
+import threading
+import time
+
+import grpc
+import grpc.aio
+
+import aiy._apis._aio
+import aiy._apis._channel
+
+try:
+    import fakeserver
+    import aiy._apis._speech_aio as speech_aio
+except (ImportError, AttributeError):
+    # The generated protobuf modules don't import with newer protobuf
+    # runtimes.
+    fakeserver = None
+
+METHOD = '/test.Echo/Stream'
+CHUNK = b'\x01\x00' * 1600  # 100 ms of audio
+
+
+async def echo(request_iterator, context):
+    """Replies with the length of each request, once the requests end."""
+    lengths = [len(request) async for request in request_iterator]
+    for length in lengths:
+        yield str(length).encode()
+
+
+async def start_server():
+    server = grpc.aio.server()
+    server.add_generic_rpc_handlers((grpc.method_handlers_generic_handler(
+        'test.Echo', {'Stream': grpc.stream_stream_rpc_method_handler(echo)}),))
+    port = server.add_insecure_port('localhost:0')
+    await server.start()
+    return server, port
+
+
+class AudioBridgeTests(object):
+
+    def test_put_from_thread(self):
+        async def main():
+            bridge = aiy._apis._aio.AudioBridge()
+            chunks = [b'a', b'bb', b'ccc', None]
+            thread = threading.Thread(target=lambda: [bridge.put(c) for c in chunks])
+            thread.start()
+            received = [data async for data in bridge]
+            thread.join()
+            return received
+
+        self.assertEqual(asyncio.run(main()), [b'a', b'bb', b'ccc'])
+
+    def test_close_drops_queued_audio(self):
+        async def main():
+            bridge = aiy._apis._aio.AudioBridge()
+            bridge.put(b'queued')
+            thread = threading.Thread(target=bridge.close)
+            thread.start()
+            thread.join()
+            bridge.put(b'late')
+            return [data async for data in bridge]
+
+        self.assertEqual(asyncio.run(main()), [])
+
+    def test_put_after_loop_closes(self):
+        async def main():
+            return aiy._apis._aio.AudioBridge()
+
+        bridge = asyncio.run(main())
+        # The recorder can outlive the loop, and mustn't be broken by it.
+        bridge.put(b'late')
+
+
+class AsyncChannelTests(object):
+
+    def run_with_server(self, client):
+        async def main():
+            server, port = await start_server()
+            channel = aiy._apis._aio.AsyncChannel(
+                lambda options: grpc.aio.insecure_channel('localhost:%d' % port, options=options),
+                aiy._apis._channel.keepalive_options())
+            try:
+                return await client(channel)
+            finally:
+                await channel.close()
+                await server.stop(None)
+
+        return asyncio.run(main())
+
+    def test_stream_from_bridge(self):
+        async def client(channel):
+            self.assertTrue(await channel.wait_ready(5))
+            timer = aiy._apis._channel.RequestTimer()
+            bridge = aiy._apis._aio.AudioBridge()
+            call = channel.get().stream_stream(METHOD)(
+                aiy._apis._aio.timed_requests(timer, bridge))
+            for data in (b'x' * 10, b'y' * 20, None):
+                bridge.put(data)
+            responses = [r async for r in aiy._apis._aio.timed_responses(timer, call)]
+            timer.finish()
+            return timer, responses
+
+        timer, responses = self.run_with_server(client)
+        self.assertEqual(responses, [b'10', b'20'])
+        self.assertIsNotNone(timer.first_request_s)
+        self.assertGreaterEqual(timer.first_response_s, timer.first_request_s)
+
+    def test_concurrent_streams_share_channel(self):
+        async def session(channel, size):
+            bridge = aiy._apis._aio.AudioBridge()
+            call = channel.get().stream_stream(METHOD)(bridge)
+            for _ in range(3):
+                bridge.put(b'x' * size)
+                await asyncio.sleep(0.01)
+            bridge.put(None)
+            return [r async for r in call]
+
+        async def client(channel):
+            return await asyncio.gather(*(session(channel, n) for n in range(1, 21)))
+
+        results = self.run_with_server(client)
+        self.assertEqual(results, [[str(n).encode()] * 3 for n in range(1, 21)])
+
+    def test_channel_is_created_on_first_use(self):
+        made = []
+
+        def make_channel(options):
+            made.append(options)
+            return grpc.aio.insecure_channel('localhost:1', options=options)
+
+        async def main():
+            channel = aiy._apis._aio.AsyncChannel(make_channel, [('grpc.test', 1)])
+            self.assertEqual(made, [])
+            self.assertIs(channel.get(), channel.get())
+            self.assertFalse(await channel.wait_ready(0.1))
+            await channel.close()
+
+        asyncio.run(main())
+        self.assertEqual(made, [[('grpc.test', 1)]])
+
+
+class AsyncSpeechRequestTests(object):
+
+    def start_server(self, script):
+        server = fakeserver.FakeSpeechServer([script]).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def make_request(self, server, chunks):
+        request = speech_aio.AsyncCloudSpeechRequest(
+            None, fakeserver.fake_credentials(), server.channel_factory())
+        request.reset()
+        for _ in range(chunks):
+            request.add_data(CHUNK)
+        request.end_audio()
+        return request
+
+    def test_async_request(self):
+        server = self.start_server(fakeserver.Script('hello'))
+
+        async def main():
+            request = self.make_request(server, 2)
+            result = await request.do_request()
+            await request.close()
+            return result
+
+        self.assertEqual(asyncio.run(main()).transcript, 'hello')
+
+    def test_async_cancel(self):
+        server = self.start_server(fakeserver.Script('hello', latency_s=5))
+
+        async def main():
+            request = self.make_request(server, 1)
+            # Like a button press, from another thread.
+            threading.Timer(0.2, request.cancel).start()
+            start = time.monotonic()
+            result = await request.do_request()
+            elapsed = time.monotonic() - start
+            await request.close()
+            return result, elapsed
+
+        result, elapsed = asyncio.run(main())
+        self.assertEqual(result, (None, None))
+        self.assertLess(elapsed, 2)
@@ -0,0 +1,303 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local stand-ins for the Cloud Speech and Assistant gRPC services.
+
+The servers answer each call from a Script: the transcript, when to send the
+endpointer event, the response audio, and how long to take or which error to
+return. They listen on a local port, and channel_factory() returns what the
+speech requests need to connect to them, so tests and benchmarks can run
+without credentials or a network:
+
+    with FakeSpeechServer([Script('turn on the light')]) as server:
+        request = CloudSpeechRequest(None, fake_credentials(),
+                                     server.channel_factory())
+"""
+
+from abc import abstractmethod
+import collections
+from concurrent import futures
+import random
+import threading
+import time
+
+import google.oauth2.credentials
+from google.cloud.grpc.speech.v1beta1 import cloud_speech_pb2 as cloud_speech
+from google.assistant.embedded.v1alpha1 import embedded_assistant_pb2
+import grpc
+
+# How long a call waits for the first audio before giving up.
+FIRST_AUDIO_TIMEOUT_S = 30
+
+# What the server saw of one call: the config request and the audio bytes,
+# still encoded as the client sent them.
+RecordedCall = collections.namedtuple('RecordedCall', ['config', 'audio'])
+
+
+class Script(object):
+
+    """How the server answers one call.
+
+    Args:
+        transcript: the final transcript
+        interim: (seconds after the first audio, transcript, stability) for
+            each interim result, sent while the client is still sending audio
+        endpoint_after_s: seconds after the first audio to send the endpointer
+            event, or None to wait for the client to end the audio
+        response_audio: the Assistant's response audio
+        latency_s: seconds from the end of the audio to the final result
+        jitter_s: up to this many seconds are added to latency_s at random
+        error: a grpc.StatusCode to fail the call with, after the latency
+        error_rate: the chance of failing with error, from 0 to 1
+        dialog_follow_on: whether the Assistant expects the user to answer
+        chunk_bytes: the size of each response audio chunk
+    """
+
+    def __init__(self, transcript='', interim=(), endpoint_after_s=None,
+                 response_audio=b'', latency_s=0.0, jitter_s=0.0, error=None,
+                 error_rate=1.0, dialog_follow_on=False, chunk_bytes=3200):
+        self.transcript = transcript
+        self.interim = interim
+        self.endpoint_after_s = endpoint_after_s
+        self.response_audio = response_audio
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.error = error
+        self.error_rate = error_rate
+        self.dialog_follow_on = dialog_follow_on
+        self.chunk_bytes = chunk_bytes
+
+    def delay(self):
+        """Returns the seconds to wait before the final result."""
+        return self.latency_s + random.uniform(0, self.jitter_s)
+
+    def pick_error(self):
+        """Returns the error to fail this call with, or None."""
+        if self.error is not None and random.random() < self.error_rate:
+            return self.error
+        return None
+
+
+def fake_credentials():
+    """Returns credentials that never need refreshing, for requests to the
+    fake servers.
+    """
+    return google.oauth2.credentials.Credentials('fake-token')
+
+
+class InsecureChannelFactory(object):
+
+    """Creates plaintext channels to a local server, in place of the
+    _ChannelFactory of a speech request.
+    """
+
+    def __init__(self, target):
+        self._target = target
+
+    def make_channel(self, options=None):
+        return grpc.insecure_channel(self._target, options=options)
+
+    def make_async_channel(self, options=None):
+        import grpc.aio  # pylint: disable=redefined-outer-name
+        return grpc.aio.insecure_channel(self._target, options=options)
+
+
+class _Call(object):
+
+    """Reads the request stream of a call in a background thread, so the
+    server can send responses while the client is still sending audio.
+    """
+
+    def __init__(self, request_iterator, get_config, get_audio):
+        self.config = None
+        self._audio = []
+        self._first_audio_time = None
+        self.first_audio = threading.Event()
+        self.ended = threading.Event()
+        self._get_config = get_config
+        self._get_audio = get_audio
+        threading.Thread(target=self._read, args=(request_iterator,), daemon=True).start()
+
+    def _read(self, request_iterator):
+        try:
+            for request in request_iterator:
+                config = self._get_config(request)
+                if config is not None:
+                    self.config = config
+                    continue
+                self._audio.append(self._get_audio(request))
+                if not self.first_audio.is_set():
+                    self._first_audio_time = time.monotonic()
+                    self.first_audio.set()
+        except grpc.RpcError:
+            pass  # The call was cancelled.
+        finally:
+            self.first_audio.set()
+            self.ended.set()
+
+    @property
+    def audio(self):
+        return b''.join(self._audio)
+
+    def wait_until(self, after_s):
+        """Waits until after_s seconds after the first audio. Returns False if
+        the audio ended first.
+        """
+        self.first_audio.wait(FIRST_AUDIO_TIMEOUT_S)
+        if self._first_audio_time is None:
+            return False
+        remaining = self._first_audio_time + after_s - time.monotonic()
+        return not self.ended.wait(max(0, remaining))
+
+
+class _FakeServer(object):
+
+    """A gRPC server on a local port that answers calls from scripts.
+
+    The scripts are used in order, and the last one for every call after
+    that. Each call is recorded in calls.
+    """
+
+    def __init__(self, scripts=None, max_workers=16):
+        self._lock = threading.Lock()
+        self._scripts = list(scripts or [Script()])
+        self.calls = []
+        self._server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+        self._add_to_server(self._server)
+        self.port = self._server.add_insecure_port('localhost:0')
+
+    @abstractmethod
+    def _add_to_server(self, server):
+        """Registers the servicer with the gRPC server.
+        """
+        return
+
+    @property
+    def target(self):
+        return 'localhost:%d' % self.port
+
+    def channel_factory(self):
+        """Returns a channel factory for speech requests to this server."""
+        return InsecureChannelFactory(self.target)
+
+    def set_scripts(self, scripts):
+        with self._lock:
+            self._scripts = list(scripts)
+
+    def start(self):
+        self._server.start()
+        return self
+
+    def stop(self):
+        self._server.stop(0).wait()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _start_call(self, request_iterator, get_config, get_audio):
+        with self._lock:
+            script = self._scripts[0]
+            if len(self._scripts) > 1:
+                self._scripts.pop(0)
+        return script, _Call(request_iterator, get_config, get_audio)
+
+    def _record(self, call):
+        with self._lock:
+            self.calls.append(RecordedCall(call.config, call.audio))
+
+    def _finish(self, script, call, context):
+        """Waits for the end of the audio and the script's latency, then
+        aborts the call if the script calls for an error.
+        """
+        call.ended.wait()
+        self._record(call)
+        time.sleep(script.delay())
+        error = script.pick_error()
+        if error is not None:
+            context.abort(error, 'injected error')
+
+
+class FakeSpeechServer(_FakeServer, cloud_speech.SpeechServicer):
+
+    """Answers Speech.StreamingRecognize calls. The other methods are left
+    unimplemented.
+    """
+
+    def _add_to_server(self, server):
+        cloud_speech.add_SpeechServicer_to_server(self, server)
+
+    def StreamingRecognize(self, request_iterator, context):  # pylint: disable=invalid-name
+        script, call = self._start_call(
+            request_iterator,
+            lambda r: r.streaming_config if r.HasField('streaming_config') else None,
+            lambda r: r.audio_content)
+
+        Response = cloud_speech.StreamingRecognizeResponse
+        events = [(after_s, self._result(transcript, is_final=False, stability=stability))
+                  for after_s, transcript, stability in script.interim]
+        if script.endpoint_after_s is not None:
+            events.append((script.endpoint_after_s,
+                           Response(endpointer_type=Response.END_OF_SPEECH)))
+            events.append((script.endpoint_after_s,
+                           Response(endpointer_type=Response.END_OF_AUDIO)))
+        for after_s, response in sorted(events, key=lambda event: event[0]):
+            if not call.wait_until(after_s):
+                break
+            yield response
+
+        self._finish(script, call, context)
+        if script.transcript:
+            yield self._result(script.transcript, is_final=True)
+
+    @staticmethod
+    def _result(transcript, is_final, stability=0.0):
+        alternative = cloud_speech.SpeechRecognitionAlternative(
+            transcript=transcript, confidence=0.9 if is_final else 0.0)
+        result = cloud_speech.StreamingRecognitionResult(
+            alternatives=[alternative], is_final=is_final, stability=stability)
+        return cloud_speech.StreamingRecognizeResponse(results=[result])
+
+
+class FakeAssistantServer(_FakeServer, embedded_assistant_pb2.EmbeddedAssistantServicer):
+
+    """Answers EmbeddedAssistant.Converse calls."""
+
+    def _add_to_server(self, server):
+        embedded_assistant_pb2.add_EmbeddedAssistantServicer_to_server(self, server)
+
+    def Converse(self, request_iterator, context):  # pylint: disable=invalid-name
+        script, call = self._start_call(
+            request_iterator,
+            lambda r: r.config if r.HasField('config') else None,
+            lambda r: r.audio_in)
+
+        Response = embedded_assistant_pb2.ConverseResponse
+        if script.endpoint_after_s is not None and call.wait_until(script.endpoint_after_s):
+            yield Response(event_type=Response.END_OF_UTTERANCE)
+
+        self._finish(script, call, context)
+        Result = embedded_assistant_pb2.ConverseResult
+        yield Response(result=Result(
+            spoken_request_text=script.transcript,
+            conversation_state=b'fake-state',
+            microphone_mode=(Result.DIALOG_FOLLOW_ON if script.dialog_follow_on
+                             else Result.CLOSE_MICROPHONE)))
+
+        audio = script.response_audio
+        for i in range(0, len(audio), script.chunk_bytes):
+            yield Response(audio_out=embedded_assistant_pb2.AudioOut(
+                audio_data=audio[i:i + script.chunk_bytes]))
@@ -0,0 +1,60 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Test the asyncio audio bridge and channel against a local echo server,
+and the asyncio speech requests against the fake servers.
+
+The tests are in aio_cases.py, and only run with asyncio.run() (Python 3.7)
+and a grpcio that has grpc.aio.
+'''
+
+import sys
+import unittest
+
+aio_cases = None
+if sys.version_info >= (3, 7):
+    try:
+        import aio_cases
+    except ImportError:
+        # grpc.aio needs grpcio 1.32 or later.
+        pass
+
+
+class _Unavailable(object):
+    pass
+
+
+def cases(name):
+    """Returns the mixin called name from aio_cases, if it was imported."""
+    return getattr(aio_cases, name) if aio_cases else _Unavailable
+
+
+@unittest.skipIf(aio_cases is None, 'needs Python 3.7 and grpc.aio')
+class TestAudioBridge(cases('AudioBridgeTests'), unittest.TestCase):
+    pass
+
+
+@unittest.skipIf(aio_cases is None, 'needs Python 3.7 and grpc.aio')
+class TestAsyncChannel(cases('AsyncChannelTests'), unittest.TestCase):
+    pass
+
+
+@unittest.skipIf(aio_cases is None or aio_cases.fakeserver is None,
+                 'needs Python 3.7, grpc.aio and the speech APIs')
+class TestAsyncSpeechRequest(cases('AsyncSpeechRequestTests'), unittest.TestCase):
+    pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Test the shared-memory audio bus.'''
+
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+import wave
+
+import aiy._drivers._audiobus as audiobus
+import aiy._drivers._capture
+import aiy._drivers._recorder
+
+
+def make_audio(num_bytes, seed=0):
+    return bytes((i + seed) % 251 for i in range(num_bytes))
+
+
+class TestAudioBus(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'bus')
+        # One second of 16 kHz mono s16 audio.
+        self.writer = audiobus.AudioBusWriter(self.path, capacity_s=1)
+        self.capacity = 32000
+
+    def tearDown(self):
+        self.writer.close()
+        self.temp_dir.cleanup()
+
+    def test_format_in_header(self):
+        with audiobus.AudioBusReader(self.path) as reader:
+            self.assertEqual(reader.sample_rate_hz, 16000)
+            self.assertEqual(reader.channels, 1)
+            self.assertEqual(reader.bytes_per_sample, 2)
+            self.assertEqual(reader.capacity, self.capacity)
+
+    def test_reads_across_ring_end(self):
+        audio = make_audio(self.capacity * 3)
+        with audiobus.AudioBusReader(self.path) as reader:
+            received = []
+            for start in range(0, len(audio), 3000):
+                self.writer.add_data(audio[start:start + 3000])
+                received.append(reader.read_nowait(self.capacity))
+            self.assertEqual(b''.join(received), audio)
+
+    def test_new_reader_starts_live(self):
+        self.writer.add_data(make_audio(1000))
+        with audiobus.AudioBusReader(self.path) as reader:
+            self.assertEqual(reader.read_nowait(1000), b'')
+            self.writer.add_data(make_audio(1000, seed=1))
+            self.assertEqual(reader.read_nowait(1000), make_audio(1000, seed=1))
+
+    def test_from_oldest(self):
+        audio = make_audio(self.capacity + 1000)
+        self.writer.add_data(audio)
+        with audiobus.AudioBusReader(self.path, from_oldest=True) as reader:
+            self.assertEqual(reader.read_nowait(len(audio)), audio[1000:])
+
+    def test_reads_whole_frames(self):
+        self.writer.add_data(make_audio(1000))
+        with audiobus.AudioBusReader(self.path, from_oldest=True) as reader:
+            self.assertEqual(len(reader.read_nowait(999)), 998)
+
+    def test_overrun_skips_to_oldest_audio(self):
+        with audiobus.AudioBusReader(self.path) as reader:
+            audio = make_audio(self.capacity + 2000)
+            self.writer.add_data(audio)
+            with self.assertRaises(audiobus.Overrun) as raised:
+                reader.read_nowait(100)
+            self.assertEqual(raised.exception.missing_bytes, 2000)
+            self.assertEqual(reader.overruns, 1)
+            self.assertEqual(reader.read_nowait(100), audio[2000:2100])
+
+    def test_blocking_read_waits_for_writer(self):
+        audio = make_audio(3200)
+
+        def write():
+            for start in range(0, len(audio), 320):
+                time.sleep(0.005)
+                self.writer.add_data(audio[start:start + 320])
+
+        with audiobus.AudioBusReader(self.path) as reader:
+            thread = threading.Thread(target=write)
+            thread.start()
+            self.assertEqual(reader.read(len(audio), timeout=5), audio)
+            thread.join()
+
+    def test_blocking_read_timeout(self):
+        with audiobus.AudioBusReader(self.path) as reader:
+            self.writer.add_data(make_audio(100))
+            start = time.monotonic()
+            self.assertEqual(reader.read(1000, timeout=0.05), make_audio(100))
+            self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+    def test_record_to_wave(self):
+        # Audio published before recording starts is left out.
+        self.writer.add_data(make_audio(1000, seed=1))
+        audio = make_audio(3200)
+
+        def write():
+            time.sleep(0.05)
+            self.writer.add_data(audio)
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        wav_path = os.path.join(self.temp_dir.name, 'recording.wav')
+        with audiobus.AudioBusReader(self.path, from_oldest=True) as reader:
+            reader.record_to_wave(wav_path, 0.1)
+        thread.join()
+
+        with wave.open(wav_path, 'rb') as wav:
+            self.assertEqual(wav.getframerate(), 16000)
+            self.assertEqual(wav.readframes(1600), audio)
+
+    def test_close_ends_stream(self):
+        reader = audiobus.AudioBusReader(self.path)
+        self.writer.add_data(make_audio(100))
+        self.writer.close()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(reader.read(1000), make_audio(100))
+        self.assertEqual(reader.read(1000), b'')
+        reader.close()
+
+    def test_rejects_other_files(self):
+        other = os.path.join(self.temp_dir.name, 'other')
+        with open(other, 'wb') as f:
+            f.write(b'\0' * 100)
+        with self.assertRaises(audiobus.Error):
+            audiobus.AudioBusReader(other)
+
+    def test_reader_in_other_process(self):
+        audio = make_audio(6400)
+        script = (
+            'import sys\n'
+            'import aiy._drivers._audiobus as audiobus\n'
+            'with audiobus.AudioBusReader(sys.argv[1]) as reader:\n'
+            '    print("ready", flush=True)\n'
+            '    sys.stdout.buffer.write(reader.read(%d, timeout=10))\n' % len(audio))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        process = subprocess.Popen([sys.executable, '-c', script, self.path],
+                                   stdout=subprocess.PIPE, env=env)
+        self.assertEqual(process.stdout.readline(), b'ready\n')
+        for start in range(0, len(audio), 640):
+            self.writer.add_data(audio[start:start + 640])
+        self.assertEqual(process.stdout.read(), audio)
+        self.assertEqual(process.wait(), 0)
+
+
+class TestRecorderBus(unittest.TestCase):
+
+    def test_recorder_publishes_audio(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'bus')
+            chunk_bytes = 3200
+            audio = make_audio(chunk_bytes * 5)
+            chunks = [audio[i:i + chunk_bytes] for i in range(0, len(audio), chunk_bytes)]
+            opened = threading.Event()
+            released = threading.Event()
+
+            def source():
+                # Hold the first chunk back until the reader is attached.
+                opened.set()
+                released.wait(5)
+                for chunk in chunks:
+                    yield chunk
+
+            backend = aiy._drivers._capture.FileBackend(source())
+            recorder = aiy._drivers._recorder.Recorder(backend=backend, bus_path=path)
+            with mock.patch('os._exit'), recorder:
+                self.assertTrue(opened.wait(5))
+                with audiobus.AudioBusReader(path) as reader:
+                    released.set()
+                    self.assertEqual(reader.read(len(audio), timeout=5), audio)
+                recorder.join(5)
+            self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Test background logging of request and response audio.'''
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import wave
+from unittest import mock
+
+import aiy._apis._audiolog as audiolog
+
+CHUNK = b'\1\0' * 1600  # 100 ms
+
+
+class TestAudioLog(unittest.TestCase):
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.log_dir)
+
+    def make_log(self, **kwargs):
+        log = audiolog.AudioLog(self.log_dir, **kwargs)
+        log.start()
+        self.addCleanup(log.join)
+        self.addCleanup(log.stop)
+        return log
+
+    def log_request(self, log, request_chunks=10, response=b'', **metadata):
+        entry = log.start_entry()
+        for _ in range(request_chunks):
+            entry.add_request_audio(CHUNK)
+        if response:
+            entry.add_response_audio(response)
+        return entry.finish(**metadata)
+
+    def wait_for_writes(self, log, count):
+        deadline = time.monotonic() + 5
+        while log.stats.written + log.stats.failed < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_writes_audio_and_sidecar(self):
+        log = self.make_log()
+        self.log_request(log, response=CHUNK * 2, transcript='hello', outcome='ok')
+        self.wait_for_writes(log, 1)
+
+        names = sorted(os.listdir(self.log_dir))
+        self.assertEqual([name.split('.', 1)[1] for name in names],
+                         ['json', 'request.wav', 'response.wav'])
+        with open(os.path.join(self.log_dir, names[0])) as f:
+            metadata = json.load(f)
+        self.assertEqual(metadata['transcript'], 'hello')
+        self.assertEqual(metadata['files'], {'request': names[1], 'response': names[2]})
+        with wave.open(os.path.join(self.log_dir, names[1])) as wav:
+            self.assertEqual(wav.readframes(16000), CHUNK * 10)
+
+    def test_compressed(self):
+        log = self.make_log(compress=True)
+        self.log_request(log)
+        self.wait_for_writes(log, 1)
+
+        request, = [name for name in os.listdir(self.log_dir) if 'request' in name]
+        self.assertTrue(request.endswith('.request.flac'))
+        with open(os.path.join(self.log_dir, request), 'rb') as f:
+            self.assertEqual(f.read(4), b'fLaC')
+
+    def test_rotates_by_size(self):
+        # Each entry is about 32 KB.
+        log = self.make_log(max_bytes=100 * 1000)
+        for _ in range(6):
+            self.log_request(log)
+            self.wait_for_writes(log, log.stats.written + 1)
+            time.sleep(0.002)
+
+        self.assertEqual(log.stats.written, 6)
+        self.assertEqual(log.stats.removed, 3)
+        names = sorted({name.split('.')[0] for name in os.listdir(self.log_dir)})
+        self.assertEqual(len(names), 3)
+
+    def test_rotates_by_age(self):
+        old = os.path.join(self.log_dir, '20170101-000000-000.json')
+        with open(old, 'w') as f:
+            f.write('{}')
+        os.utime(old, (0, 0))
+
+        log = self.make_log(max_age_s=3600)
+        self.log_request(log)
+        self.wait_for_writes(log, 1)
+        self.assertFalse(os.path.exists(old))
+        self.assertEqual(log.stats.removed, 1)
+
+    def test_drops_entries_when_disk_is_slow(self):
+        log = self.make_log(max_queued=2)
+        written = threading.Event()
+
+        def slow_write(entry):
+            written.wait()
+
+        with mock.patch.object(log, '_write', slow_write):
+            results = [self.log_request(log, request_chunks=1) for _ in range(5)]
+            written.set()
+
+        # One is being written, two are queued and the rest are dropped.
+        self.assertEqual(log.stats.dropped, sum(1 for ok in results if not ok))
+        self.assertGreaterEqual(log.stats.dropped, 2)
+        self.assertFalse(results[-1])
+
+    def test_write_errors_are_counted(self):
+        log = self.make_log()
+        shutil.rmtree(self.log_dir)
+        with self.assertLogs('speech', 'ERROR'):
+            self.log_request(log)
+            self.wait_for_writes(log, 1)
+        os.makedirs(self.log_dir)
+        self.assertEqual(log.stats.failed, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
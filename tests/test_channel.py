@@ -0,0 +1,185 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Test persistent gRPC channels against a local server.'''
+
+from concurrent import futures
+import time
+import unittest
+from unittest import mock
+
+import grpc
+
+import aiy._apis._channel
+
+METHOD = '/test.Echo/Stream'
+
+
+def echo(request_iterator, context):
+    for request in request_iterator:
+        yield request
+
+
+class EchoServer(object):
+
+    """A local stand-in for the speech APIs that streams requests back."""
+
+    def __init__(self, port=0):
+        self._server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+        handler = grpc.method_handlers_generic_handler('test.Echo', {
+            'Stream': grpc.stream_stream_rpc_method_handler(echo),
+        })
+        self._server.add_generic_rpc_handlers((handler,))
+        self.port = self._server.add_insecure_port('localhost:%d' % port)
+        self._server.start()
+
+    def stop(self):
+        self._server.stop(None).wait()
+
+
+class TestPersistentChannel(unittest.TestCase):
+
+    def setUp(self):
+        self.server = EchoServer()
+        self.made = []
+        self.channel = aiy._apis._channel.PersistentChannel(self.make_channel)
+        self.channel.RECONNECT_DELAY_S = 0.01
+        self.channel.INITIAL_RECONNECT_BACKOFF_MS = 100
+
+    def tearDown(self):
+        self.channel.close()
+        self.server.stop()
+
+    def make_channel(self, options):
+        self.made.append(dict(options))
+        return grpc.insecure_channel('localhost:%d' % self.server.port, options)
+
+    def stream(self, messages):
+        timer = aiy._apis._channel.RequestTimer()
+        self.assertTrue(self.channel.wait_ready(5))
+        timer.channel_ready()
+        call = self.channel.get().stream_stream(METHOD)
+        responses = list(timer.responses(call(timer.requests(iter(messages)), timeout=5)))
+        timer.finish()
+        return responses, timer
+
+    def test_connects_in_background(self):
+        self.channel.connect()
+        deadline = time.monotonic() + 5
+        while self.channel.connects == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.channel.connects, 1)
+
+    def test_keepalive_options(self):
+        self.channel.get()
+        self.assertEqual(self.made[0]['grpc.keepalive_time_ms'], self.channel.KEEPALIVE_MS)
+        self.assertEqual(self.made[0]['grpc.keepalive_permit_without_calls'], 1)
+        # Idle connections to Google's servers allow one ping in 5 minutes.
+        self.assertGreaterEqual(self.made[0]['grpc.keepalive_time_ms'], 300000)
+
+    def test_channel_is_reused(self):
+        for _ in range(3):
+            responses, _ = self.stream([b'a', b'b'])
+            self.assertEqual(responses, [b'a', b'b'])
+        self.assertEqual(len(self.made), 1)
+        self.assertEqual(self.channel.connects, 1)
+
+    def test_warm_channel_timing(self):
+        self.channel.connect()
+        self.assertTrue(self.channel.wait_ready(5))
+        _, timer = self.stream([b'hello'])
+
+        # No connection setup on the critical path.
+        self.assertLess(timer.channel_ready_s, 0.01)
+        self.assertLessEqual(timer.channel_ready_s, timer.first_request_s)
+        self.assertLessEqual(timer.first_request_s, timer.first_response_s)
+        self.assertLessEqual(timer.first_response_s, timer.total_s)
+
+    def test_reconnects_after_server_restart(self):
+        self.stream([b'a'])
+        port = self.server.port
+        self.server.stop()
+        self.server = EchoServer(port)
+
+        # The channel reconnects without waiting for a request.
+        deadline = time.monotonic() + 10
+        while self.channel.connects < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.channel.connects, 2)
+        self.assertEqual(self.stream([b'b'])[0], [b'b'])
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    @mock.patch('grpc.channel_ready_future')
+    def test_close_during_reconnect_delay(self, ready_future):
+        self.channel.RECONNECT_DELAY_S = 0.2
+        self.stream([b'a'])
+        self.server.stop()
+        self.wait_for(lambda: self.channel.state != grpc.ChannelConnectivity.READY)
+        self.channel.close()
+        time.sleep(0.3)
+
+        # The closed channel isn't watched.
+        ready_future.assert_not_called()
+
+    def test_ready_future_is_cancelled(self):
+        self.stream([b'a'])
+        ready_futures = []
+        with mock.patch('grpc.channel_ready_future',
+                        lambda channel: ready_futures.append(mock.Mock()) or ready_futures[-1]):
+            for count in (1, 2):
+                self.channel._idle.set()
+                self.wait_for(lambda: len(ready_futures) == count)
+            self.channel.close()
+
+        self.assertEqual(len(ready_futures), 2)
+        # Each watch is cancelled by the next reconnect or by close().
+        for ready_future in ready_futures:
+            ready_future.cancel.assert_called_once_with()
+
+    def test_failed_creation_is_retried(self):
+        calls = []
+
+        def make_channel(options):
+            calls.append(options)
+            if len(calls) == 1:
+                raise OSError('no network yet')
+            return self.make_channel(options)
+
+        self.channel = aiy._apis._channel.PersistentChannel(make_channel)
+        with self.assertRaises(OSError):
+            self.channel.get()
+        self.assertTrue(self.channel.wait_ready(5))
+
+
+class TestRequestTimer(unittest.TestCase):
+
+    def test_repr_before_responses(self):
+        timer = aiy._apis._channel.RequestTimer()
+        timer.channel_ready()
+        self.assertIn('first_response=n/a', repr(timer))
+
+    def test_first_audio_is_kept(self):
+        timer = aiy._apis._channel.RequestTimer()
+        timer.first_audio()
+        first_audio_s = timer.first_audio_s
+        timer.first_audio()
+        self.assertEqual(timer.first_audio_s, first_audio_s)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Test background token refresh against a local token endpoint.'''
+
+import datetime
+import http.server
+import json
+import threading
+import time
+import unittest
+
+import google.auth.transport.requests
+import google.oauth2.credentials
+
+import aiy._apis._credentials
+
+
+class FakeTokenEndpoint(object):
+
+    """A local OAuth2 token endpoint that hands out numbered tokens."""
+
+    def __init__(self, expires_in=3600):
+        self.expires_in = expires_in
+        self.failures = 0
+        self.requests = 0
+        endpoint = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                self.rfile.read(int(self.headers['Content-Length']))
+                endpoint.requests += 1
+                if endpoint.failures:
+                    endpoint.failures -= 1
+                    # google.auth retries transient errors itself, so fail
+                    # with an error it gives up on, to count each attempt.
+                    self.send_response(400)
+                    body = b'{"error": "invalid_request"}'
+                else:
+                    self.send_response(200)
+                    body = json.dumps({
+                        'access_token': 'token-%d' % endpoint.requests,
+                        'expires_in': endpoint.expires_in,
+                    }).encode('utf-8')
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = http.server.HTTPServer(('localhost', 0), Handler)
+        self.url = 'http://localhost:%d/token' % self._server.server_port
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class TestTokenRefresher(unittest.TestCase):
+
+    def setUp(self):
+        self.endpoint = FakeTokenEndpoint()
+        self.credentials = google.oauth2.credentials.Credentials(
+            token=None, refresh_token='refresh', token_uri=self.endpoint.url,
+            client_id='client', client_secret='secret')
+        self.refresher = aiy._apis._credentials.TokenRefresher(self.credentials)
+        self.refresher.JITTER_S = 0
+        self.refresher.RETRY_DELAY_S = 0.01
+
+    def tearDown(self):
+        self.refresher.stop()
+        if self.refresher.ident:
+            self.refresher.join(5)
+        self.endpoint.stop()
+
+    def wait_for_refreshes(self, count):
+        deadline = time.monotonic() + 5
+        while self.refresher.stats.refreshes < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.refresher.stats.refreshes, count)
+
+    def test_refreshes_missing_token_at_start(self):
+        self.refresher.start()
+        self.wait_for_refreshes(1)
+        self.assertEqual(self.credentials.token, 'token-1')
+        self.assertGreater(self.refresher.stats.max_s, 0)
+
+    def test_requests_use_refreshed_token(self):
+        self.refresher.start()
+        self.wait_for_refreshes(1)
+
+        headers = {}
+        self.credentials.before_request(
+            google.auth.transport.requests.Request(), 'POST', 'https://example.com', headers)
+        self.assertEqual(headers['authorization'], 'Bearer token-1')
+        self.assertEqual(self.endpoint.requests, 1)
+
+    def test_refreshes_before_expiry(self):
+        self.endpoint.expires_in = self.refresher.REFRESH_MARGIN_S + 0.2
+        self.refresher.start()
+        self.wait_for_refreshes(3)
+        self.assertEqual(self.credentials.token, 'token-3')
+
+    def test_retries_with_backoff(self):
+        self.endpoint.failures = 3
+        self.refresher.start()
+        self.wait_for_refreshes(1)
+
+        self.assertEqual(self.refresher.stats.failures, 3)
+        self.assertEqual(self.credentials.token, 'token-4')
+        self.assertEqual([self.refresher._get_retry_delay(n) for n in (1, 2, 3)],
+                         [0.01, 0.02, 0.04])
+
+    def test_jitter_refreshes_early(self):
+        self.credentials.token = 'token'
+        self.credentials.expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=1000)
+        self.refresher.JITTER_S = 60
+        delays = [self.refresher._get_refresh_delay() for _ in range(20)]
+        for delay in delays:
+            self.assertLessEqual(delay, 1000 - 300)
+            self.assertGreaterEqual(delay, 1000 - 300 - 61)
+        self.assertGreater(len(set(delays)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
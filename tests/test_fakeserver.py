@@ -0,0 +1,396 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Test the speech requests against the local stand-in servers.'''
+
+import threading
+import time
+import unittest
+
+import grpc
+
+try:
+    import fakeserver
+    import aiy._apis._speech as speech
+except (ImportError, AttributeError):
+    # The generated protobuf modules don't import with newer protobuf
+    # runtimes.
+    fakeserver = None
+
+CHUNK = b'\x01\x00' * 1600  # 100 ms of audio
+
+
+def feed(request, chunks, interval_s=0.0, chunk=CHUNK):
+    """Sends audio from another thread, like the recorder."""
+    def run():
+        for _ in range(chunks):
+            request.add_data(chunk)
+            time.sleep(interval_s)
+        request.end_audio()
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def response(*results):
+    """Returns a StreamingRecognizeResponse with a result for each
+    (transcript, stability) pair. A stability of None makes a final result.
+    """
+    cloud_speech = speech.cloud_speech
+    return cloud_speech.StreamingRecognizeResponse(results=[
+        cloud_speech.StreamingRecognitionResult(
+            alternatives=[cloud_speech.SpeechRecognitionAlternative(transcript=transcript)],
+            is_final=stability is None, stability=stability or 0.0)
+        for transcript, stability in results])
+
+
+@unittest.skipIf(fakeserver is None, 'speech APIs unavailable')
+class TestFakeSpeechServer(unittest.TestCase):
+
+    def start_server(self, *scripts):
+        server = fakeserver.FakeSpeechServer(scripts).start()
+        self.addCleanup(server.stop)
+        request = speech.CloudSpeechRequest(
+            None, fakeserver.fake_credentials(), server.channel_factory())
+        self.addCleanup(request._channel.close)
+        request.set_audio_encoding('LINEAR16')
+        request.reset()
+        return server, request
+
+    def test_transcript_and_recorded_audio(self):
+        server, request = self.start_server(fakeserver.Script('turn on the light'))
+        feed(request, 3).join()
+
+        self.assertEqual(request.do_request().transcript, 'turn on the light')
+        call, = server.calls
+        self.assertEqual(call.config.config.encoding, call.config.config.LINEAR16)
+        self.assertEqual(call.audio, CHUNK * 3)
+
+    def test_endpoint_ends_the_audio(self):
+        server, request = self.start_server(
+            fakeserver.Script('hello', endpoint_after_s=0.1))
+        ends = []
+        request.set_endpointer_cb(lambda: ends.append(True))
+        thread = feed(request, 50, interval_s=0.02)
+
+        self.assertEqual(request.do_request().transcript, 'hello')
+        self.assertEqual(ends, [True])
+        self.assertLess(len(server.calls[0].audio), len(CHUNK) * 50)
+        thread.join()
+
+    def test_early_action_on_interim_result(self):
+        _, request = self.start_server(fakeserver.Script(
+            'turn on the light please', interim=[(0.05, 'turn on the light', 0.9)]))
+        handled = []
+        request.set_early_action_cb(lambda t: 'light' in t, handled.append)
+        request.reset()
+        thread = feed(request, 50, interval_s=0.02)
+
+        request.do_request()
+        self.assertEqual(handled, ['turn on the light'])
+        self.assertEqual(request.early_transcript, 'turn on the light')
+        thread.join()
+
+    def test_latency(self):
+        _, request = self.start_server(fakeserver.Script('hello', latency_s=0.2))
+        feed(request, 1).join()
+        start = time.monotonic()
+        request.do_request()
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    def test_scripts_in_order(self):
+        _, request = self.start_server(
+            fakeserver.Script(error=grpc.StatusCode.UNAVAILABLE),
+            fakeserver.Script('second'))
+        feed(request, 1).join()
+        with self.assertRaises(speech.Error) as cm:
+            request.do_request()
+        self.assertEqual(cm.exception.__cause__.code(), grpc.StatusCode.UNAVAILABLE)
+
+        for _ in range(2):
+            request.reset()
+            feed(request, 1).join()
+            self.assertEqual(request.do_request().transcript, 'second')
+
+    def test_config_request_is_cached(self):
+        server, request = self.start_server(fakeserver.Script('hello'))
+        request.add_phrase('light on')
+        request.add_phrase('Light on')
+
+        configs = []
+        for phrase in ('light on', 'light off'):
+            request.add_phrase(phrase)
+            for _ in range(2):
+                request.reset()
+                feed(request, 1).join()
+                request.do_request()
+                configs.append(request._start_request_stream())
+
+        self.assertIs(configs[0], configs[1])
+        self.assertIsNot(configs[1], configs[2])
+        self.assertIs(configs[2], configs[3])
+        self.assertEqual(server.calls[-1].config.config.speech_context.phrases,
+                         ['light on', 'light off'])
+
+    def test_cancel_while_waiting_for_result(self):
+        _, request = self.start_server(fakeserver.Script('hello', latency_s=5))
+        feed(request, 1).join()
+        threading.Timer(0.2, request.cancel).start()
+
+        start = time.monotonic()
+        self.assertEqual(request.do_request(), (None, None))
+        self.assertLess(time.monotonic() - start, 2)
+
+    def test_cancel_while_streaming_drops_queued_audio(self):
+        server, request = self.start_server(fakeserver.Script('hello'))
+        for _ in range(100):
+            request.add_data(CHUNK)
+        request.cancel()
+
+        self.assertEqual(request.do_request(), (None, None))
+        # Only the end of the audio is left.
+        self.assertEqual(request._audio_queue.qsize(), 1)
+        self.assertEqual(server.calls, [])
+
+    def test_deadline(self):
+        _, request = self.start_server(fakeserver.Script('hello', latency_s=5))
+        request.set_deadline(0.3)
+        feed(request, 1).join()
+
+        with self.assertRaises(speech.Error) as cm:
+            request.do_request()
+        self.assertIn('deadline', str(cm.exception))
+        self.assertEqual(cm.exception.__cause__.code(), grpc.StatusCode.DEADLINE_EXCEEDED)
+
+
+@unittest.skipIf(fakeserver is None, 'speech APIs unavailable')
+class TestFakeAssistantServer(unittest.TestCase):
+
+    def start_server(self, *scripts):
+        server = fakeserver.FakeAssistantServer(scripts).start()
+        self.addCleanup(server.stop)
+        request = speech.AssistantSpeechRequest(
+            fakeserver.fake_credentials(), server.channel_factory())
+        self.addCleanup(request._channel.close)
+        request.reset()
+        return server, request
+
+    def test_response_audio(self):
+        _, request = self.start_server(fakeserver.Script(
+            'what time is it', response_audio=b'r' * 10000, chunk_bytes=4000))
+        streamed = []
+        request.set_response_stream_cb(lambda t: streamed.append(t) or None)
+        feed(request, 2).join()
+
+        result = request.do_request()
+        self.assertEqual(result, ('what time is it', b'r' * 10000))
+        self.assertEqual(streamed, ['what time is it'])
+        self.assertFalse(request.dialog_follow_on)
+
+    def test_end_of_utterance_and_follow_on(self):
+        server, request = self.start_server(fakeserver.Script(
+            'set a timer', endpoint_after_s=0.1, dialog_follow_on=True))
+        thread = feed(request, 50, interval_s=0.02)
+
+        self.assertEqual(request.do_request().transcript, 'set a timer')
+        self.assertTrue(request.dialog_follow_on)
+        self.assertLess(len(server.calls[0].audio), len(CHUNK) * 50)
+        thread.join()
+
+
+@unittest.skipIf(fakeserver is None, 'speech APIs unavailable')
+class TestSessions(unittest.TestCase):
+
+    def make_request(self, server_class, *scripts):
+        server = server_class(scripts).start()
+        self.addCleanup(server.stop)
+        if server_class is fakeserver.FakeSpeechServer:
+            request = speech.CloudSpeechRequest(
+                None, fakeserver.fake_credentials(), server.channel_factory())
+        else:
+            request = speech.AssistantSpeechRequest(
+                fakeserver.fake_credentials(), server.channel_factory())
+        self.addCleanup(request._channel.close)
+        request.set_audio_encoding('LINEAR16')
+        return server, request
+
+    def wait_for_calls(self, server, count):
+        deadline = time.monotonic() + 5
+        while len(server.calls) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_sessions_overlap(self):
+        server, request = self.make_request(
+            fakeserver.FakeSpeechServer,
+            fakeserver.Script('first', latency_s=0.5), fakeserver.Script('second'))
+        finished = []
+
+        first = request.new_session()
+        feed(first, 2, chunk=b'\x01\x00' * 1600).join()
+        thread = threading.Thread(
+            target=lambda: finished.append(first.do_request().transcript))
+        thread.start()
+        # The first session's audio has reached the server, and its result
+        # is still on the way.
+        self.wait_for_calls(server, 1)
+
+        second = request.new_session()
+        feed(second, 3, chunk=b'\x02\x00' * 1600).join()
+        finished.append(second.do_request().transcript)
+        thread.join()
+
+        self.assertEqual(finished, ['second', 'first'])
+        self.assertEqual([call.audio for call in server.calls],
+                         [b'\x01\x00' * 3200, b'\x02\x00' * 4800])
+
+    def test_sessions_share_settings(self):
+        server, request = self.make_request(
+            fakeserver.FakeSpeechServer, fakeserver.Script('hello'))
+        session = request.new_session()
+        request.add_phrase('light on')
+        ends = []
+        session.set_endpointer_cb(lambda: ends.append(True))
+
+        feed(session, 1).join()
+        session.do_request()
+        self.assertEqual(server.calls[0].config.config.speech_context.phrases, ['light on'])
+        self.assertIs(session.get_endpoint_stats(), request.get_endpoint_stats())
+        # Callbacks set on a session are its own.
+        self.assertIsNone(request._endpointer_cb)
+
+    def test_conversation_continues_across_sessions(self):
+        server, request = self.make_request(
+            fakeserver.FakeAssistantServer, fakeserver.Script('hello'))
+        for _ in range(2):
+            session = request.new_session()
+            feed(session, 1).join()
+            session.do_request()
+
+        states = [call.config.converse_state.conversation_state for call in server.calls]
+        self.assertEqual(states, [b'', b'fake-state'])
+
+
+class FakeRecorder(object):
+
+    def __init__(self):
+        self.processors = []
+
+    def add_processor(self, processor, preroll=False):
+        self.processors.append(processor)
+
+    def remove_processor(self, processor):
+        self.processors.remove(processor)
+
+
+@unittest.skipIf(fakeserver is None, 'speech APIs unavailable')
+class TestRecordingSession(unittest.TestCase):
+
+    def setUp(self):
+        self.server = fakeserver.FakeSpeechServer(
+            [fakeserver.Script('hello', latency_s=5)]).start()
+        self.addCleanup(self.server.stop)
+        self.request = speech.CloudSpeechRequest(
+            None, fakeserver.fake_credentials(), self.server.channel_factory())
+        self.addCleanup(self.request._channel.close)
+        self.recorder = FakeRecorder()
+
+    def test_cancel_stops_recording(self):
+        recording = speech.RecordingSession(self.request, self.recorder)
+        self.assertEqual(self.recorder.processors, [recording.session])
+        recording.session.add_data(CHUNK)
+        threading.Timer(0.2, recording.cancel).start()
+
+        start = time.monotonic()
+        self.assertEqual(recording.session.do_request(), (None, None))
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(self.recorder.processors, [])
+        # Stopping again after the request is harmless.
+        recording.stop_recording()
+
+    def test_cancel_leaves_the_next_session_alone(self):
+        first = speech.RecordingSession(self.request, self.recorder)
+        first.cancel()
+        self.server.set_scripts([fakeserver.Script('second')])
+        second = speech.RecordingSession(self.request, self.recorder)
+        feed(second.session, 1).join()
+
+        self.assertEqual(first.session.do_request(), (None, None))
+        self.assertEqual(second.session.do_request().transcript, 'second')
+        self.assertEqual(self.recorder.processors, [second.session])
+
+
+@unittest.skipIf(fakeserver is None, 'speech APIs unavailable')
+class TestEarlyAction(unittest.TestCase):
+
+    """Feeds responses straight to a request, to test which interim results
+    run commands.
+    """
+
+    def setUp(self):
+        # The server only gives the request's channel somewhere to connect.
+        server = fakeserver.FakeSpeechServer().start()
+        self.addCleanup(server.stop)
+        self.request = speech.CloudSpeechRequest(
+            None, fakeserver.fake_credentials(), server.channel_factory())
+        self.addCleanup(self.request._channel.close)
+        self.handled = []
+        self.request.set_early_action_cb(
+            lambda t: t == 'turn on the light', self.handled.append, min_stability=0.8)
+        self.ends = []
+        self.request.set_endpointer_cb(lambda: self.ends.append(True))
+        self.request.reset()
+
+    def test_stable_prefix(self):
+        # 'off' isn't stable yet, so it isn't part of the command.
+        self.request._handle_response(response(
+            ('turn on', None), ('the light', 0.9), ('off', 0.1)))
+
+        self.assertEqual(self.handled, ['turn on the light'])
+        self.assertEqual(self.request.early_transcript, 'turn on the light')
+        self.assertEqual(self.ends, [True])
+
+    def test_waits_for_stability(self):
+        self.request._handle_response(response(('turn on the light', 0.5)))
+        self.assertEqual(self.handled, [])
+        self.assertIsNone(self.request.early_transcript)
+
+        self.request._handle_response(response(('turn on the light', 0.9)))
+        self.assertEqual(self.handled, ['turn on the light'])
+
+    def test_prefix_stops_at_unstable_result(self):
+        # The stable result comes after an unstable one, so it isn't a prefix.
+        self.request._handle_response(response(('please', 0.1), ('turn on the light', 0.9)))
+
+        self.assertEqual(self.handled, [])
+        self.assertEqual(self.ends, [])
+
+    def test_final_result_is_not_handled_again(self):
+        self.request._handle_response(response(('turn on the light', 0.9)))
+        self.request._handle_response(response(('turn on the light', None)))
+
+        self.assertEqual(self.handled, ['turn on the light'])
+        self.assertEqual(self.ends, [True])
+        self.assertEqual(self.request._finish_request().transcript, 'turn on the light')
+
+    def test_handled_again_next_turn(self):
+        self.request._handle_response(response(('turn on the light', 0.9)))
+        self.request.reset()
+        self.assertIsNone(self.request.early_transcript)
+
+        self.request._handle_response(response(('turn on the light', 0.9)))
+        self.assertEqual(self.handled, ['turn on the light'] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Test the streaming FLAC encoder.'''
+
+import io
+import os
+import struct
+import unittest
+
+import numpy as np
+
+import aiy._apis._flac as flac
+
+try:
+    import soundfile
+except (ImportError, OSError):
+    soundfile = None
+
+HELLO_PATH = os.path.realpath(os.path.join(__file__, '..', '..', 'checkpoints', 'test_hello.raw'))
+
+
+def encode(data, chunk=3200, **kwargs):
+    encoder = flac.FlacEncoder(**kwargs)
+    return b''.join(encoder.encode(data[i:i + chunk])
+                    for i in range(0, len(data), chunk)) + encoder.flush()
+
+
+def decode(stream, samples):
+    """Decodes with libsndfile. The encoder doesn't know the length of the
+    stream when it sends the header, so fill it in first.
+    """
+    info, = struct.unpack('>Q', stream[18:26])
+    stream = stream[:18] + struct.pack('>Q', info | samples) + stream[26:]
+    data, rate = soundfile.read(io.BytesIO(stream), dtype='int16')
+    return data.tobytes(), rate
+
+
+def noise(samples, amplitude=1000, seed=0):
+    random = np.random.RandomState(seed)
+    return random.randint(-amplitude, amplitude, samples).astype('<i2').tobytes()
+
+
+class TestFlacEncoder(unittest.TestCase):
+
+    def test_stream_header(self):
+        stream = flac.FlacEncoder(16000).encode(b'')
+        self.assertEqual(stream[:4], b'fLaC')
+        self.assertEqual(len(stream), 4 + 4 + 34)
+        info, = struct.unpack('>Q', stream[18:26])
+        self.assertEqual(info >> 44, 16000)
+
+    def test_chunking_does_not_change_stream(self):
+        data = noise(16000)
+        self.assertEqual(encode(data, chunk=3200), encode(data, chunk=777))
+
+    def test_frames_are_sent_when_complete(self):
+        encoder = flac.FlacEncoder(16000)
+        header = encoder.encode(b'')
+        self.assertEqual(encoder.encode(noise(1000)), b'')
+        self.assertNotEqual(encoder.encode(noise(600)), b'')
+        self.assertEqual(encoder.flush(), b'')
+        self.assertTrue(header)
+
+    def test_compresses_speech(self):
+        with open(HELLO_PATH, 'rb') as f:
+            data = f.read()
+        self.assertLess(len(encode(data)), 0.65 * len(data))
+
+    def test_silence_is_tiny(self):
+        stream = encode(b'\0' * 32000)
+        self.assertLess(len(stream), 200)
+
+    def test_checksums(self):
+        self.assertEqual(flac._crc8(b'123456789'), 0xf4)
+        self.assertEqual(flac._crc16(b'123456789'), 0xfee8)
+
+    def test_frame_numbers(self):
+        self.assertEqual(flac._utf8_number(0x7f), b'\x7f')
+        self.assertEqual(flac._utf8_number(0x80), b'\xc2\x80')
+        self.assertEqual(flac._utf8_number(0x800), b'\xe0\xa0\x80')
+
+    def test_invalid_block_size(self):
+        with self.assertRaises(ValueError):
+            flac.FlacEncoder(16000, block_size=8)
+
+
+@unittest.skipUnless(soundfile, 'needs soundfile to decode FLAC')
+class TestFlacDecoding(unittest.TestCase):
+
+    def assertLossless(self, data, rate=16000, channels=1, **kwargs):
+        stream = encode(data, sample_rate_hz=rate, channels=channels, **kwargs)
+        decoded, decoded_rate = decode(stream, len(data) // 2 // channels)
+        self.assertEqual(decoded_rate, rate)
+        self.assertEqual(decoded, data)
+
+    def test_speech(self):
+        with open(HELLO_PATH, 'rb') as f:
+            self.assertLossless(f.read())
+
+    def test_full_scale_noise(self):
+        # Incompressible, so coded verbatim.
+        self.assertLossless(noise(16001, amplitude=32767))
+
+    def test_silence(self):
+        self.assertLossless(b'\0' * 5000)
+
+    def test_stereo(self):
+        self.assertLossless(noise(2 * 4410), rate=44100, channels=2, chunk=1000)
+
+    def test_uncommon_rate_and_block_size(self):
+        self.assertLossless(noise(3000), rate=11025, chunk=777, block_size=256)
+
+    def test_many_frames(self):
+        # Frame numbers over 127 take more than one byte.
+        self.assertLossless(noise(16000 * 30, amplitude=100), chunk=32000)
+
+    def test_file_has_length(self):
+        data = noise(5000)
+        stream = flac.encode_file(data)
+        info, = struct.unpack('>Q', stream[18:26])
+        self.assertEqual(info & (1 << 36) - 1, 5000)
+        decoded, _ = soundfile.read(io.BytesIO(stream), dtype='int16')
+        self.assertEqual(decoded.tobytes(), data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,245 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Test racing Cloud Speech against the Assistant with stand-in requests.'''
+
+import collections
+import threading
+import time
+import unittest
+
+import aiy._apis._hedge as hedge
+
+Result = collections.namedtuple('Result', ['transcript', 'response_audio'])
+
+
+class FakeRequest(object):
+
+    """Answers with result, latency_s after the audio ends."""
+
+    def __init__(self, result, latency_s=0.0, error=None):
+        self.result = result
+        self.latency_s = latency_s
+        self.error = error
+        self.dialog_follow_on = False
+        self.last_timing = None
+        self.data = []
+        self.cancelled = False
+        self.endpointer_cb = None
+        self.response_stream_cb = None
+        self.response_stream = None
+        self.early_action_cbs = None
+        self.early_transcript = None
+        self.audio_log = None
+        self._ended = threading.Event()
+        self._done = threading.Event()
+
+    def set_endpointer_cb(self, cb):
+        self.endpointer_cb = cb
+
+    def set_response_stream_cb(self, cb):
+        self.response_stream_cb = cb
+
+    def set_audio_logging_enabled(self, audio_logging_enabled=True):
+        self.audio_log = object() if audio_logging_enabled else None
+
+    def set_audio_log(self, audio_log):
+        self.audio_log = audio_log
+
+    def get_audio_log(self):
+        return self.audio_log
+
+    def set_early_action_cb(self, can_handle_cb, handle_cb, min_stability=0.8):
+        self.early_action_cbs = (can_handle_cb, handle_cb)
+
+    def interim_result(self, transcript):
+        """Simulates a stable interim result, like CloudSpeechRequest."""
+        can_handle_cb, handle_cb = self.early_action_cbs
+        if can_handle_cb(transcript):
+            self.early_transcript = transcript
+            self.end_audio()
+            handle_cb(transcript)
+
+    def reset(self):
+        self.data = []
+        self.cancelled = False
+        self._ended.clear()
+        self._done.clear()
+
+    def add_data(self, data):
+        if data:
+            self.data.append(data)
+        else:
+            self._ended.set()
+
+    def end_audio(self):
+        self.add_data(None)
+
+    def endpoint(self):
+        """Simulates the server's endpointer."""
+        self.end_audio()
+        self.endpointer_cb()
+
+    def cancel(self):
+        self.cancelled = True
+        self.end_audio()
+        self._done.set()
+
+    def do_request(self):
+        self._ended.wait()
+        if self._done.wait(self.latency_s):
+            return Result(None, None)
+        if self.error:
+            raise self.error
+        if self.response_stream_cb and self.result.response_audio:
+            self.response_stream = self.response_stream_cb(self.result.transcript)
+        return self.result
+
+
+class TestHedgedRequest(unittest.TestCase):
+
+    def make_request(self, cloud_transcript, cloud_latency_s=0.0, assistant_latency_s=0.2,
+                     cloud_error=None, always_responds=False):
+        self.cloud = FakeRequest(Result(cloud_transcript, None), cloud_latency_s, cloud_error)
+        self.assistant = FakeRequest(Result('assistant heard', b'audio'), assistant_latency_s)
+        request = hedge.HedgedRequest(self.cloud, self.assistant)
+        request.set_can_handle_cb(lambda t: 'light' in t, always_responds)
+        self.streams = []
+        request.set_response_stream_cb(lambda t: self.streams.append(t) or 'stream')
+        self.ends = []
+        request.set_endpointer_cb(lambda: self.ends.append(time.monotonic()))
+        request.reset()
+        return request
+
+    def run_request(self, request, endpoint=None):
+        request.add_data(b'x')
+        (endpoint or self.cloud).endpoint()
+        start = time.monotonic()
+        result = request.do_request()
+        return result, time.monotonic() - start
+
+    def test_local_command_wins(self):
+        request = self.make_request('turn the light on', assistant_latency_s=5)
+        result, elapsed = self.run_request(request)
+
+        self.assertEqual(result, ('turn the light on', None))
+        self.assertLess(elapsed, 1)
+        self.assertTrue(self.assistant.cancelled)
+        self.assertFalse(request.dialog_follow_on)
+        self.assertEqual(request.get_hedge_stats().cloud_speech, 1)
+        request.reset()
+
+    def test_assistant_answers_other_requests(self):
+        request = self.make_request('what is the weather')
+        result, _ = self.run_request(request)
+
+        self.assertEqual(result, ('assistant heard', b'audio'))
+        self.assertFalse(self.assistant.cancelled)
+        self.assertEqual(self.streams, ['assistant heard'])
+        self.assertEqual(request.get_hedge_stats().assistant, 1)
+
+    def test_both_get_the_audio(self):
+        request = self.make_request('what is the weather')
+        self.run_request(request, endpoint=self.assistant)
+
+        self.assertEqual(self.cloud.data, [b'x'])
+        self.assertEqual(self.assistant.data, [b'x'])
+        # Either endpointer ends the audio of both, and calls back once.
+        self.assertTrue(self.cloud._ended.is_set())
+        self.assertEqual(len(self.ends), 1)
+
+    def test_response_waits_for_cloud_speech(self):
+        request = self.make_request('turn the light on', cloud_latency_s=0.2,
+                                    assistant_latency_s=0)
+        result, _ = self.run_request(request)
+
+        self.assertEqual(result.transcript, 'turn the light on')
+        self.assertEqual(self.streams, [])
+        request.reset()
+        self.assertIsNone(self.assistant.response_stream)
+
+    def test_cloud_speech_error_falls_back(self):
+        request = self.make_request(None, cloud_error=RuntimeError('no network'))
+        with self.assertLogs('speech', 'ERROR'):
+            result, _ = self.run_request(request)
+
+        self.assertEqual(result, ('assistant heard', b'audio'))
+        self.assertEqual(request.get_hedge_stats().cloud_speech_errors, 1)
+
+    def test_early_action_wins(self):
+        # The command ran from an interim result, though the final
+        # transcript no longer matches.
+        request = self.make_request('what is the weather', assistant_latency_s=5)
+        self.cloud.early_transcript = 'turn the light on'
+        _, elapsed = self.run_request(request)
+
+        self.assertLess(elapsed, 1)
+        self.assertTrue(self.assistant.cancelled)
+        request.reset()
+
+    def make_late_request(self):
+        """Returns a request whose Cloud Speech result comes after the
+        Assistant's response starts playing.
+        """
+        request = self.make_request('turn the light on', cloud_latency_s=0.6,
+                                    assistant_latency_s=0)
+        request.VERDICT_TIMEOUT_S = 0.1
+        self.handled = []
+        request.set_early_action_cb(lambda t: 'light' in t, self.handled.append)
+        return request
+
+    def test_early_action_before_verdict_timeout(self):
+        request = self.make_late_request()
+        self.cloud.interim_result('turn the light')
+        result, _ = self.run_request(request)
+
+        self.assertEqual(self.handled, ['turn the light'])
+        # The Assistant's response isn't played after the command ran.
+        self.assertEqual(self.streams, [])
+        self.assertEqual(result.transcript, 'turn the light on')
+        request.reset()
+
+    def test_late_verdict_is_ignored(self):
+        request = self.make_late_request()
+        threading.Timer(0.3, self.cloud.interim_result, ('turn the light',)).start()
+        result, _ = self.run_request(request)
+
+        # The Assistant's response started playing first, so the command
+        # doesn't run as well.
+        self.assertEqual(self.streams, ['assistant heard'])
+        self.assertEqual(self.handled, [])
+        self.assertIsNone(self.cloud.early_transcript)
+        self.assertEqual(result, ('assistant heard', b'audio'))
+
+    def test_requests_share_the_audio_log(self):
+        request = self.make_request('what is the weather')
+        request.set_audio_logging_enabled()
+
+        # Cloud Speech's request creates the log, in its audio format.
+        self.assertIsNotNone(self.cloud.audio_log)
+        self.assertIs(self.assistant.audio_log, self.cloud.audio_log)
+        request.set_audio_logging_enabled(False)
+        self.assertIsNone(self.assistant.audio_log)
+
+    def test_assistant_always_responds(self):
+        request = self.make_request('turn the light on', always_responds=True)
+        result, _ = self.run_request(request)
+
+        self.assertEqual(result, ('turn the light on', b'audio'))
+        self.assertFalse(self.assistant.cancelled)
+        self.assertEqual(self.streams, ['assistant heard'])
+
+
+if __name__ == '__main__':
+    unittest.main()
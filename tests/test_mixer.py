@@ -0,0 +1,105 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Test mixing multichannel audio down to mono.'''
+
+import io
+import unittest
+
+import numpy as np
+
+import aiy._drivers._mixer as mixer
+import aiy._drivers._recorder
+
+CHUNK_FRAMES = 1600
+
+
+def interleave(*channels):
+    return np.stack(channels, axis=1).astype(np.int16)
+
+
+def mix_chunks(channel_mixer, samples):
+    out = [channel_mixer.mix(samples[i:i + CHUNK_FRAMES].tobytes())
+           for i in range(0, len(samples), CHUNK_FRAMES)]
+    return np.frombuffer(b''.join(out), dtype=np.int16)
+
+
+class TestChannelMixer(unittest.TestCase):
+
+    def setUp(self):
+        self.speech = np.random.RandomState(0).normal(0, 3000, CHUNK_FRAMES * 10 + 16)
+
+    def test_average(self):
+        samples = interleave([100, 5, -7], [-3, 6, -8])
+        mono = mix_chunks(mixer.ChannelMixer(2, mixer.AVERAGE), samples)
+        self.assertEqual(mono.tolist(), [48, 5, -8])
+
+    def test_best_channel_picks_loudest(self):
+        quiet = self.speech[:CHUNK_FRAMES] / 10
+        loud = self.speech[:CHUNK_FRAMES]
+        samples = interleave(quiet, loud)
+        mono = mix_chunks(mixer.ChannelMixer(2, mixer.BEST_CHANNEL), samples)
+        self.assertTrue(np.array_equal(mono, samples[:, 1]))
+
+    def test_best_channel_hysteresis(self):
+        channel_mixer = mixer.ChannelMixer(2, mixer.BEST_CHANNEL)
+        samples = interleave(self.speech[:CHUNK_FRAMES], self.speech[:CHUNK_FRAMES] * 1.1)
+        mix_chunks(channel_mixer, samples)
+        self.assertEqual(channel_mixer._best_channel, 0)
+
+    def test_beamform_estimates_delay(self):
+        length = CHUNK_FRAMES * 10
+        left = self.speech[5:5 + length]
+        right = self.speech[2:2 + length]  # right[t] = left[t - 3]
+        channel_mixer = mixer.ChannelMixer(2, mixer.BEAMFORM, max_delay=4)
+        mono = mix_chunks(channel_mixer, interleave(left, right))
+
+        self.assertEqual(channel_mixer.delays.tolist(), [0, 3])
+        # Aligned channels add up to the left channel, delayed by max_delay.
+        expected = np.concatenate((np.zeros(4), left[:-4]))
+        self.assertGreater(np.corrcoef(mono[CHUNK_FRAMES:], expected[CHUNK_FRAMES:])[0, 1], 0.999)
+
+    def test_beamform_ignores_quiet_chunks(self):
+        channel_mixer = mixer.ChannelMixer(2, mixer.BEAMFORM)
+        noise = self.speech[:CHUNK_FRAMES] / 1000
+        mix_chunks(channel_mixer, interleave(noise, np.roll(noise, 2)))
+        self.assertEqual(channel_mixer.delays.tolist(), [0, 0])
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            mixer.ChannelMixer(2, 'loudest')
+
+
+class TestRecorderMixing(unittest.TestCase):
+
+    def test_processors_receive_mono(self):
+        recorder = aiy._drivers._recorder.Recorder(channels=2, mix_mode=mixer.AVERAGE)
+        samples = interleave(np.arange(CHUNK_FRAMES * 2), np.arange(CHUNK_FRAMES * 2) + 2)
+        chunks = []
+
+        class Processor(object):
+            keeps_data = True
+
+            def add_data(self, data):
+                chunks.append(data)
+
+        recorder.add_processor(Processor())
+        recorder._capture(io.BytesIO(samples.tobytes()))
+
+        mono = np.frombuffer(b''.join(chunks), dtype=np.int16)
+        self.assertEqual(mono.tolist(), list(range(1, CHUNK_FRAMES * 2 + 1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Test deduplicating and trimming phrase hints.'''
+
+import unittest
+
+from aiy._apis._phrases import PhraseSet
+
+
+class TestPhraseSet(unittest.TestCase):
+
+    def test_duplicates(self):
+        phrases = PhraseSet()
+        for phrase in ('light on', 'Light  On', ' light on', 'light off', ''):
+            phrases.add(phrase)
+        self.assertEqual(phrases.get(), ['light on', 'light off'])
+        self.assertEqual(len(phrases), 2)
+
+    def test_cached_until_changed(self):
+        phrases = PhraseSet()
+        phrases.add('light on')
+        version = phrases.version
+        first = phrases.get()
+        phrases.add('light on')
+        self.assertIs(phrases.get(), first)
+        self.assertEqual(phrases.version, version)
+
+        phrases.add('light off')
+        self.assertEqual(phrases.get(), ['light on', 'light off'])
+        self.assertNotEqual(phrases.version, version)
+
+    def test_priority_order(self):
+        phrases = PhraseSet()
+        phrases.add('a')
+        phrases.add('b', priority=1)
+        phrases.add('c')
+        phrases.add('c', priority=2)
+        self.assertEqual(phrases.get(), ['c', 'b', 'a'])
+
+    def test_phrase_limit(self):
+        phrases = PhraseSet(max_phrases=2)
+        for phrase in ('a', 'b', 'c'):
+            phrases.add(phrase)
+        phrases.add('d', priority=1)
+        with self.assertLogs('speech', 'WARNING'):
+            self.assertEqual(phrases.get(), ['d', 'a'])
+
+    def test_character_limits(self):
+        phrases = PhraseSet(max_phrase_chars=5, max_total_chars=8)
+        for phrase in ('toolong', 'abcd', 'efgh', 'ijkl', 'mn'):
+            phrases.add(phrase)
+        with self.assertLogs('speech', 'WARNING'):
+            # Shorter phrases still fit after a longer one doesn't.
+            self.assertEqual(phrases.get(), ['abcd', 'efgh'])
+        phrases = PhraseSet(max_phrase_chars=5, max_total_chars=10)
+        for phrase in ('abcd', 'efgh', 'ijkl', 'mn'):
+            phrases.add(phrase)
+        with self.assertLogs('speech', 'WARNING'):
+            self.assertEqual(phrases.get(), ['abcd', 'efgh', 'mn'])
+
+
+if __name__ == '__main__':
+    unittest.main()
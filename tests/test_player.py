@@ -0,0 +1,143 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Test streaming playback with a stand-in for aplay.'''
+
+import time
+import unittest
+from unittest import mock
+
+import aiy._drivers._player
+
+RATE = 16000
+CHUNK = b'\1\0' * 1600  # 100 ms
+
+
+class FakeAplay(object):
+
+    """Records what is written to aplay, and when. Each write takes
+    write_s, like a pipe that is full while earlier audio plays.
+    """
+
+    write_s = 0
+
+    def __init__(self, cmd, stdin=None):
+        self.cmd = cmd
+        self.stdin = self
+        self.writes = []
+        self.closed = False
+        self.terminated = False
+        FakeAplay.instances.append(self)
+
+    def write(self, data):
+        time.sleep(self.write_s)
+        if data:
+            self.writes.append((time.monotonic(), data))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def terminate(self):
+        self.terminated = True
+
+    def wait(self):
+        return 0
+
+    @property
+    def data(self):
+        return b''.join(data for _, data in self.writes)
+
+
+class TestPlaybackStream(unittest.TestCase):
+
+    def setUp(self):
+        FakeAplay.instances = []
+        FakeAplay.write_s = 0
+        patcher = mock.patch('subprocess.Popen', FakeAplay)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.player = aiy._drivers._player.Player()
+
+    def test_starts_after_jitter_buffer(self):
+        stream = self.player.open_stream(RATE)
+        stream.write(CHUNK[:1000])
+        self.assertIsNone(stream.start_time)
+        stream.write(CHUNK)
+        self.assertIsNotNone(stream.start_time)
+        stream.close()
+
+        aplay, = FakeAplay.instances
+        self.assertEqual(aplay.data, CHUNK[:1000] + CHUNK)
+        self.assertTrue(aplay.closed)
+
+    def test_short_clip_plays_on_close(self):
+        self.player.play_bytes(b'\0\0' * 10, RATE)
+        self.assertEqual(FakeAplay.instances[0].data, b'\0\0' * 10)
+
+    def test_write_does_not_wait_for_playback(self):
+        FakeAplay.write_s = 0.05
+        stream = self.player.open_stream(RATE)
+        start = time.monotonic()
+        for _ in range(10):
+            stream.write(CHUNK)
+        self.assertLess(time.monotonic() - start, 0.05)
+        stream.close()
+        self.assertEqual(FakeAplay.instances[0].data, CHUNK * 10)
+
+    def test_plays_while_audio_arrives(self):
+        # Audio arriving over 0.5 s starts playing with the first chunk,
+        # rather than when all of it has arrived.
+        start = time.monotonic()
+        stream = self.player.open_stream(RATE)
+        for _ in range(5):
+            stream.write(CHUNK)
+            time.sleep(0.1)
+        stream.close()
+
+        first_write = FakeAplay.instances[0].writes[0][0] - start
+        self.assertLess(first_write, 0.1)
+
+    def test_stop_drops_queued_audio(self):
+        FakeAplay.write_s = 0.05
+        stream = self.player.open_stream(RATE)
+        for _ in range(10):
+            stream.write(CHUNK)
+        start = time.monotonic()
+        stream.stop()
+        stream.write(CHUNK)
+
+        self.assertLess(time.monotonic() - start, 0.2)
+        aplay, = FakeAplay.instances
+        self.assertTrue(aplay.terminated)
+        self.assertLess(len(aplay.data), len(CHUNK) * 10)
+
+    def test_converts_to_output_format(self):
+        player = aiy._drivers._player.Player(output_rate_hz=48000, output_channels=2)
+        stream = player.open_stream(RATE)
+        for _ in range(3):
+            stream.write(CHUNK)
+        stream.close()
+
+        aplay, = FakeAplay.instances
+        self.assertEqual(aplay.cmd[aplay.cmd.index('-r') + 1], '48000')
+        self.assertEqual(aplay.cmd[aplay.cmd.index('-c') + 1], '2')
+        # Three times the rate, twice the channels, plus the filter's tail.
+        self.assertAlmostEqual(len(aplay.data), len(CHUNK) * 3 * 3 * 2, delta=1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
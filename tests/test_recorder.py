@@ -0,0 +1,673 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Test the audio recorder driver.'''
+
+import io
+import threading
+import time
+import unittest
+from unittest import mock
+
+import aiy._drivers._capture
+import aiy._drivers._recorder
+
+
+class ViewProcessor(object):
+
+    def __init__(self):
+        self.chunks = []
+
+    def add_data(self, data):
+        self.chunks.append(data)
+
+
+class CopyProcessor(ViewProcessor):
+
+    keeps_data = True
+
+
+class FailingProcessor(ViewProcessor):
+
+    """Fails on its second chunk."""
+
+    def add_data(self, data):
+        if self.chunks:
+            raise RuntimeError('processor failed')
+        super().add_data(data)
+
+
+def make_audio(num_bytes):
+    return bytes(i % 251 for i in range(num_bytes))
+
+
+class TestRecorderCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.recorder = aiy._drivers._recorder.Recorder()
+        self.chunk_bytes = self.recorder._chunk_bytes
+
+    def test_chunks_are_views_into_ring(self):
+        processor = ViewProcessor()
+        self.recorder.add_processor(processor)
+        self.recorder._capture(io.BytesIO(make_audio(self.chunk_bytes * 2)))
+
+        self.assertEqual(len(processor.chunks), 2)
+        for chunk in processor.chunks:
+            self.assertIsInstance(chunk, memoryview)
+            self.assertIs(chunk.obj, self.recorder._ring)
+
+    def test_keeps_data_gets_copies(self):
+        audio = make_audio(self.chunk_bytes * (self.recorder.RING_CHUNKS + 1))
+        processor = CopyProcessor()
+        self.recorder.add_processor(processor)
+        self.recorder._capture(io.BytesIO(audio))
+
+        self.assertEqual(b''.join(processor.chunks), audio)
+        for chunk in processor.chunks:
+            self.assertIsInstance(chunk, bytes)
+
+    def test_partial_reads_are_assembled(self):
+        audio = make_audio(self.chunk_bytes * 2)
+
+        class TrickleStream(io.BytesIO):
+            def readinto(self, b):
+                return super().readinto(b[:123])
+
+        processor = CopyProcessor()
+        self.recorder.add_processor(processor)
+        self.recorder._capture(TrickleStream(audio))
+
+        self.assertEqual(processor.chunks, [audio[:self.chunk_bytes], audio[self.chunk_bytes:]])
+
+    def test_trailing_partial_chunk_is_dropped(self):
+        processor = CopyProcessor()
+        self.recorder.add_processor(processor)
+        self.recorder._capture(io.BytesIO(make_audio(self.chunk_bytes + 10)))
+
+        self.assertEqual(len(processor.chunks), 1)
+
+    def test_capture_from_generator_backend(self):
+        audio = make_audio(self.chunk_bytes * 3)
+        backend = aiy._drivers._capture.FileBackend(
+            audio[i:i + 1000] for i in range(0, len(audio), 1000))
+        backend.open()
+        processor = CopyProcessor()
+        self.recorder.add_processor(processor)
+        self.recorder._capture(backend)
+
+        self.assertEqual(b''.join(processor.chunks), audio)
+
+    def test_failing_processor_is_removed(self):
+        failing = FailingProcessor()
+        processor = CopyProcessor()
+        self.recorder.add_processor(failing)
+        self.recorder.add_processor(processor)
+        audio = make_audio(self.chunk_bytes * 3)
+        with self.assertLogs('recorder', 'ERROR'):
+            self.recorder._capture(io.BytesIO(audio))
+
+        self.assertEqual(b''.join(processor.chunks), audio)
+        self.assertEqual(len(failing.chunks), 1)
+        self.assertIsNone(self.recorder._find_subscription(failing))
+
+    def test_chunk_duration(self):
+        recorder = aiy._drivers._recorder.Recorder(chunk_s=0.02)
+        self.assertEqual(recorder._chunk_bytes, 640)
+
+
+class TestRecorderPreroll(unittest.TestCase):
+
+    def setUp(self):
+        self.recorder = aiy._drivers._recorder.Recorder(preroll_s=0.25)
+        self.chunk_bytes = self.recorder._chunk_bytes
+        self.audio = make_audio(self.chunk_bytes * 8)
+
+    def chunk(self, index):
+        return self.audio[index * self.chunk_bytes:(index + 1) * self.chunk_bytes]
+
+    def test_preroll_rounds_up_to_chunks(self):
+        self.assertEqual(self.recorder._preroll_chunks, 3)
+        self.assertEqual(len(self.recorder._slots), self.recorder.RING_CHUNKS + 3)
+
+    def test_preroll_replayed_before_live_chunks(self):
+        late = CopyProcessor()
+
+        class Trigger(ViewProcessor):
+            def add_data(trigger, data):
+                super().add_data(data)
+                if len(trigger.chunks) == 5:
+                    self.recorder.add_processor(late, preroll=True)
+
+        self.recorder.add_processor(Trigger())
+        self.recorder._capture(io.BytesIO(self.audio))
+
+        # Added after chunk 4: replay chunks 2-4, then live from chunk 5.
+        self.assertEqual(late.chunks, [self.chunk(i) for i in range(2, 8)])
+
+    def test_preroll_limited_to_captured_audio(self):
+        processor = CopyProcessor()
+        self.recorder.add_processor(processor, preroll=True)
+        self.recorder._capture(io.BytesIO(self.audio))
+
+        self.assertEqual(b''.join(processor.chunks), self.audio)
+
+    def test_without_preroll_starts_live(self):
+        late = CopyProcessor()
+
+        class Trigger(ViewProcessor):
+            def add_data(trigger, data):
+                super().add_data(data)
+                if len(trigger.chunks) == 5:
+                    self.recorder.add_processor(late)
+
+        self.recorder.add_processor(Trigger())
+        self.recorder._capture(io.BytesIO(self.audio))
+
+        # Processors added during delivery see the next chunk.
+        self.assertEqual(late.chunks, [self.chunk(i) for i in range(5, 8)])
+
+    def test_remove_pending_processor(self):
+        processor = CopyProcessor()
+        self.recorder.add_processor(processor, preroll=True)
+        self.recorder.remove_processor(processor)
+        self.recorder._capture(io.BytesIO(self.audio))
+
+        self.assertEqual(processor.chunks, [])
+
+
+class FrameProcessor(CopyProcessor):
+
+    def __init__(self, frame_s, frame_overlap_s=None):
+        super().__init__()
+        self.frame_s = frame_s
+        self.frame_overlap_s = frame_overlap_s
+
+
+class TestRecorderFraming(unittest.TestCase):
+
+    def setUp(self):
+        self.recorder = aiy._drivers._recorder.Recorder()
+        self.audio = make_audio(self.recorder._chunk_bytes * 10)
+
+    def capture(self, *processors):
+        for processor in processors:
+            self.recorder.add_processor(processor)
+        self.recorder._capture(io.BytesIO(self.audio))
+
+    def expected_frames(self, frame_bytes, hop_bytes):
+        return [self.audio[i:i + frame_bytes]
+                for i in range(0, len(self.audio) - frame_bytes + 1, hop_bytes)]
+
+    def test_short_frames_are_views(self):
+        processor = ViewProcessor()
+        processor.frame_s = 0.02
+        frames = []
+        processor.add_data = lambda data: frames.append(bytes(data))
+        self.recorder.add_processor(processor)
+        self.recorder._capture(io.BytesIO(self.audio))
+
+        self.assertEqual(frames, self.expected_frames(640, 640))
+
+    def test_long_overlapping_frames(self):
+        processor = FrameProcessor(0.25, 0.05)
+        self.capture(processor)
+
+        self.assertEqual(processor.chunks, self.expected_frames(8000, 6400))
+
+    def test_mixed_frame_sizes(self):
+        short = FrameProcessor(0.01)
+        chunked = CopyProcessor()
+        odd = FrameProcessor(0.13)
+        self.capture(short, chunked, odd)
+
+        self.assertEqual(short.chunks, self.expected_frames(320, 320))
+        self.assertEqual(chunked.chunks, self.expected_frames(3200, 3200))
+        self.assertEqual(odd.chunks, self.expected_frames(4160, 4160))
+
+    def test_frame_longer_than_ring_rejected(self):
+        with self.assertRaises(ValueError):
+            self.recorder.add_processor(FrameProcessor(0.35))
+
+    def test_overlap_longer_than_frame_rejected(self):
+        with self.assertRaises(ValueError):
+            self.recorder.add_processor(FrameProcessor(0.1, 0.1))
+
+    def test_latency_is_measured(self):
+        processor = FrameProcessor(0.02)
+        self.capture(processor)
+
+        latency = self.recorder.get_latency(processor)
+        self.assertEqual(latency.count, 50)
+        # The first frame of each chunk waits for the rest of the chunk.
+        self.assertGreaterEqual(latency.max_s, 0.08)
+
+
+class TimedProcessor(CopyProcessor):
+
+    def __init__(self):
+        super().__init__()
+        self.timestamps = []
+        self.discontinuities = []
+
+    def add_timed_data(self, data, timestamp):
+        self.add_data(data)
+        self.timestamps.append(timestamp)
+
+    def add_discontinuity(self, discontinuity):
+        self.discontinuities.append(discontinuity)
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ClockedStream(io.BytesIO):
+
+    """A stream whose chunks take real time to arrive on a fake clock.
+
+    Like a capture backend, it can say how much audio it buffers and report
+    overruns before some chunks.
+    """
+
+    def __init__(self, data, clock, chunk_bytes, delays, buffer_s=None, overrun_chunks=()):
+        super().__init__(data)
+        self.clock = clock
+        self.chunk_bytes = chunk_bytes
+        self.delays = delays
+        self.buffer_s = buffer_s
+        self.overrun_chunks = overrun_chunks
+        self.overruns = 0
+
+    def readinto(self, b):
+        chunk = self.tell() // self.chunk_bytes
+        self.clock.now += self.delays.get(chunk, 0.0) + len(b) / 32000
+        if chunk in self.overrun_chunks:
+            self.overruns += 1
+        return super().readinto(b)
+
+
+class TestRecorderTiming(unittest.TestCase):
+
+    def setUp(self):
+        self.recorder = aiy._drivers._recorder.Recorder()
+        self.chunk_bytes = self.recorder._chunk_bytes
+        self.clock = FakeClock()
+
+    def capture(self, processor, chunks, delays=None, **kwargs):
+        if processor:
+            self.recorder.add_processor(processor)
+        stream = ClockedStream(make_audio(self.chunk_bytes * chunks), self.clock,
+                               self.chunk_bytes, delays or {}, **kwargs)
+        with mock.patch('time.monotonic', self.clock):
+            self.recorder._capture(stream)
+
+    def test_timestamps(self):
+        processor = TimedProcessor()
+        processor.frame_s = 0.05
+        self.capture(processor, 3)
+
+        self.assertEqual([t.sample_index for t in processor.timestamps],
+                         [800 * i for i in range(6)])
+        self.assertAlmostEqual(processor.timestamps[0].capture_time, 1000.0)
+        self.assertAlmostEqual(processor.timestamps[5].capture_time, 1000.25)
+
+    def test_plain_processors_get_data_only(self):
+        processor = CopyProcessor()
+        self.capture(processor, 2)
+        self.assertEqual(len(processor.chunks), 2)
+
+    def test_skip_audio(self):
+        processor = TimedProcessor()
+        self.recorder.add_processor(processor)
+        # Chunk i is captured from 1000.0 + 0.1 * i: leave out chunks 3 and 4.
+        self.recorder.skip_audio(processor, 1000.33, 1000.47)
+        self.capture(None, 7)
+
+        self.assertEqual([t.sample_index // 1600 for t in processor.timestamps],
+                         [0, 1, 2, 5, 6])
+        self.assertEqual(processor.discontinuities, [])
+
+    def test_skip_audio_keeps_preroll(self):
+        self.recorder = aiy._drivers._recorder.Recorder(preroll_s=0.3)
+        late = TimedProcessor()
+        sound = []
+
+        class Trigger(ViewProcessor):
+            def add_data(trigger, data):
+                super().add_data(data)
+                if len(trigger.chunks) == 5:
+                    # A sound starts playing just after the processor is added.
+                    self.recorder.add_processor(late, preroll=True)
+                    sound.append(self.clock.now + 0.01)
+                    self.recorder.skip_audio(late, sound[0])
+                elif len(trigger.chunks) == 8:
+                    self.recorder.skip_audio(late, sound[0], self.clock.now)
+
+        self.capture(Trigger(), 10)
+
+        # Chunks 2-4 are the pre-roll, and 5-7 were captured while the sound
+        # played.
+        self.assertEqual([t.sample_index // 1600 for t in late.timestamps],
+                         [2, 3, 4, 8, 9])
+
+    def test_lost_audio_is_reported(self):
+        processor = TimedProcessor()
+        # Chunk 5 arrives a second late: the backend lost a second of audio.
+        self.capture(processor, 10, delays={5: 1.0})
+
+        stats = self.recorder.get_capture_stats()
+        self.assertEqual(stats.overruns, 1)
+        # The estimate allows for the sample clock drifting.
+        self.assertAlmostEqual(stats.missing_samples, 16000, delta=20)
+        self.assertEqual(processor.discontinuities,
+                         [aiy._drivers._recorder.Discontinuity(stats.missing_samples, 0, 0.0)])
+        self.assertEqual(processor.timestamps[4].sample_index, 4 * 1600)
+        self.assertEqual(processor.timestamps[5].sample_index,
+                         5 * 1600 + stats.missing_samples)
+
+    def test_jitter_is_not_lost_audio(self):
+        processor = TimedProcessor()
+        # A late read is caught up by the next ones, as the samples were
+        # buffered by the backend.
+        self.capture(processor, 10, delays={3: 0.3, 4: -0.15, 5: -0.15})
+
+        stats = self.recorder.get_capture_stats()
+        self.assertEqual(stats.overruns, 0)
+        self.assertAlmostEqual(stats.read_latency.max_s, 0.3, places=2)
+
+    def test_late_read_within_buffer_is_not_lost_audio(self):
+        processor = TimedProcessor()
+        # Chunk 5 is read a second late, eg behind a slow processor. The
+        # backend buffered the audio, so the next ten reads catch up at once.
+        delays = {5: 1.0}
+        delays.update((chunk, -0.1) for chunk in range(6, 16))
+        self.capture(processor, 20, delays, buffer_s=2.0)
+
+        stats = self.recorder.get_capture_stats()
+        self.assertEqual(stats.overruns, 0)
+        self.assertEqual(stats.missing_samples, 0)
+        self.assertEqual(processor.discontinuities, [])
+        self.assertEqual([t.sample_index for t in processor.timestamps],
+                         [1600 * i for i in range(20)])
+
+    def test_lag_beyond_buffer_is_lost_audio(self):
+        processor = TimedProcessor()
+        self.capture(processor, 10, {5: 3.0}, buffer_s=2.0)
+
+        stats = self.recorder.get_capture_stats()
+        self.assertEqual(stats.overruns, 1)
+        # The estimate allows for the sample clock drifting.
+        self.assertAlmostEqual(stats.missing_samples, 48000, delta=60)
+
+    def test_overrun_reported_by_backend(self):
+        processor = TimedProcessor()
+        # Shorter than the gap threshold, but the backend says it lost it.
+        self.capture(processor, 10, {5: 0.2}, buffer_s=2.0, overrun_chunks={5})
+
+        stats = self.recorder.get_capture_stats()
+        self.assertEqual(stats.overruns, 1)
+        self.assertAlmostEqual(stats.missing_samples, 3200, delta=20)
+        self.assertEqual(processor.timestamps[5].sample_index, 5 * 1600 + stats.missing_samples)
+
+    def test_lasting_lag_moves_the_floor(self):
+        processor = TimedProcessor()
+        # The reads never catch up, though the backend didn't report losing
+        # anything: after the length of its buffer, the new lag is normal.
+        self.capture(processor, 40, {5: 1.0}, buffer_s=2.0)
+
+        stats = self.recorder.get_capture_stats()
+        self.assertEqual(stats.overruns, 0)
+        self.assertEqual(processor.discontinuities, [])
+        self.assertAlmostEqual(self.recorder._clock._floor, 1.0, delta=0.01)
+        self.assertIsNone(self.recorder._clock._late_since)
+
+    def test_drift(self):
+        stats = aiy._drivers._recorder.CaptureStats()
+        clock = aiy._drivers._recorder._SampleClock(16000, stats)
+        # The sample clock runs 100 ppm slow: 1600 samples every 100.01 ms.
+        for chunk in range(300):
+            clock.update(chunk * 0.10001, 1600)
+        self.assertAlmostEqual(stats.drift_ppm, -100, delta=1)
+        self.assertEqual(stats.overruns, 0)
+
+
+class DyingBackend(object):
+
+    """A capture backend that dies after each of the given sessions."""
+
+    def __init__(self, sessions):
+        self.sessions = list(sessions)
+        self.opened = 0
+        self.stopped = threading.Event()
+        self._data = None
+
+    def open(self):
+        self.opened += 1
+        self._data = io.BytesIO(self.sessions.pop(0)) if self.sessions else None
+
+    def readinto(self, buf):
+        if self._data:
+            return self._data.readinto(buf)
+        # Out of sessions: block like a healthy microphone until stopped.
+        self.stopped.wait()
+        return 0
+
+    def stop(self):
+        self.stopped.set()
+
+    def close(self):
+        pass
+
+
+class GapProcessor(CopyProcessor):
+
+    def __init__(self):
+        super().__init__()
+        self.discontinuities = []
+
+    def add_discontinuity(self, discontinuity):
+        self.discontinuities.append((len(self.chunks), discontinuity))
+
+
+class TestRecorderSupervisor(unittest.TestCase):
+
+    def make_recorder(self, sessions, **kwargs):
+        self.backend = DyingBackend(sessions)
+        recorder = aiy._drivers._recorder.Recorder(backend=self.backend, **kwargs)
+        recorder.RESTART_DELAY_S = 0.001
+        return recorder
+
+    def test_restarts_in_place_and_reports_gap(self):
+        chunk_bytes = 3200
+        audio = make_audio(chunk_bytes * 5)
+        # The partial chunk at the end of the first session is lost.
+        recorder = self.make_recorder([
+            audio[:chunk_bytes * 2 + 100],
+            audio[chunk_bytes * 2:chunk_bytes * 4],
+            audio[chunk_bytes * 4:],
+            b''])
+        processor = GapProcessor()
+        recorder.add_processor(processor)
+
+        with recorder:
+            while self.backend.opened < 4:
+                time.sleep(0.01)
+            time.sleep(0.01)
+        recorder.join()
+
+        self.assertEqual(b''.join(processor.chunks), audio)
+        self.assertEqual([index for index, _ in processor.discontinuities], [2, 4])
+        self.assertEqual(processor.discontinuities[1][1].restart_count, 2)
+        stats = recorder.get_capture_stats()
+        self.assertEqual(stats.restarts, 2)
+        self.assertGreater(stats.restart_time_s, 0)
+
+    def test_backoff_doubles(self):
+        recorder = self.make_recorder([])
+        delays = [recorder._get_restart_delay(100.0) for _ in range(3)]
+        self.assertEqual(delays, [0.001, 0.002, 0.004])
+
+    def test_failures_outside_window_are_forgotten(self):
+        recorder = self.make_recorder([], max_restarts=1, restart_window_s=10)
+        self.assertIsNotNone(recorder._get_restart_delay(100.0))
+        self.assertIsNone(recorder._get_restart_delay(105.0))
+        self.assertIsNotNone(recorder._get_restart_delay(111.0))
+
+    @mock.patch('os._exit')
+    def test_exits_when_failure_budget_is_spent(self, mock_exit):
+        recorder = self.make_recorder([b'', b'', b''], max_restarts=2)
+        recorder.start()
+        recorder.join(5)
+
+        mock_exit.assert_called_once_with(1)
+        self.assertEqual(self.backend.opened, 3)
+
+
+class TestCaptureBackends(unittest.TestCase):
+
+    def test_file_backend_reads_file_object(self):
+        backend = aiy._drivers._capture.FileBackend(io.BytesIO(b'abcdef'))
+        backend.open()
+        buf = bytearray(4)
+        self.assertEqual(backend.readinto(memoryview(buf)), 4)
+        self.assertEqual(buf, b'abcd')
+        self.assertEqual(backend.readinto(memoryview(buf)[:2]), 2)
+        self.assertEqual(backend.readinto(memoryview(buf)), 0)
+
+    def test_file_backend_stop(self):
+        backend = aiy._drivers._capture.FileBackend([b'abcdef'])
+        backend.open()
+        backend.stop()
+        self.assertEqual(backend.readinto(bytearray(4)), 0)
+
+    def test_arecord_period_and_buffer_size(self):
+        backend = aiy._drivers._capture.ArecordBackend(
+            'hw:0', channels=2, period_frames=160, buffer_frames=640)
+        self.assertEqual(backend._cmd, [
+            'arecord', '-q', '-t', 'raw', '-D', 'hw:0', '-c', '2', '-f', 's16', '-r', '16000',
+            '--period-size=160', '--buffer-size=640'])
+
+    def test_alsa_backend_rejects_unknown_format(self):
+        with self.assertRaises(ValueError):
+            aiy._drivers._capture.AlsaBackend(bytes_per_sample=3)
+
+
+class BlockedProcessor(ViewProcessor):
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def add_data(self, data):
+        self.release.wait()
+        super().add_data(data)
+
+
+class TestRecorderFanout(unittest.TestCase):
+
+    def setUp(self):
+        self.recorder = aiy._drivers._recorder.Recorder(fanout=True, queue_chunks=2)
+        self.chunk_bytes = self.recorder._chunk_bytes
+
+    def tearDown(self):
+        self.recorder.__exit__()
+
+    def capture_chunks(self, count):
+        audio = make_audio(self.chunk_bytes * count)
+        self.recorder._capture(io.BytesIO(audio))
+        return [audio[i * self.chunk_bytes:(i + 1) * self.chunk_bytes] for i in range(count)]
+
+    def wait_for_chunks(self, worker_processor, count):
+        worker = self.recorder._find_subscription(worker_processor).worker
+        while len(worker_processor.chunks) < count and worker.is_alive():
+            worker.join(0.01)
+
+    def test_all_chunks_delivered_as_bytes(self):
+        processor = ViewProcessor()
+        self.recorder.add_processor(processor, queue_chunks=10)
+        chunks = self.capture_chunks(5)
+        self.wait_for_chunks(processor, 5)
+
+        self.assertEqual(processor.chunks, chunks)
+        self.assertEqual(self.recorder.get_dropped_chunks(processor), 0)
+
+    def drop_with_policy(self, overflow):
+        processor = BlockedProcessor()
+        self.recorder.add_processor(processor, overflow=overflow)
+        # The worker takes the first chunk and blocks, two more fit in the
+        # queue and the last two overflow.
+        worker = self.recorder._find_subscription(processor).worker
+        worker.put(b'first', aiy._drivers._recorder.Timestamp(0, time.monotonic()))
+        while not worker._queue.empty():
+            worker.join(0.01)
+        chunks = self.capture_chunks(4)
+        processor.release.set()
+        self.wait_for_chunks(processor, 3)
+
+        self.assertEqual(self.recorder.get_dropped_chunks(processor), 2)
+        return processor.chunks[1:], chunks
+
+    def test_drop_oldest(self):
+        delivered, chunks = self.drop_with_policy(aiy._drivers._recorder.DROP_OLDEST)
+        self.assertEqual(delivered, chunks[2:])
+
+    def test_drop_newest(self):
+        delivered, chunks = self.drop_with_policy(aiy._drivers._recorder.DROP_NEWEST)
+        self.assertEqual(delivered, chunks[:2])
+
+    def test_slow_processor_does_not_stall_others(self):
+        slow = BlockedProcessor()
+        fast = ViewProcessor()
+        self.recorder.add_processor(slow)
+        self.recorder.add_processor(fast, queue_chunks=10)
+        chunks = self.capture_chunks(6)
+        self.wait_for_chunks(fast, 6)
+
+        self.assertEqual(fast.chunks, chunks)
+        self.assertGreater(self.recorder.get_dropped_chunks(slow), 0)
+        slow.release.set()
+
+    def test_failing_processor_does_not_block_capture(self):
+        failing = FailingProcessor()
+        processor = ViewProcessor()
+        self.recorder.add_processor(failing, overflow=aiy._drivers._recorder.BLOCK)
+        self.recorder.add_processor(processor, queue_chunks=10)
+        worker = self.recorder._find_subscription(failing).worker
+        with self.assertLogs('recorder', 'ERROR'):
+            chunks = self.capture_chunks(8)
+            self.wait_for_chunks(processor, 8)
+
+        self.assertEqual(processor.chunks, chunks)
+        self.assertTrue(worker.failed)
+        self.assertIsNone(self.recorder._find_subscription(failing))
+
+    def test_remove_processor_stops_worker(self):
+        processor = ViewProcessor()
+        self.recorder.add_processor(processor)
+        worker = self.recorder._find_subscription(processor).worker
+        self.recorder.remove_processor(processor)
+        worker.join(1)
+
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(self.recorder._subscriptions, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Test sample rate and format conversion.'''
+
+import io
+import unittest
+
+import numpy as np
+
+import aiy._drivers._recorder
+import aiy._drivers._resample as resample
+
+
+def sine(frequency, rate, seconds=1.0, amplitude=10000.0):
+    return amplitude * np.sin(2 * np.pi * frequency * np.arange(int(rate * seconds)) / rate)
+
+
+def snr_db(samples, frequency, rate):
+    """Fits a sine of the given frequency and returns signal to residual ratio."""
+    t = np.arange(len(samples)) / rate
+    basis = np.stack((np.sin(2 * np.pi * frequency * t), np.cos(2 * np.pi * frequency * t)), 1)
+    coefficients = np.linalg.lstsq(basis, samples, rcond=None)[0]
+    fitted = basis.dot(coefficients)
+    return 10 * np.log10(np.var(fitted) / np.var(samples - fitted))
+
+
+def process_in_chunks(resampler, samples, chunk):
+    return np.concatenate([resampler.process(samples[i:i + chunk])
+                           for i in range(0, len(samples), chunk)])
+
+
+class TestResampler(unittest.TestCase):
+
+    # Skip the filter's start-up transient when measuring.
+    SETTLE = 100
+
+    def assertAccurate(self, from_rate, to_rate, frequency):
+        resampler = resample.Resampler(from_rate, to_rate)
+        output = process_in_chunks(resampler, sine(frequency, from_rate), 1000)
+
+        self.assertEqual(len(output), to_rate)
+        self.assertGreater(snr_db(output[self.SETTLE:], frequency, to_rate), 80)
+
+    def test_48k_to_16k(self):
+        self.assertAccurate(48000, 16000, 1000)
+
+    def test_16k_to_48k(self):
+        self.assertAccurate(16000, 48000, 1000)
+
+    def test_24k_to_16k(self):
+        self.assertAccurate(24000, 16000, 3000)
+
+    def test_attenuates_above_nyquist(self):
+        # 10 kHz can't be represented at 16 kHz and must be filtered out.
+        output = resample.Resampler(48000, 16000).process(sine(10000, 48000))
+        level_db = 20 * np.log10(np.std(output[self.SETTLE:]) / np.std(sine(10000, 48000)))
+        self.assertLess(level_db, -60)
+
+    def test_chunking_does_not_change_output(self):
+        samples = np.random.RandomState(0).normal(0, 3000, 48000)
+        whole = resample.Resampler(48000, 16000).process(samples)
+        for chunk in (1, 7, 480, 4801):
+            chunked = process_in_chunks(resample.Resampler(48000, 16000), samples, chunk)
+            self.assertTrue(np.allclose(whole, chunked, atol=1e-2), chunk)
+
+    def test_stereo(self):
+        resampler = resample.Resampler(16000, 48000, channels=2)
+        left, right = sine(500, 16000), sine(700, 16000)
+        output = resampler.process(np.stack((left, right), 1).reshape(-1)).reshape(-1, 2)
+
+        self.assertGreater(snr_db(output[self.SETTLE:, 0], 500, 48000), 80)
+        self.assertGreater(snr_db(output[self.SETTLE:, 1], 700, 48000), 80)
+
+
+class TestFormatConverter(unittest.TestCase):
+
+    def test_s32_to_s16(self):
+        converter = resample.FormatConverter(16000, 16000, from_width=4, to_width=2)
+        data = np.array([65536 * 100, -65536 * 7, 2 ** 31 - 1], dtype=np.int32).tobytes()
+        self.assertEqual(np.frombuffer(converter.convert(data), np.int16).tolist(),
+                         [100, -7, 32767])
+
+    def test_s16_to_s32(self):
+        converter = resample.FormatConverter(16000, 16000, from_width=2, to_width=4)
+        data = np.array([100, -7], dtype=np.int16).tobytes()
+        self.assertEqual(np.frombuffer(converter.convert(data), np.int32).tolist(),
+                         [100 * 65536, -7 * 65536])
+
+    def test_stereo_to_mono(self):
+        converter = resample.FormatConverter(16000, 16000, from_channels=2, to_channels=1)
+        data = np.array([100, 200, -7, -9], dtype=np.int16).tobytes()
+        self.assertEqual(np.frombuffer(converter.convert(data), np.int16).tolist(), [150, -8])
+
+    def test_mono_to_stereo(self):
+        converter = resample.FormatConverter(16000, 16000, from_channels=1, to_channels=2)
+        data = np.array([100, -7], dtype=np.int16).tobytes()
+        self.assertEqual(np.frombuffer(converter.convert(data), np.int16).tolist(),
+                         [100, 100, -7, -7])
+
+    def test_flush_returns_delayed_samples(self):
+        converter = resample.FormatConverter(24000, 48000)
+        output = converter.convert(sine(1000, 24000).astype(np.int16).tobytes())
+        output += converter.flush()
+        self.assertGreaterEqual(len(output), 48000 * 2)
+
+    def test_unsupported_channels(self):
+        with self.assertRaises(ValueError):
+            resample.FormatConverter(16000, 16000, from_channels=2, to_channels=3)
+
+
+class TestRecorderNativeCapture(unittest.TestCase):
+
+    def test_48k_s32_capture(self):
+        recorder = aiy._drivers._recorder.Recorder(
+            capture_rate_hz=48000, capture_bytes_per_sample=4)
+        captured = (sine(440, 48000) * 65536).astype(np.int32)
+        chunks = []
+
+        class Processor(object):
+            keeps_data = True
+
+            def add_data(self, data):
+                chunks.append(data)
+
+        recorder.add_processor(Processor())
+        recorder._capture(io.BytesIO(captured.tobytes()))
+
+        self.assertEqual([len(chunk) for chunk in chunks], [3200] * 10)
+        output = np.frombuffer(b''.join(chunks), np.int16).astype(float)
+        self.assertGreater(snr_db(output[100:], 440, 16000), 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
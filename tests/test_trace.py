@@ -0,0 +1,130 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Test per-turn latency tracing.'''
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import timeit
+import unittest
+
+import aiy._apis._trace as trace
+
+
+class TestTrace(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        self.path = os.path.join(temp_dir, 'trace.jsonl')
+        trace.enable(self.path)
+        self.addCleanup(trace.disable)
+
+    def read_records(self):
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_records_first_time_of_each_stage(self):
+        trace.start_turn()
+        trace.mark(trace.FIRST_CHUNK)
+        time.sleep(0.05)
+        trace.mark(trace.FIRST_CHUNK)
+        trace.mark(trace.ENDPOINT)
+        trace.end_turn(transcript='hello')
+
+        record, = self.read_records()
+        self.assertEqual(record['transcript'], 'hello')
+        stages = record['stages']
+        self.assertEqual(stages['trigger'], 0)
+        self.assertLess(stages['first_chunk'], 0.04)
+        self.assertGreaterEqual(stages['endpoint'], 0.05)
+
+    def test_mark_at_given_time(self):
+        trace.start_turn()
+        start = time.monotonic()
+        time.sleep(0.05)
+        trace.mark(trace.ACTION_START, start)
+        trace.end_turn()
+        self.assertLess(self.read_records()[0]['stages']['action_start'], 0.04)
+
+    def test_playback_counts_after_endpoint(self):
+        trace.start_turn()
+        trace.mark(trace.FIRST_PLAYBACK)  # the trigger sound
+        trace.mark(trace.ENDPOINT)
+        time.sleep(0.05)
+        trace.mark(trace.FIRST_PLAYBACK)
+        trace.end_turn()
+        stages = self.read_records()[0]['stages']
+        self.assertGreaterEqual(stages['first_playback'], 0.05)
+
+    def test_marks_outside_a_turn_are_ignored(self):
+        trace.mark(trace.FIRST_CHUNK)
+        trace.end_turn()
+        trace.start_turn()
+        trace.end_turn()
+        trace.mark(trace.FIRST_CHUNK)
+        self.assertEqual(self.read_records()[0]['stages'], {'trigger': 0})
+
+    def test_overlapping_turns(self):
+        first = trace.start_turn()
+        trace.start_turn()
+        trace.mark(trace.FIRST_CHUNK)
+        trace.end_turn(first, transcript='first')
+        trace.end_turn(transcript='second')
+
+        records = self.read_records()
+        self.assertEqual([r['transcript'] for r in records], ['first', 'second'])
+        self.assertEqual(records[0]['stages'], {'trigger': 0})
+        self.assertIn('first_chunk', records[1]['stages'])
+
+    def test_late_marks_go_to_their_turn(self):
+        first = trace.start_turn()
+        trace.mark(trace.ENDPOINT, turn=first)
+        second = trace.start_turn()
+        # The first turn's command runs while the second one listens.
+        trace.mark(trace.ACTION_START, turn=first)
+        trace.mark(trace.FIRST_CHUNK, turn=second)
+        trace.end_turn(first)
+        trace.end_turn(second)
+
+        first_stages, second_stages = (r['stages'] for r in self.read_records())
+        self.assertEqual(set(first_stages), {'trigger', 'endpoint', 'action_start'})
+        self.assertEqual(set(second_stages), {'trigger', 'first_chunk'})
+
+    def test_disabled_is_cheap(self):
+        trace.disable()
+        trace.start_turn()
+        trace.end_turn()
+        self.assertEqual(self.read_records(), [])
+        # Well under a microsecond, so marks can stay in the audio path.
+        per_call_s = min(timeit.repeat(lambda: trace.mark(trace.FIRST_CHUNK),
+                                       number=10000, repeat=3)) / 10000
+        self.assertLess(per_call_s, 1e-6)
+
+    def test_summarize(self):
+        records = [{'stages': {'trigger': 0, 'endpoint': t, 'first_playback': t + 1}}
+                   for t in (1.0, 2.0, 3.0, 4.0)]
+        summary = trace.summarize(records, percentiles=(50, 99))
+        self.assertEqual(summary, [
+            ('trigger', 4, [0, 0], None),
+            ('endpoint', 4, [3.0, 4.0], [3.0, 4.0]),
+            ('first_playback', 4, [4.0, 5.0], [1.0, 1.0]),
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
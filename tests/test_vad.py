@@ -0,0 +1,219 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Test voice activity detection and local endpointing.'''
+
+import io
+import os
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import aiy._drivers._recorder
+import aiy._drivers._vad as vad
+
+RATE = 16000
+HELLO_PATH = os.path.realpath(os.path.join(__file__, '..', '..', 'checkpoints', 'test_hello.raw'))
+
+
+def noise(seconds, level_db, seed=0):
+    random = np.random.RandomState(seed)
+    return random.normal(0, 32768 * 10 ** (level_db / 20), int(seconds * RATE))
+
+
+def tone(seconds, level_db, frequency=1000):
+    t = np.arange(int(seconds * RATE)) / RATE
+    return 32768 * 10 ** (level_db / 20) * np.sqrt(2) * np.sin(2 * np.pi * frequency * t)
+
+
+def to_bytes(*parts):
+    return np.clip(np.concatenate(parts), -32768, 32767).astype('<i2').tobytes()
+
+
+def run(endpointer, data, chunk=3200):
+    """Feeds data in chunks, and returns the stream time at which the
+    endpointer fired, or None.
+    """
+    for start in range(0, len(data), chunk):
+        if endpointer.add_data(data[start:start + chunk]):
+            return (start + chunk) / (2 * RATE)
+    return None
+
+
+class TestVoiceActivityDetector(unittest.TestCase):
+
+    def test_noise_is_not_speech(self):
+        detector = vad.VoiceActivityDetector()
+        self.assertFalse(any(detector.process(to_bytes(noise(2, -50)))))
+
+    def test_loud_sound_is_speech(self):
+        detector = vad.VoiceActivityDetector()
+        frames = detector.process(to_bytes(noise(1, -50), tone(0.5, -20)))
+        self.assertFalse(any(frames[:100]))
+        self.assertTrue(all(frames[102:]))
+
+    def test_adapts_to_louder_room(self):
+        detector = vad.VoiceActivityDetector()
+        frames = detector.process(to_bytes(noise(1, -50), noise(10, -40, seed=1)))
+        # The new noise is speech at first, until the noise level catches up.
+        self.assertFalse(any(frames[-100:]))
+
+    def test_partial_frames_are_kept(self):
+        data = to_bytes(noise(0.5, -50), tone(0.5, -20))
+        whole = vad.VoiceActivityDetector().process(data)
+        detector = vad.VoiceActivityDetector()
+        pieces = []
+        for start in range(0, len(data), 334):
+            pieces.extend(detector.process(data[start:start + 334]))
+        self.assertEqual(pieces, whole)
+
+
+class TestEndpointer(unittest.TestCase):
+
+    def test_ends_after_hangover(self):
+        data = to_bytes(noise(0.5, -50), tone(1, -20), noise(2, -50, seed=1))
+        endpointer = vad.Endpointer(hangover_s=0.5)
+        ended = run(endpointer, data, chunk=320)
+
+        self.assertAlmostEqual(endpointer.speech_start_s, 0.5, delta=0.02)
+        self.assertAlmostEqual(endpointer.speech_end_s, 1.5, delta=0.02)
+        self.assertAlmostEqual(ended, 2.0, delta=0.02)
+
+    def test_pauses_shorter_than_hangover(self):
+        data = to_bytes(noise(0.5, -50), tone(0.5, -20), noise(0.3, -50, seed=1),
+                        tone(0.5, -20), noise(2, -50, seed=2))
+        endpointer = vad.Endpointer(hangover_s=0.5)
+        run(endpointer, data)
+        self.assertAlmostEqual(endpointer.speech_end_s, 1.8, delta=0.02)
+
+    def test_clicks_are_ignored(self):
+        data = to_bytes(noise(0.5, -50), tone(0.03, -10), noise(2, -50, seed=1))
+        endpointer = vad.Endpointer()
+        self.assertIsNone(run(endpointer, data))
+        self.assertIsNone(endpointer.speech_start_s)
+
+    def test_no_end_without_speech(self):
+        self.assertIsNone(run(vad.Endpointer(), to_bytes(noise(3, -50))))
+
+    def test_threshold(self):
+        # After pre-emphasis, the tone is about 7 dB above the noise.
+        data = to_bytes(noise(0.5, -50), tone(1, -32), noise(1, -50, seed=1))
+        self.assertIsNone(run(vad.Endpointer(threshold_db=10), data))
+        self.assertIsNotNone(run(vad.Endpointer(threshold_db=3), data))
+
+    def test_recorded_speech(self):
+        with open(HELLO_PATH, 'rb') as f:
+            data = f.read()
+        endpointer = vad.Endpointer()
+        ended = run(endpointer, data)
+
+        # "Hello" is spoken from about 0.95 s to 1.45 s.
+        self.assertAlmostEqual(endpointer.speech_start_s, 1.0, delta=0.1)
+        self.assertAlmostEqual(endpointer.speech_end_s, 1.4, delta=0.1)
+        self.assertLess(ended, 2.4)
+
+
+class TestSpeechGate(unittest.TestCase):
+
+    def setUp(self):
+        self.endpointer = vad.Endpointer()
+        self.gate = vad.SpeechGate(self.endpointer, lead_in_s=0.2)
+
+    def feed(self, data, chunk=3200):
+        released = []
+        for start in range(0, len(data), chunk):
+            self.endpointer.add_data(data[start:start + chunk])
+            released.append(self.gate.add_data(data[start:start + chunk]))
+        return released
+
+    def test_holds_silence(self):
+        released = self.feed(to_bytes(noise(3, -50)))
+        self.assertEqual(b''.join(released), b'')
+        self.assertFalse(self.gate.is_open)
+        # Only enough for a lead-in is kept.
+        self.assertGreater(self.gate.dropped_bytes, 2 * RATE * 2.5)
+
+    def test_releases_from_lead_in(self):
+        data = to_bytes(noise(1, -50), tone(1, -20), noise(1, -50, seed=1))
+        released = self.feed(data)
+
+        self.assertTrue(self.gate.is_open)
+        sent = b''.join(released)
+        # Everything from 0.2 s before the start of speech at 1 s.
+        self.assertEqual(sent, data[int(0.8 * RATE) * 2:])
+        first = next(i for i, chunk in enumerate(released) if chunk)
+        # Speech is found 100 ms in, in the chunk from 1.0 s to 1.1 s.
+        self.assertEqual(first, 10)
+
+    def test_speech_at_start(self):
+        data = to_bytes(tone(1, -20), noise(1, -50))
+        self.assertEqual(b''.join(self.feed(data)), data)
+
+
+class EndpointerProcessor(object):
+
+    def __init__(self):
+        self.endpointer = vad.Endpointer()
+        self.ended = False
+
+    def add_data(self, data):
+        self.ended = self.endpointer.add_data(data) or self.ended
+
+
+class TestTriggerSound(unittest.TestCase):
+
+    """The trigger sound plays after recording starts. It has to be left out of
+    the audio, or the endpointer ends the turn before the user speaks.
+    """
+
+    def capture(self, skip):
+        # The sound plays from 0.5 s to 0.8 s, and the user speaks from 2 s.
+        data = to_bytes(noise(0.5, -50), tone(0.3, -20), noise(1.2, -50, seed=1),
+                        tone(0.5, -20), noise(1, -50, seed=2))
+        recorder = aiy._drivers._recorder.Recorder()
+        processor = EndpointerProcessor()
+        recorder.add_processor(processor)
+        if skip:
+            recorder.skip_audio(processor, 1000.51, 1000.79)
+
+        now = [1000.0]
+        stream = io.BytesIO(data)
+        read = stream.readinto
+
+        def readinto(b):
+            now[0] += len(b) / (2 * RATE)
+            return read(b)
+
+        stream.readinto = readinto
+        with mock.patch('time.monotonic', lambda: now[0]):
+            recorder._capture(stream)
+        return processor
+
+    def test_sound_ends_the_turn(self):
+        processor = self.capture(skip=False)
+        self.assertTrue(processor.ended)
+        self.assertAlmostEqual(processor.endpointer.speech_start_s, 0.5, delta=0.02)
+        self.assertAlmostEqual(processor.endpointer.speech_end_s, 0.8, delta=0.02)
+
+    def test_skipped_sound_is_not_speech(self):
+        processor = self.capture(skip=True)
+        self.assertTrue(processor.ended)
+        # The stream is 0.3 s shorter without the sound.
+        self.assertAlmostEqual(processor.endpointer.speech_start_s, 1.7, delta=0.02)
+        self.assertAlmostEqual(processor.endpointer.speech_end_s, 2.2, delta=0.02)
+
+
+if __name__ == '__main__':
+    unittest.main()